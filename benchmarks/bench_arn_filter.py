@@ -0,0 +1,58 @@
+"""Benchmark the ARN filtering of the tagging handler.
+
+Times helpers.partition_arns against the list.remove loop that filter_resource_arns and ebs.tag_all_ebs_volumes
+used before, at 100k and 1M ARNs with 1% of them skipped and as many skip ARNs that were not discovered. The
+list.remove loop is quadratic and raises on unknown ARNs, so it only gets the discovered skip ARNs, and it is not
+run above LEGACY_MAX_ARNS unless --legacy is given.
+
+Usage:
+    python -m benchmarks.bench_arn_filter [--legacy] [sizes...]
+"""
+import sys
+import time
+
+from utils import helpers
+
+DEFAULT_SIZES = (100000, 1000000)
+SKIP_RATIO = 0.01
+LEGACY_MAX_ARNS = 100000
+
+
+def build_arns(size):
+    """Build the discovered ARNs, the discovered skip ARNs and the skip ARNs that were not discovered."""
+    arns = [f"arn:aws:rds:us-east-1:123456789012:db:database-{i}" for i in range(size)]
+    step = int(1 / SKIP_RATIO)
+    to_skip = arns[::step]
+    unknown = [f"arn:aws:ec2:us-east-1:123456789012:snapshot/snap-{i:017x}" for i in range(len(to_skip))]
+    return arns, to_skip, unknown
+
+
+def legacy_filter(arns, to_skip):
+    for arn in to_skip:
+        arns.remove(arn)
+    return arns
+
+
+def time_call(call):
+    start = time.perf_counter()
+    result = call()
+    return (time.perf_counter() - start) * 1000, result
+
+
+def main(sizes=DEFAULT_SIZES, legacy=False):
+    for size in sizes:
+        arns, to_skip, unknown = build_arns(size)
+        elapsed, partition = time_call(lambda: helpers.partition_arns(arns, to_skip + unknown))
+        print(f"{size} ARNs, {len(to_skip)} skipped, {len(unknown)} unknown")
+        print(f"  partition_arns       {elapsed:10.1f} ms  {partition.counts()}")
+        if legacy or size <= LEGACY_MAX_ARNS:
+            legacy_elapsed, _ = time_call(lambda: legacy_filter(list(arns), to_skip))
+            print(f"  list.remove loop     {legacy_elapsed:10.1f} ms  speed-up {legacy_elapsed / elapsed:.0f}x")
+        else:
+            print("  list.remove loop     skipped, use --legacy to run it")
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    run_legacy = '--legacy' in args
+    main([int(arg) for arg in args if arg != '--legacy'] or DEFAULT_SIZES, legacy=run_legacy)
@@ -0,0 +1,71 @@
+"""Benchmark the per-call latency of the pooled HTTP session against bare requests.request calls.
+
+Starts a keep-alive stub HTTP server on localhost and times GET calls made the way api_request.ApiRequests made them
+before (a new connection per call) and through utils.http_session. The stub is plain HTTP, so the numbers only
+show the TCP connection setup; against the HTTPS VPC endpoint every new connection also pays a TLS handshake.
+
+Usage:
+    python -m benchmarks.bench_http_session [calls]
+"""
+import sys
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+import requests
+
+from utils import http_session
+
+
+class StubServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are written separately; without this the kept-alive client waits on delayed ACKs.
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        body = b'{"credentials": {"AccessKeyId": "AKIAEXAMPLE"}}'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def time_calls(call, calls):
+    """Return the mean and p99 latency of the calls in milliseconds."""
+    latencies = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        call()
+        latencies.append((time.perf_counter() - start) * 1000)
+    latencies.sort()
+    return sum(latencies) / len(latencies), latencies[int(len(latencies) * 0.99) - 1]
+
+
+def main(calls=500):
+    server = StubServer(('127.0.0.1', 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/v1/accounts/itx-000/roles/admin/credentials"
+    session = http_session.build_session()
+    try:
+        bare = time_calls(lambda: requests.request('get', url, timeout=300), calls)
+        pooled = time_calls(lambda: session.request('get', url, timeout=http_session.get_timeout()), calls)
+    finally:
+        server.shutdown()
+        server.server_close()
+    print(f"{calls} GET calls against {url}")
+    print(f"requests.request       mean {bare[0]:.3f} ms  p99 {bare[1]:.3f} ms")
+    print(f"pooled session         mean {pooled[0]:.3f} ms  p99 {pooled[1]:.3f} ms")
+    print(f"speed-up               {bare[0] / pooled[0]:.1f}x")
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 500)
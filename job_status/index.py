@@ -0,0 +1,74 @@
+"""
+This module contains the lambda function code for get-job API.
+
+It returns the status, progress counters and final response of an async tagging job.
+"""
+
+# pylint: disable=import-error,logging-format-interpolation,broad-except,C0413,W1203
+import os
+import re
+import sys
+import json
+import logging
+
+THISDIR = os.path.dirname(__file__)  # job_status
+APPDIR = os.path.dirname(THISDIR)  # resource_tagging
+
+if APPDIR not in sys.path:
+    sys.path.append(APPDIR)
+if THISDIR not in sys.path:
+    sys.path.append(THISDIR)
+
+from utils import helpers, jobs
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+JOB_ID_PATTERN = re.compile(r'^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$')
+
+
+def handler(event, context):
+    """
+    Handles an API
+    Args:
+        event (dict): Lambda Event object prepared by API Gateway, with the job-id path parameter
+        context (dict):
+            See aws lambda documents. Not used here.
+    Returns:
+         dict: Defined by API Gateway, with the job in the body:
+        {
+            "job_id": "...",
+            "status": "pending|running|succeeded|failed",
+            "created_at": epoch seconds,
+            "updated_at": epoch seconds,
+            "progress": {"stage": "...", "resources_seen": ..., ...},
+            "result": {"statusCode": ..., "body": {...}} once the job is done
+        }
+    """
+    logger.info(f'event: {event}\n context: {context}')
+    resp_headers = {
+        'Content-Type': 'application/json'
+    }
+    job_id = (event.get('pathParameters') or {}).get('job-id') or ''
+    try:
+        if not JOB_ID_PATTERN.match(job_id):
+            status_code = 400
+            resp = {
+                'error': 'Please enter a valid job id in the url path'
+            }
+        else:
+            resp = jobs.get_job(job_id)
+            status_code = 200
+            if resp is None:
+                status_code = 404
+                resp = {
+                    'error': f'No job {job_id}. Jobs expire after some days.'
+                }
+    except Exception as err:
+        status_code = 500
+        resp = {
+            'error': f'{type(err).__name__}: {err}'
+        }
+    resp = helpers.lambda_returns(status_code, resp_headers, json.dumps(resp))
+    logger.info(f'response: {resp}')
+    return resp
@@ -23,9 +23,11 @@ if APPDIR not in sys.path:
 if THISDIR not in sys.path:
     sys.path.append(THISDIR)
 
-from utils import api_request
-from utils import ebs, resource_groups_tagging_api, helpers, secrets
+from utils import api_request, batch_executor, checkpoints, client_pool, credentials_cache, throttling
+from utils import arn_router, ebs, idempotency, preflight, resource_groups_tagging_api, helpers, secrets, tag_plan
+from utils import single_flight, validation
 from utils.exceptions import InvalidRegionException, InvalidInputException
+from utils.retry_queue import RetryQueue
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
@@ -75,14 +77,28 @@ def handler(event, context):
         }    """
     logger.info(f'event: {event}\n context: {context}')
 
-    resource_list = json.loads(event.get('body', {}))
-    volume_ids = resource_list.get('volume_ids', [])
-    resource_arn_list = resource_list.get('resource_arns', [])
-    valid_exception_actions = ['enable', 'disable']
-    tag_list = {}
+    resp_headers = {
+        'Content-Type': 'application/json'
+    }
 
-    if len(volume_ids) == 0 and len(resource_arn_list) == 0:
-        raise InvalidInputException("Either resource_arns or volume_ids have to be included in the request body")
+    # Validate the input before any call to AWS or vpcxiam, so that invalid requests are rejected right away.
+    try:
+        request = validation.validate_exception_request(event)
+        write_mode = tag_plan.get_write_mode(event)
+        diff = write_mode == tag_plan.DIFF_MODE
+        budget_limits = checkpoints.get_budget_limits(event)
+        checkpoint_id = checkpoints.get_checkpoint_id(event)
+        idempotency_key = idempotency.get_key(event)
+    except (InvalidInputException, InvalidRegionException) as err:
+        resp = helpers.lambda_returns(400, resp_headers, json.dumps({'error': str(err)}))
+        logger.info(f'response: {resp}')
+        return resp
+    account = request.account
+    region = request.region
+    action = request.action
+    volume_ids = request.volume_ids
+    resource_arn_list = request.resource_arns
+    tag_list = {}
 
     try:
         # Define service client
@@ -103,13 +119,16 @@ def handler(event, context):
             'body': json.dumps({'error': f"Unauthorized. {str(e)}"})
         }
 
+    # A retry of a request that is done or still running gets the response of the first attempt instead of doing
+    # the work again.
+    resp = idempotency.claim(event, idempotency_key, account, region)
+    if resp is not None:
+        logger.info(f'response: {resp}')
+        return resp
+
     # Get environment variables
-    resp_headers = {
-        'Content-Type': 'application/json'
-    }
     if hasattr(context, 'local_test'):
         logger.info('Running at local')
-    path_params = event.get('pathParameters', {})
     request_headers = event.get('headers', {})
     vpcxiam_endpoint = os.environ.get('vpcxiam_endpoint')
     vpcxiam_scope = os.environ.get('vpcxiam_scope')
@@ -118,124 +137,144 @@ def handler(event, context):
     status_code = 200
 
     try:
-        account = path_params.get('account-id')
-        region = path_params.get('region-name')
-        action = path_params.get('exception-action')
         logger.info(f"Account to tag resources in: {account}")
         logger.info(f"Region to tag resources in : {region}")
         logger.info(f"Action for exception (enable/disable): {action}")
 
-        # Validate exception action.
-        if action not in valid_exception_actions:
-            raise InvalidInputException("exception-action should be enable or disable")
-
         # is authorized?
         logger.info(f'is_authorized({request_headers}, {MSFT_IDP_APP_ID}, '
                     f'{MSFT_IDP_TENANT_ID}, {MSFT_IDP_CLIENT_ROLES}')
 
-        # Get the credentials for the account resources will be created in.
-        url = (vpcxiam_endpoint +
-               f"/v1/accounts/{account}/roles/admin/credentials")
-        scope = vpcxiam_scope
-        additional_headers = {
-            'Host': vpcxiam_host
-        }
-        api_requests = api_request.ApiRequests()
-        credentials = json.loads(
-            (api_requests.request(url=url, method='get', scope=scope, additional_headers=additional_headers)).text
+        # Get the credentials, validate the region and get the clients for the given region and given account.
+        # Credentials and clients are cached in the warm container.
+        preflight_result = preflight.run_preflight(
+            account,
+            region,
+            lambda: credentials_cache.fetch_admin_credentials(api_request.ApiRequests(), vpcxiam_endpoint,
+                                                              vpcxiam_host, vpcxiam_scope, account),
+            ['ec2', 'resourcegroupstaggingapi']
         )
-        error = credentials.get('error', {})
-        if error:
-            logger.error(error)
-            raise ValueError(error)
-        credentials = credentials.get('credentials', {})
-
-        # Validate region.
-        ec2_client = boto3.client(
-            service_name='ec2',
-            aws_access_key_id=credentials.get('AccessKeyId', ''),
-            aws_secret_access_key=credentials.get('SecretAccessKey', ''),
-            aws_session_token=credentials.get('SessionToken', ''))
-        helpers.is_region_valid(ec2_client, region)
+        logger.info(f"Preflight timings (ms): {dict(preflight_result.timings)}")
         logger.info(f"{region} is a valid region")
+        ec2_client = preflight_result.clients['ec2']
+        resource_tagging_client = preflight_result.clients['resourcegroupstaggingapi']
 
-        # Region is valid. Create clients for the given region and given account.
-        sts_client = boto3.client(
-            service_name='sts',
-            region_name=region,
-            aws_access_key_id=credentials.get('AccessKeyId', ''),
-            aws_secret_access_key=credentials.get('SecretAccessKey', ''),
-            aws_session_token=credentials.get('SessionToken', ''))
-        iam_client = boto3.client(
-            service_name='iam',
-            region_name=region,
-            aws_access_key_id=credentials.get('AccessKeyId', ''),
-            aws_secret_access_key=credentials.get('SecretAccessKey', ''),
-            aws_session_token=credentials.get('SessionToken', ''))
-        ec2_client = boto3.client(
-            service_name='ec2',
-            region_name=region,
-            aws_access_key_id=credentials.get('AccessKeyId', ''),
-            aws_secret_access_key=credentials.get('SecretAccessKey', ''),
-            aws_session_token=credentials.get('SessionToken', ''))
-        resource_tagging_client = boto3.client(
-            service_name='resourcegroupstaggingapi',
-            region_name=region,
-            aws_access_key_id=credentials.get('AccessKeyId', ''),
-            aws_secret_access_key=credentials.get('SecretAccessKey', ''),
-            aws_session_token=credentials.get('SessionToken', ''))
-
-        # Get the role name that has been assumed
-        role_arn, account_id = helpers.get_caller_role(sts_client, iam_client)
-
-        logger.info(f"Role name: {role_arn}\t Account Number : {account_id}")
+        logger.info(f"Role name: {preflight_result.role_arn}\t Account Number : {preflight_result.account_id}")
 
-        if action == 'enable':
-            tag_list = {
-                'vpcx-skip-backup': 'true'
-            }
+        # EC2 ARNs (volumes, snapshots) are sent to the EC2 API, 1000 per call instead of 20.
+        # Resources that AWS rejected one by one. They are reported in the response and do not fail the request.
+        # The ones that failed with a retryable error are sent again in bulk once all the other writes are done.
+        failures_queue = RetryQueue()
 
-            if len(resource_arn_list) != 0:
-                # Tag when the resource arn list is not empty
-                # Tag storage resources with vpcx-skip-backup tag
-                resource_groups_tagging_api.tag_storage_resources(resource_tagging_client, tag_list, resource_arn_list)
-
-                # Untag storage resource with tag key vpcx-backup and value regular
-                resource_groups_tagging_api.untag_storage_resources_to_skip(
-                    resource_tagging_client,
-                    resource_arn_list,
-                    ['vpcx-backup']
-                )
-
-            if len(volume_ids) != 0:
-                # Tag ebs volumes with vpcx-skip-backup tag.
-                # Untag the volumes with tag key vpcx-backup and value regular.
-                # Tags with key vpcx-backup and value legal-hold will be kept
-                # as is because those resources can't be skipped.
-                logger.info(f"Volumes ids that have to be skipped : {volume_ids}")
-                ebs.tag_untag_skip_backup_ebs_volumes(ec2_client, volume_ids, tag_list)
+        def tag_resources(tags, arns):
+            def write(batch):
+                return arn_router.tag_resources(resource_tagging_client, ec2_client, tags, batch)
+            failures_queue.add(('tag_resources', tuple(sorted(tags.items()))), write, write(arns))
 
-        else:
-            # The exception action is disable
-            if len(resource_arn_list) != 0:
-                # Un tag all the resources with the vpcx-skip-backup tag key
-                resource_groups_tagging_api.untag_storage_resources_to_skip(
-                    resource_tagging_client,
-                    resource_arn_list,
-                    ['vpcx-skip-backup']
-                )
-
-            if len(volume_ids) != 0:
-                # Un tag all the volumes with vpcx-skip-backup tag
-                for i in range(0, len(volume_ids), 1000):
-                    ec2_client.delete_tags(
-                        Resources=volume_ids[i:i+1000],
-                        Tags=[
-                            {
-                                'Key': 'vpcx-skip-backup'
-                            }
-                        ]
-                    )
+        def untag_resources(tag_keys, arns):
+            def write(batch):
+                return arn_router.untag_resources(resource_tagging_client, ec2_client, tag_keys, batch)
+            failures_queue.add(('untag_resources', tuple(tag_keys)), write, write(arns))
+
+        def untag_volumes(tag_keys, volume_ids):
+            def write(batch):
+                return ebs.delete_tags(ec2_client, batch, [{'Key': key} for key in tag_keys]).failures
+            failures_queue.add(('delete_tags', tuple(tag_keys)), write, write(volume_ids))
+
+        def apply_action(resource_arn_list, volume_ids):
+            # In diff mode, read the current tags of the resources first so that only the tags that change are
+            # written.
+            current_tags = None
+            current_volume_tags = None
+            if diff:
+                if len(resource_arn_list) != 0:
+                    current_tags = resource_groups_tagging_api.get_resource_tags(resource_tagging_client,
+                                                                                 resource_arns=resource_arn_list)
+                if len(volume_ids) != 0:
+                    current_volume_tags = ebs.get_volume_tags(ec2_client, volume_ids)
+
+            plans = []
+            if action == 'enable':
+                tag_list = {
+                    'vpcx-skip-backup': 'true'
+                }
+
+                if len(resource_arn_list) != 0:
+                    # Tag when the resource arn list is not empty
+                    # Tag storage resources with vpcx-skip-backup tag
+                    plans.append(tag_plan.apply(
+                        tag_plan.plan_tags(resource_arn_list, tag_list, current_tags),
+                        tag_resources
+                    ))
+
+                    # Untag storage resource with tag key vpcx-backup and value regular
+                    plans.append(tag_plan.apply(
+                        tag_plan.plan_untags(resource_arn_list, ['vpcx-backup'], current_tags),
+                        untag_resources
+                    ))
+
+                if len(volume_ids) != 0:
+                    # Tag ebs volumes with vpcx-skip-backup tag.
+                    # Untag the volumes with tag key vpcx-backup and value regular.
+                    # Tags with key vpcx-backup and value legal-hold will be kept
+                    # as is because those resources can't be skipped.
+                    logger.info(f"Volumes ids that have to be skipped : {volume_ids}")
+                    plans.extend(ebs.tag_untag_skip_backup_ebs_volumes(ec2_client, volume_ids, tag_list,
+                                                                       current_tags=current_volume_tags,
+                                                                       retry_queue=failures_queue))
+
+            else:
+                # The exception action is disable
+                if len(resource_arn_list) != 0:
+                    # Un tag all the resources with the vpcx-skip-backup tag key
+                    plans.append(tag_plan.apply(
+                        tag_plan.plan_untags(resource_arn_list, ['vpcx-skip-backup'], current_tags),
+                        untag_resources
+                    ))
+
+                if len(volume_ids) != 0:
+                    # Un tag all the volumes with vpcx-skip-backup tag
+                    plans.append(tag_plan.apply(
+                        tag_plan.plan_untags(volume_ids, ['vpcx-skip-backup'], current_volume_tags),
+                        untag_volumes
+                    ))
+            return plans
+
+        # A request with a budget, or resumed with a continuation token, goes through the lists a slice at a time
+        # and stops between two slices once the budget is used up. The cursor is the number of resource ARNs and
+        # volume ids done. Without a budget the lists are a single slice.
+        checkpoint = checkpoints.load(checkpoint_id) or {}
+        invocation = checkpoints.get_invocation(checkpoint)
+        budget = checkpoints.Budget(context, account=account, **budget_limits) if budget_limits else None
+        arns_done = arns_start = checkpoint.get('resource_arns_done', 0)
+        volumes_done = volumes_start = checkpoint.get('volume_ids_done', 0)
+        slice_size = checkpoints.get_slice_size() if budget else max(len(resource_arn_list), len(volume_ids))
+        plans = []
+        stopped = False
+        try:
+            while arns_done < len(resource_arn_list) or volumes_done < len(volume_ids):
+                # The first slice is always done, so that every request makes progress.
+                if budget is not None and (arns_done, volumes_done) != (arns_start, volumes_start) and \
+                        budget.expired():
+                    stopped = True
+                    break
+                arns_slice = resource_arn_list[arns_done:arns_done + slice_size]
+                volumes_slice = volume_ids[volumes_done:volumes_done + slice_size]
+                plans.extend(apply_action(arns_slice, volumes_slice))
+                arns_done += len(arns_slice)
+                volumes_done += len(volumes_slice)
+        finally:
+            # The skip tags changed: the storage tagging requests running for the account and region should not
+            # diff against the snapshot of their discovery any more.
+            single_flight.invalidate_discovery(account, region)
+
+        failures = checkpoint.get('failures', []) + batch_executor.failures_to_dicts(failures_queue.drain())
+        outcome = failures_queue.summary(failures)
+        logger.info(f"Tag write outcome: {outcome}")
+        tag_writes = tag_plan.summarize(plans)
+        tag_writes['mode'] = write_mode
+        logger.info(f"Tag writes: {tag_writes}")
+        logger.info(f"Throttling stats: {throttling.get_stats(account)}")
 
         # Set the response.
         if action == 'enable':
@@ -246,11 +285,40 @@ def handler(event, context):
             resp = {
                 'message': 'storage resources un tagged with tag key vpcx-skip-backup'
             }
+        resp['stats'] = {
+            'tag_writes': tag_writes,
+            'outcome': outcome,
+            'invocations': invocation
+        }
+        resp['failures'] = failures
+        if stopped:
+            # The budget of the request is used up: return what was done and a token to resume from.
+            resp['message'] = 'Part of the storage resources have been updated. Send the request again with the ' \
+                              'continuation token to update the rest.'
+            resp['stats']['api_calls'] = budget.api_calls()
+            resp['continuation_token'] = checkpoints.save_continuation(event, {
+                'invocation': invocation,
+                'resource_arns_done': arns_done,
+                'volume_ids_done': volumes_done,
+                'failures': failures
+            })
+            logger.info(f"Budget used up after {arns_done} resource arns and {volumes_done} volume ids")
+        if failures:
+            logger.info(f"Resources that could not be tagged: {failures}")
     # boto3 error;
     except botocore.exceptions.ClientError as err:
+        if credentials_cache.is_credentials_error(err):
+            # AWS rejected the cached credentials. Make the next request fetch new ones.
+            credentials_cache.invalidate(account)
+            client_pool.invalidate(account)
         err_code = err.response['Error']['Code']
         logger.info(f"err_code from boto3: {err_code}")
-        if err_code == 'InvalidParameterException':
+        if throttling.is_throttle_error(err):
+            status_code = 503
+            resp = {
+                'error': f'AWS is throttling the requests for the account, try again later. Details : {err}'
+            }
+        elif err_code == 'InvalidParameterException':
             status_code = 400
             resp = {
                 'error': f'One of the resources in the request is invalid. Details : {err}'
@@ -281,5 +349,6 @@ def handler(event, context):
             'error': f'{type(err).__name__}: {err}'
         }
     resp = helpers.lambda_returns(status_code, resp_headers, json.dumps(resp))
+    idempotency.complete(idempotency_key, account, region, resp)
     logger.info(f'response: {resp}')
     return resp
@@ -13,6 +13,8 @@ import sys
 import json
 import logging
 import traceback
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 #from cloudx_sls_authorization import lambda_auth
 
 THISDIR = os.path.dirname(__file__)  # storage_resource_tagging
@@ -23,9 +25,11 @@ if APPDIR not in sys.path:
 if THISDIR not in sys.path:
     sys.path.append(THISDIR)
 
-from utils import api_request
-from utils import dynamodb, ebs, efs, fsx, rds, redshift, resource_groups_tagging_api, helpers, secrets
+from utils import api_request, batch_executor, client_pool, credentials_cache, throttling
+from utils import discovery, ebs, pipeline, preflight, resource_groups_tagging_api, helpers, secrets, tag_plan
+from utils import checkpoints, idempotency, jobs, single_flight, validation
 from utils.exceptions import InvalidRegionException, InvalidInputException
+from utils.retry_queue import RetryQueue
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
@@ -76,41 +80,28 @@ def handler(event, context):
     logger.info(f'event: {event}\n context: {context}')
     resp = {}
     status_code = 200
+    resp_headers = {
+        'Content-Type': 'application/json'
+    }
 
-    # Validate the input
-    tag_list = json.loads(event.get('body', {}))
-    vpcx_backup_tag = {}
-    valid_vpcx_backup_tag_values = ["regular"]
-    if "vpcx-backup" in tag_list:
-        vpcx_backup_tag["vpcx-backup"] = tag_list.get("vpcx-backup")
-        del tag_list["vpcx-backup"]
-
+    # Validate the input before any call to AWS or vpcxiam, so that invalid requests are rejected right away.
     try:
-        if len(tag_list.keys()) == 0 and len(vpcx_backup_tag.keys()) == 0:
-            # Empty JSON in request body.
-            raise InvalidInputException("No tag key-values present in the request body.")
-
-        invalid_tag_value_tag_keys = []
-        for key in tag_list.keys():
-            if tag_list.get(key) == "":
-                invalid_tag_value_tag_keys.append(key)
-
-        if len(invalid_tag_value_tag_keys) > 0:
-            # There is at least one tag key with an invalid value
-            # Invalid values are any one of the following:
-            # [empty_string]
-            raise InvalidInputException(f"The request body has empty values for the these "
-                                        f"tagKeys: {invalid_tag_value_tag_keys}."
-                                        f"Tag values should be non-empty")
-
-        if vpcx_backup_tag:
-            if vpcx_backup_tag["vpcx-backup"] not in valid_vpcx_backup_tag_values:
-                raise InvalidInputException("Allowed values for the vpcx-backup tag are: [regular]")
-    except InvalidInputException as err:
-        status_code = 400
-        resp = {
-            'error': str(err)
-        }
+        request = validation.validate_storage_request(event)
+        write_mode = tag_plan.get_write_mode(event)
+        diff = write_mode == tag_plan.DIFF_MODE
+        discovery_backend = discovery.get_backend(event)
+        strict = discovery.is_strict(event)
+        budget_limits = checkpoints.get_budget_limits(event)
+        checkpoint_id = checkpoints.get_checkpoint_id(event)
+        idempotency_key = idempotency.get_key(event)
+    except (InvalidInputException, InvalidRegionException) as err:
+        resp = helpers.lambda_returns(400, resp_headers, json.dumps({'error': str(err)}))
+        logger.info(f'response: {resp}')
+        return resp
+    account = request.account
+    region = request.region
+    tag_list = request.tag_list
+    vpcx_backup_tag = request.vpcx_backup_tag
 
     try:
         # Define service client
@@ -131,186 +122,302 @@ def handler(event, context):
             'body': json.dumps(str(e))
         }
 
+    # A retry of a request that is done or still running gets the response of the first attempt instead of doing
+    # the work again. The worker invocations of a job belong to the request that started the job.
+    job_id = jobs.get_job_id(event)
+    if job_id is None:
+        resp = idempotency.claim(event, idempotency_key, account, region)
+        if resp is not None:
+            logger.info(f'response: {resp}')
+            return resp
+
+    # Async mode: hand the request over to a worker invocation and return the job id right away.
+    if job_id is None and jobs.is_async(event):
+        job = jobs.submit(event, context, handler)
+        resp = helpers.lambda_returns(202, resp_headers, json.dumps({
+            'job_id': job['job_id'],
+            'status': job['status'],
+            'status_url': f"/v1/jobs/{job['job_id']}"
+        }))
+        idempotency.complete(idempotency_key, account, region, resp)
+        logger.info(f'response: {resp}')
+        return resp
+    progress = jobs.JobProgress(job_id)
+    progress.start()
+    continued = False
+    flight = None
+
     # Get environment variables
-    resp_headers = {
-        'Content-Type': 'application/json'
-    }
     if hasattr(context, 'local_test'):
         logger.info('Running at local')
-    path_params = event.get('pathParameters', {})
     request_headers = event.get('headers', {})
     vpcxiam_endpoint = os.environ.get('vpcxiam_endpoint')
     vpcxiam_scope = os.environ.get('vpcxiam_scope')
     vpcxiam_host = os.environ.get('vpcxiam_host')
 
     try:
-        account = path_params.get('account-id')
-        region = path_params.get('region-name')
-        resource_type = path_params.get('resource-type')
         logger.info(f"Account to tag resources in: {account}")
         logger.info(f"Region to tag resources in : {region}")
-        logger.info(f"Resource_type to tag resources for: {resource_type}")
 
-        # Validate resource type.
-        if resource_type != 'storage':
-            raise InvalidInputException("resource type should be storage")
+        # A follow-up invocation or a request with a continuation token starts from the checkpoint of the previous
+        # one. Every invocation but the last allowed one stops sending new writes shortly before its timeout and
+        # hands over to a new invocation. A request with a budget stops once the budget is used up instead.
+        checkpoint = checkpoints.load(checkpoint_id)
+        invocation = checkpoints.get_invocation(checkpoint)
+        if budget_limits:
+            deadline = checkpoints.Budget(context, account=account, **budget_limits)
+        else:
+            deadline = checkpoints.Deadline(context) if checkpoints.can_continue(checkpoint) else None
+        cursor = checkpoints.Cursor.decode((checkpoint or {}).get('written'))
 
         # is authorized?
         logger.info(f'is_authorized({request_headers}, {MSFT_IDP_APP_ID}, '
                     f'{MSFT_IDP_TENANT_ID}, {MSFT_IDP_CLIENT_ROLES}')
 
-        if len(tag_list.keys()) == 0 and len(vpcx_backup_tag.keys()) == 0:
-            # Empty JSON in request body.
-            raise InvalidInputException("No tag key-values present in the request body.")
-
-        invalid_tag_value_tag_keys = []
-        for key in tag_list.keys():
-            if tag_list.get(key) == "":
-                invalid_tag_value_tag_keys.append(key)
-
-        if len(invalid_tag_value_tag_keys) > 0:
-            # There is at least one tag key with an invalid value
-            # Invalid values are any one of the following:
-            # [empty_string]
-            raise InvalidInputException(f"The request body has empty values for the these "
-                                        f"tagKeys: {invalid_tag_value_tag_keys}."
-                                        f"Tag values should be non-empty")
-
-        # Get the credentials for the account resources will be created in.
-        url = (vpcxiam_endpoint +
-               f"/v1/accounts/{account}/roles/admin/credentials")
-        scope = vpcxiam_scope
-        additional_headers = {
-            'Host': vpcxiam_host
-        }
-        api_requests = api_request.ApiRequests()
-        credentials = json.loads(
-            (api_requests.request(url=url, method='get', scope=scope, additional_headers=additional_headers)).text
+        # Get the credentials, validate the region and get the clients for the given region and given account.
+        # Credentials and clients are cached in the warm container.
+        preflight_result = preflight.run_preflight(
+            account,
+            region,
+            lambda: credentials_cache.fetch_admin_credentials(api_request.ApiRequests(), vpcxiam_endpoint,
+                                                              vpcxiam_host, vpcxiam_scope, account),
+            ['ec2', 'resourcegroupstaggingapi'] if discovery_backend == discovery.RGTA_BACKEND else
+            ['ec2', 'rds', 'redshift', 'efs', 'fsx', 'dynamodb', 'resourcegroupstaggingapi']
         )
-        error = credentials.get('error', {})
-        if error:
-            logger.error(error)
-            raise ValueError(error)
-        credentials = credentials.get('credentials', {})
-
-        # Validate region.
-        ec2_client = boto3.client(
-            service_name='ec2',
-            aws_access_key_id=credentials.get('AccessKeyId', ''),
-            aws_secret_access_key=credentials.get('SecretAccessKey', ''),
-            aws_session_token=credentials.get('SessionToken', ''))
-        helpers.is_region_valid(ec2_client, region)
+        logger.info(f"Preflight timings (ms): {dict(preflight_result.timings)}")
+        progress.update(force=True, stage='discovery')
         logger.info(f"{region} is a valid region")
+        clients = preflight_result.clients
+        ec2_client = clients['ec2']
+        resource_tagging_client = clients['resourcegroupstaggingapi']
+        account_id = preflight_result.account_id
 
-        # Region is valid. Create clients for the given region and given account.
-        sts_client = boto3.client(
-            service_name='sts',
-            region_name=region,
-            aws_access_key_id=credentials.get('AccessKeyId', ''),
-            aws_secret_access_key=credentials.get('SecretAccessKey', ''),
-            aws_session_token=credentials.get('SessionToken', ''))
-        iam_client = boto3.client(
-            service_name='iam',
-            region_name=region,
-            aws_access_key_id=credentials.get('AccessKeyId', ''),
-            aws_secret_access_key=credentials.get('SecretAccessKey', ''),
-            aws_session_token=credentials.get('SessionToken', ''))
-        ec2_client = boto3.client(
-            service_name='ec2',
-            region_name=region,
-            aws_access_key_id=credentials.get('AccessKeyId', ''),
-            aws_secret_access_key=credentials.get('SecretAccessKey', ''),
-            aws_session_token=credentials.get('SessionToken', ''))
-        rds_client = boto3.client(
-            service_name='rds',
-            region_name=region,
-            aws_access_key_id=credentials.get('AccessKeyId', ''),
-            aws_secret_access_key=credentials.get('SecretAccessKey', ''),
-            aws_session_token=credentials.get('SessionToken', ''))
-        redshift_client = boto3.client(
-            service_name='redshift',
-            region_name=region,
-            aws_access_key_id=credentials.get('AccessKeyId', ''),
-            aws_secret_access_key=credentials.get('SecretAccessKey', ''),
-            aws_session_token=credentials.get('SessionToken', ''))
-        efs_client = boto3.client(
-            service_name='efs',
-            region_name=region,
-            aws_access_key_id=credentials.get('AccessKeyId', ''),
-            aws_secret_access_key=credentials.get('SecretAccessKey', ''),
-            aws_session_token=credentials.get('SessionToken', ''))
-        fsx_client = boto3.client(
-            service_name='fsx',
-            region_name=region,
-            aws_access_key_id=credentials.get('AccessKeyId', ''),
-            aws_secret_access_key=credentials.get('SecretAccessKey', ''),
-            aws_session_token=credentials.get('SessionToken', ''))
-        dynamodb_client = boto3.client(
-            service_name='dynamodb',
-            region_name=region,
-            aws_access_key_id=credentials.get('AccessKeyId', ''),
-            aws_secret_access_key=credentials.get('SecretAccessKey', ''),
-            aws_session_token=credentials.get('SessionToken', ''))
-        resource_tagging_client = boto3.client(
-            service_name='resourcegroupstaggingapi',
-            region_name=region,
-            aws_access_key_id=credentials.get('AccessKeyId', ''),
-            aws_secret_access_key=credentials.get('SecretAccessKey', ''),
-            aws_session_token=credentials.get('SessionToken', ''))
-
-        # Get the role name that has been assumed
-        role_arn, account_id = helpers.get_caller_role(sts_client, iam_client)
-
-        logger.info(f"Role name: {role_arn}\t Account Number : {account_id}")
-
-        # Get all the storage resources in the account.
-        rds_arns = rds.get_rds_instances(rds_client)
-        dynamodb_arns = dynamodb.get_dynamodb_tables(dynamodb_client, region)
-        efs_arns = efs.get_efs_file_systems(efs_client)
-        fsx_arns = fsx.get_fsx_file_systems(fsx_client)
-        redshift_arns = redshift.get_redshift_cluster_arns(redshift_client, region, account_id)
-
-        storage_resources_arn_list = rds_arns + dynamodb_arns + efs_arns + fsx_arns + redshift_arns
-        logger.info(f"All storage resources in the account: {storage_resources_arn_list}")
-
-        # Skip the resources with the vpcx-skip-backup tag
-        # Get all the storage resources in the account that have the tag to skip the vpcx-backups.
-        resources_to_skip_arn_list = resource_groups_tagging_api.get_all_resources_to_skip(resource_tagging_client)
-        logger.info(f"Resources with skip tag: {resources_to_skip_arn_list}")
-
-        # Filter the ARN list and prepare a list of ARNs that will be tagged with tag list in the request.
-        arn_list_to_add_vpcx_tag = helpers.filter_resource_arns(storage_resources_arn_list,
-                                                                resources_to_skip_arn_list)
-        logger.info(f"Resources to tag vpcx backup tag: {arn_list_to_add_vpcx_tag}")
+        logger.info(f"Role name: {preflight_result.role_arn}\t Account Number : {account_id}")
 
         logger.info(f"Tag list: {tag_list}")
         logger.info(f"vpcx-backup-tag dict: {vpcx_backup_tag}")
 
-        # Tag all the resources with the tag list in the request.
-        if tag_list:
-            resource_groups_tagging_api.tag_storage_resources(resource_tagging_client,
-                                                              tag_list,
-                                                              storage_resources_arn_list)
-
-        if vpcx_backup_tag:
-            resource_groups_tagging_api.tag_storage_resources(resource_tagging_client,
-                                                              vpcx_backup_tag,
-                                                              arn_list_to_add_vpcx_tag)
-
-        # Tag the EBS volumes using the EC2 API.
-        ebs.tag_all_ebs_volumes(ec2_client, tag_list, vpcx_backup_tag)
-
-        # Set the response.
-        resp = {
-            'message': 'All the storage resources have been tagged with the tag list. '
-                       'Resources marked to skip vpcx-backups are untagged.'
+        # Resources that AWS rejected one by one. They are reported in the response and do not fail the request.
+        # The ones that failed with a retryable error are sent again in bulk once all the other writes are done.
+        failures_queue = RetryQueue()
+
+        def tag_resources(tags, arns):
+            def write(batch):
+                return resource_groups_tagging_api.tag_storage_resources(resource_tagging_client, tags,
+                                                                         batch).failures
+            failures_queue.add(('tag_resources', tuple(sorted(tags.items()))), write, write(arns))
+
+        # The request tag list and the vpcx-backup tag go to the resources without the vpcx-skip-backup tag, merged
+        # per resource so that every resource is written to once. In diff mode only the tags that change are sent.
+        # The EBS volumes are tagged using the EC2 API at the same time.
+        # Requests for the same account and region at the same time share one discovery: the leader publishes what
+        # it discovered as soon as its discovery is over and the followers apply their tag delta to it, see
+        # single_flight. A resumed request carries on with its own.
+        if not checkpoint:
+            flight = single_flight.join(account, region,
+                                        single_flight.discovery_operation(discovery_backend, strict),
+                                        deadline=deadline, wait_ms=single_flight.get_wait_ms(job_id is not None))
+        snapshot = flight.snapshot if flight is not None else None
+        discovery_counts = None
+
+        def publish(arns, skip_arns, volumes, tag_keys, current_tags):
+            if flight is not None and flight.role == single_flight.LEADER:
+                flight.publish(single_flight.build_snapshot(arns, skip_arns, volumes, tag_keys, current_tags,
+                                                            dict(tag_list, **vpcx_backup_tag), vpcx_backup_tag))
+
+        with ThreadPoolExecutor(max_workers=1) as ebs_executor:
+            if snapshot is not None:
+                ebs_future = ebs_executor.submit(ebs.tag_volumes, ec2_client, snapshot.volumes, tag_list,
+                                                 vpcx_backup_tag, diff=diff, retry_queue=failures_queue)
+                current_tags = None
+                if diff:
+                    current_tags = single_flight.current_tags(
+                        snapshot, list(tag_list) + list(vpcx_backup_tag),
+                        lambda keys: resource_groups_tagging_api.get_resource_tags(resource_tagging_client, keys))
+                progress.update(force=True, stage='tagging', resources_seen=len(snapshot.arns))
+                arn_filter_counts, tag_resources_plan = pipeline.write_stream(
+                    iter(snapshot.arns),
+                    [tag_list, vpcx_backup_tag],
+                    tag_resources,
+                    resource_groups_tagging_api.RGTA_BATCH_SIZE,
+                    skip_arns=snapshot.skip_arns,
+                    current_tags=current_tags,
+                    progress=progress.update,
+                    deadline=deadline,
+                    cursor=cursor
+                )
+                discovery_timings = OrderedDict([(single_flight.FOLLOWER, flight.waited_ms),
+                                                 ('total', flight.waited_ms)])
+            elif discovery_backend == discovery.RGTA_BACKEND:
+                # Get all the storage resources in the account with their tags in a single RGTA scan.
+                inventory = discovery.run_rgta_discovery(resource_tagging_client, list(tag_list))
+                publish(inventory.arns, inventory.skip_arns, inventory.volumes,
+                        list(tag_list) + [ebs.SKIP_TAG_KEY, ebs.BACKUP_TAG_KEY], inventory.tags)
+                if checkpoint and 'ebs_volumes' in checkpoint:
+                    # The volumes were tagged by a previous invocation.
+                    ebs_future = None
+                else:
+                    ebs_future = ebs_executor.submit(ebs.tag_volumes, ec2_client, inventory.volumes, tag_list,
+                                                     vpcx_backup_tag, diff=diff, retry_queue=failures_queue)
+                discovery_timings = inventory.timings
+                discovery_counts = inventory.counts
+                logger.info(f"Resources with skip tag: {inventory.skip_arns}")
+                progress.update(force=True, stage='tagging', resources_seen=len(inventory.arns))
+                arn_filter_counts, tag_resources_plan = pipeline.write_stream(
+                    iter(inventory.arns),
+                    [tag_list, vpcx_backup_tag],
+                    tag_resources,
+                    resource_groups_tagging_api.RGTA_BATCH_SIZE,
+                    skip_arns=inventory.skip_arns,
+                    current_tags=inventory.tags if diff else None,
+                    progress=progress.update,
+                    deadline=deadline,
+                    cursor=cursor
+                )
+            else:
+                recorded_arns = []
+                if checkpoint and 'ebs_volumes' in checkpoint:
+                    # The volumes were tagged by a previous invocation.
+                    volumes_future = ebs_future = None
+                else:
+                    # The volumes are listed first, for the snapshot of a leader, and then tagged.
+                    volumes_future = ebs_executor.submit(
+                        list, ebs.iter_volumes(ec2_client, list(tag_list) if diff else ()))
+                    ebs_future = ebs_executor.submit(
+                        lambda: ebs.tag_volumes(ec2_client, volumes_future.result(), tag_list, vpcx_backup_tag,
+                                                diff=diff, retry_queue=failures_queue))
+                # The resources with the skip tag, and in diff mode the current tags, are needed before the first
+                # write.
+                prefetch_collectors = [discovery.Collector(discovery.SKIP_COLLECTOR, 'resourcegroupstaggingapi',
+                                                           resource_groups_tagging_api.get_all_resources_to_skip,
+                                                           (resource_tagging_client,))]
+                if diff:
+                    prefetch_collectors.append(discovery.Collector(
+                        'current_tags', 'resourcegroupstaggingapi', resource_groups_tagging_api.get_resource_tags,
+                        (resource_tagging_client, list(tag_list) + list(vpcx_backup_tag))))
+                prefetch_result = discovery.run_collectors(prefetch_collectors)
+                resources_to_skip_arn_list = prefetch_result.results[discovery.SKIP_COLLECTOR]
+                logger.info(f"Resources with skip tag: {resources_to_skip_arn_list}")
+
+                # Stream the other storage resources into the tag writes as their pages arrive.
+                partition = preflight_result.role_arn.split(':')[1]
+                stream_result = pipeline.run(
+                    single_flight.record_collectors(
+                        discovery.build_streaming_collectors(clients, region, account_id, partition, strict),
+                        recorded_arns),
+                    [tag_list, vpcx_backup_tag],
+                    tag_resources,
+                    resource_groups_tagging_api.RGTA_BATCH_SIZE,
+                    skip_arns=resources_to_skip_arn_list,
+                    current_tags=prefetch_result.results.get('current_tags'),
+                    progress=progress.update,
+                    deadline=deadline,
+                    cursor=cursor,
+                    discovered=lambda: publish(recorded_arns, resources_to_skip_arn_list,
+                                               volumes_future.result() if volumes_future else [],
+                                               list(tag_list) + list(vpcx_backup_tag),
+                                               prefetch_result.results.get('current_tags'))
+                )
+                discovery_timings = OrderedDict((name, elapsed) for name, elapsed in prefetch_result.timings.items()
+                                                if name != 'total')
+                discovery_timings.update(stream_result.timings)
+                arn_filter_counts = stream_result.partition_counts
+                tag_resources_plan = stream_result.plan
+            progress.update(force=True, stage='ebs_volumes')
+            ebs_volume_counts = ebs_future.result() if ebs_future else dict(checkpoint['ebs_volumes'], plans=[])
+        logger.info(f"Discovery timings (ms): {dict(discovery_timings)}")
+        logger.info(f"ARN filter counts: {arn_filter_counts}")
+
+        plans = [tag_resources_plan]
+        plans.extend(ebs_volume_counts.pop('plans'))
+        ebs_volume_counts.pop('failures', None)
+        progress.update(force=True, stage='retries')
+        failures = (checkpoint or {}).get('failures', []) + batch_executor.failures_to_dicts(failures_queue.drain())
+        outcome = failures_queue.summary(failures)
+        logger.info(f"Tag write outcome: {outcome}")
+        if failures:
+            logger.info(f"Resources that could not be tagged: {failures}")
+        tag_writes = tag_plan.summarize(plans)
+        tag_writes['mode'] = write_mode
+        logger.info(f"Tag writes: {tag_writes}")
+
+        throttling_stats = throttling.get_stats(account)
+        logger.info(f"Throttling stats: {throttling_stats}")
+
+        if snapshot is not None and tag_writes['sent']:
+            flight.invalidate()
+
+        stats = {
+            'preflight_timings_ms': preflight_result.timings,
+            'discovery_backend': discovery_backend,
+            'discovery_timings_ms': discovery_timings,
+            'discovery_counts': discovery_counts,
+            'arn_filter': arn_filter_counts,
+            'ebs_volumes': ebs_volume_counts,
+            'tag_writes': tag_writes,
+            'outcome': outcome,
+            'throttling': throttling_stats,
+            'single_flight': flight.stats() if flight is not None else None,
+            'invocations': invocation,
+            'resumed': len(cursor.done)
         }
+        if cursor.stopped:
+            state = {
+                'invocation': invocation,
+                'written': cursor.encode(),
+                'ebs_volumes': ebs_volume_counts,
+                'failures': failures
+            }
+        if cursor.stopped and budget_limits:
+            # The budget of the request is used up: return what was done and a token to resume from.
+            stats['api_calls'] = deadline.api_calls()
+            resp = {
+                'message': 'Part of the storage resources have been tagged. Send the request again with the '
+                           'continuation token to tag the rest.',
+                'continuation_token': checkpoints.save_continuation(event, state),
+                'stats': stats,
+                'failures': failures
+            }
+            logger.info(f"Budget used up after writing to {len(cursor.written)} resources")
+        elif cursor.stopped:
+            # Out of time: save what was done and continue in a new invocation.
+            continuation_id = checkpoints.continue_later(event, context, handler, state)
+            continued = True
+            status_code = 202
+            resp = {
+                'message': 'The storage resources are being tagged. The tagging continues in the background.',
+                'job_id': continuation_id,
+                'status_url': f"/v1/jobs/{continuation_id}",
+                'stats': {
+                    'invocation': invocation,
+                    'resources_written': len(cursor.written)
+                }
+            }
+            logger.info(f"Continuing in job {continuation_id} after writing to {len(cursor.written)} resources")
+        else:
+            # Set the response.
+            resp = {
+                'message': 'All the storage resources have been tagged with the tag list. '
+                           'Resources marked to skip vpcx-backups are untagged.',
+                'stats': stats,
+                'failures': failures
+            }
     # boto3 error;
     except botocore.exceptions.ClientError as err:
-        status_code = 500
-        resp = {
-            'error': f'{type(err).__name__}: {err}'
-        }
+        if credentials_cache.is_credentials_error(err):
+            # AWS rejected the cached credentials. Make the next request fetch new ones.
+            credentials_cache.invalidate(account)
+            client_pool.invalidate(account)
+        if throttling.is_throttle_error(err):
+            status_code = 503
+            resp = {
+                'error': f'AWS is throttling the requests for the account, try again later. Details : {err}'
+            }
+        else:
+            status_code = 500
+            resp = {
+                'error': f'{type(err).__name__}: {err}'
+            }
     except InvalidRegionException:
         status_code = 400
         resp = {
@@ -332,5 +439,11 @@ def handler(event, context):
             'error': f'{type(err).__name__}: {err}'
         }
     resp = helpers.lambda_returns(status_code, resp_headers, json.dumps(resp))
+    if flight is not None:
+        flight.release()
+    if not continued:
+        progress.finish(resp)
+    if job_id is None:
+        idempotency.complete(idempotency_key, account, region, resp)
     logger.info(f'response: {resp}')
     return resp
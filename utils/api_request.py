@@ -1,11 +1,13 @@
 """This module is used to do API calls to AWSAPI Microservices"""
 # pylint:disable= no-member, invalid-name, E0401, W1203, C0411
-from requests import request as req
 from flask import Response
 import logging
 import os
+import threading
 import boto3
 from azureauth.create_token import TokenGenerator
+from utils.token_cache import TokenCache
+from utils import http_session
 
 HTTP_GET = 'get'
 HTTP_PUT = 'put'
@@ -14,6 +16,50 @@ HTTP_POST = 'post'
 lgr = logging.getLogger()
 lgr.setLevel(logging.INFO)
 
+# Kept at module level so that warm invocations reuse the secret, the token generators and the bearer tokens.
+_client_secret = None
+_generators = {}
+_token_cache = TokenCache()
+_lock = threading.Lock()
+
+
+def get_client_secret():
+    """
+    Get the client secret of the app registration, reading Secrets Manager only once per container
+
+    Returns:
+        str: The client secret
+    """
+    global _client_secret
+    with _lock:
+        if _client_secret is None:
+            secret_name = os.environ.get('RESOURCE_TAGGING_SECRET_NAME', 'nextbot/resource_tagging')
+            region = os.environ.get('region', 'us-east-1')
+            _client_secret = (
+                os.environ.get('RESOURCE_TAGGING_SECRET_VALUE') if os.environ.get('RESOURCE_TAGGING_SECRET_VALUE')
+                else boto3.client('secretsmanager', region).get_secret_value(SecretId=secret_name).get('SecretString')
+            )
+        return _client_secret
+
+
+def get_token_generator(client_id: str, client_secret: str, token_url: str) -> TokenGenerator:
+    """
+    Get the TokenGenerator of a client, creating it on first use
+
+    Args:
+        client_id (str): client id to get token.
+        client_secret (str): client secret to get token.
+        token_url (str): Azure AD token endpoint.
+
+    Returns:
+        TokenGenerator: The shared generator
+    """
+    key = (client_id, client_secret, token_url)
+    with _lock:
+        if key not in _generators:
+            _generators[key] = TokenGenerator(client_id, client_secret, token_url=token_url)
+        return _generators[key]
+
 
 class ApiRequests:
     """Class for Making AWSAPI Microservice Calls"""
@@ -27,18 +73,12 @@ class ApiRequests:
             self.logger = lgr
         self.token_url = os.environ.get("token_url")
         self.client_id = os.environ.get("RESOURCE_TAGGING_CLIENT_ID")
-        secret_name = os.environ.get('RESOURCE_TAGGING_SECRET_NAME', 'nextbot/resource_tagging')
-        region = os.environ.get('region', 'us-east-1')
-        self.client_secret = (
-            os.environ.get('RESOURCE_TAGGING_SECRET_VALUE') if os.environ.get('RESOURCE_TAGGING_SECRET_VALUE')
-            else boto3.client('secretsmanager', region).get_secret_value(SecretId=secret_name).get('SecretString')
-        )
-        os.environ['RESOURCE_TAGGING_SECRET_VALUE'] = self.client_secret
-        self.logger.info(f"The secret retrieved from secrets_manager: {self.client_secret}")
+        self.client_secret = get_client_secret()
 
     def get_access_token(self, client_id: str = None, client_secret: str = None, scope: str = None) -> str:
         """
-        Get an Access Token for the <scope> of the client
+        Get an Access Token for the <scope> of the client. Tokens are cached per (client_id, scope) until shortly
+        before they expire.
 
         Args:
             client_id (str): client id to get token.
@@ -54,10 +94,13 @@ class ApiRequests:
             client_id = self.client_id
         if not client_secret:
             client_secret = self.client_secret
-        try:
+        def generate_token():
             self.logger.info(f"Generating Bearer token for scope '{scope}'.")
-            generator = TokenGenerator(client_id, client_secret, token_url=self.token_url)
-            token = generator.get_bearer_token(scope)
+            generator = get_token_generator(client_id, client_secret, self.token_url)
+            return generator.get_bearer_token(scope)
+
+        try:
+            token = _token_cache.get(client_id, scope, generate_token)
         except Exception as ex:
             self.logger.error(
                 f"get_access_token - Failed to generated token for scope {scope} at url {self.token_url}."
@@ -72,7 +115,8 @@ class ApiRequests:
             additional_payload: dict = None
     ) -> Response:
         """
-        Make a Http request to the provided url
+        Make a Http request to the provided url over the shared keep-alive session. GET requests are retried with
+        backoff.
 
         Args:
             url (str): API URL.
@@ -111,7 +155,7 @@ class ApiRequests:
                 f"'url': '{url}', 'payload': {payload}"
                 "}"
             )
-            return req(method, url, timeout=300, **kwargs)
+            return http_session.get_session().request(method, url, timeout=http_session.get_timeout(), **kwargs)
         except Exception as ex:
             self.logger.error(
                 f"get_access_token - Failed to generated token for scope {scope}."
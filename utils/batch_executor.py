@@ -0,0 +1,193 @@
+"""Send fixed-size batches of a write API concurrently.
+
+The number of threads used by one call is bounded by ``max_workers``. On top of that every API has a process-wide
+cap, so two handlers (or two tag sets) writing through the same API at the same time share one budget.
+
+run_isolated_batches also keeps one bad item from failing its whole batch: a batch rejected because of one of its
+items is split in halves until the bad items are isolated, and the items a response reports as failed are returned
+as they are. The other items are applied and the bad ones are returned as ItemFailure, for the retry_queue.RetryQueue
+of the caller to send the retryable ones again. When both halves of a batch
+fail with the same error, the error comes from the request (e.g. an invalid tag) rather than from an item, and it is
+raised.
+"""
+import os
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_MAX_WORKERS = 8
+DEFAULT_API_CONCURRENCY = 4
+DEFAULT_API_LIMITS = {
+    'tag_resources': 4,
+    'untag_resources': 4,
+    'create_tags': 8,
+    'delete_tags': 8,
+}
+
+# Error codes meaning that one of the items of a batch is invalid rather than the whole call.
+ITEM_ERROR_CODES = frozenset([
+    'InvalidParameterException',
+    'InvalidParameterValue',
+    'InvalidID',
+    'InvalidVolume.NotFound',
+    'InvalidSnapshot.NotFound',
+    'InvalidResourceType.Unknown',
+])
+
+ItemFailure = namedtuple('ItemFailure', ['item', 'code', 'message'])
+# results: the responses of the calls that were sent, failures: ItemFailure list in item order.
+BatchOutcome = namedtuple('BatchOutcome', ['results', 'failures'])
+
+_api_semaphores = {}
+_api_semaphores_lock = threading.Lock()
+
+
+def get_max_workers():
+    """Read the batch pool size from the BATCH_MAX_WORKERS environment variable."""
+    return int(os.environ.get('BATCH_MAX_WORKERS', DEFAULT_MAX_WORKERS))
+
+
+def get_api_limit(api_name):
+    """Get the process-wide concurrency cap of an API.
+
+    The BATCH_API_CONCURRENCY environment variable overrides the defaults, e.g. ``tag_resources=2,create_tags=4``.
+
+    Args:
+        api_name: The boto3 operation name
+
+    Returns:
+        int: The maximum number of calls to the API allowed in flight at the same time
+    """
+    api_limits = dict(DEFAULT_API_LIMITS)
+    for entry in os.environ.get('BATCH_API_CONCURRENCY', '').split(','):
+        if '=' in entry:
+            name, limit = entry.split('=', 1)
+            api_limits[name.strip()] = max(1, int(limit))
+    return api_limits.get(api_name, DEFAULT_API_CONCURRENCY)
+
+
+def _get_api_semaphore(api_name):
+    with _api_semaphores_lock:
+        if api_name not in _api_semaphores:
+            _api_semaphores[api_name] = threading.BoundedSemaphore(get_api_limit(api_name))
+        return _api_semaphores[api_name]
+
+
+def chunks(items, batch_size):
+    """Split a list into consecutive batches of at most batch_size items."""
+    return [items[i:i + batch_size] for i in range(0, len(items), batch_size)]
+
+
+def run_batches(func, items, batch_size, api_name, max_workers=None):
+    """Call func once per batch of items, running the batches concurrently.
+
+    Args:
+        func: Callable taking one batch (a list) and returning the result for that batch
+        items (list): The items to split into batches
+        batch_size (int): The maximum number of items per call, e.g. 20 for TagResources
+        api_name: The operation name used to look up the per-API cap
+        max_workers (int): Threads used by this call. Defaults to get_max_workers().
+
+    Returns:
+        list: The results of func, in batch order
+
+    Raises:
+        Exception: The error of the first failing batch (in batch order), once all the batches have finished.
+    """
+    batches = chunks(items, batch_size)
+    if not batches:
+        return []
+    semaphore = _get_api_semaphore(api_name)
+    workers = min(max_workers or get_max_workers(), get_api_limit(api_name), len(batches))
+
+    def call(batch):
+        with semaphore:
+            return func(batch)
+
+    if workers == 1:
+        return [call(batch) for batch in batches]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(call, batch) for batch in batches]
+    return [future.result() for future in futures]
+
+
+def is_item_error(err):
+    """Check whether a boto3 error was caused by one of the items of the call."""
+    response = getattr(err, 'response', None) or {}
+    return response.get('Error', {}).get('Code') in ITEM_ERROR_CODES
+
+
+def _error_details(err):
+    error = (getattr(err, 'response', None) or {}).get('Error', {})
+    return error.get('Code', type(err).__name__), error.get('Message', str(err))
+
+
+def run_isolated_batches(func, items, batch_size, api_name, max_workers=None, failed_items=None):
+    """Call func once per batch of items like run_batches, isolating the items that fail.
+
+    A batch failing with an item error (see is_item_error) is bisected, so n items with one bad item cost about
+    2 * log2(n) extra calls. Some of the item error codes, e.g. InvalidParameterException, are also returned for an
+    invalid request: when both halves of a batch fail with the same code and message, the error is raised as a
+    request error after two extra calls, instead of bisecting down to every single item. The items failed_items
+    reports as failed are returned as ItemFailure without being sent again: the caller retries them in bulk, see
+    retry_queue.RetryQueue.
+
+    Args:
+        func: Callable taking one batch (a list) and returning the response for that batch
+        items (list): The items to split into batches
+        batch_size (int): The maximum number of items per call
+        api_name: The operation name used to look up the per-API cap
+        max_workers (int): Threads used by this call. Defaults to get_max_workers().
+        failed_items: Callable taking a response and returning {item: (error code, message)} for the items it
+            reports as failed, e.g. the FailedResourcesMap of TagResources
+
+    Returns:
+        BatchOutcome: The responses and the items that could not be written
+
+    Raises:
+        Exception: The first error (in batch order) that is not an item error, or that both halves of a batch failed
+            with, once all the batches have finished.
+    """
+    def call(batch):
+        try:
+            return func(batch), None
+        except Exception as err:  # pylint: disable=broad-except
+            if not is_item_error(err):
+                raise
+            return None, err
+
+    def isolate(batch, err):
+        # Bisect a batch that failed with the item error err.
+        if len(batch) == 1:
+            return [], [ItemFailure(batch[0], *_error_details(err))]
+        middle = len(batch) // 2
+        halves = [(half, call(half)) for half in (batch[:middle], batch[middle:])]
+        errors = [half_err for _, (_, half_err) in halves]
+        if None not in errors and _error_details(errors[0]) == _error_details(errors[1]):
+            raise errors[0]
+        results, failures = [], []
+        for half, (result, half_err) in halves:
+            if half_err is None:
+                results.append(result)
+            else:
+                half_results, half_failures = isolate(half, half_err)
+                results += half_results
+                failures += half_failures
+        return results, failures
+
+    def write(batch):
+        result, err = call(batch)
+        results, failures = ([result], []) if err is None else isolate(batch, err)
+        for result in results:
+            for item, (code, message) in (failed_items(result) if failed_items else {}).items():
+                failures.append(ItemFailure(item, code, message))
+        return BatchOutcome(results, failures)
+
+    outcomes = run_batches(write, items, batch_size, api_name, max_workers=max_workers)
+    return BatchOutcome([result for outcome in outcomes for result in outcome.results],
+                        [failure for outcome in outcomes for failure in outcome.failures])
+
+
+def failures_to_dicts(failures):
+    """Convert ItemFailure tuples to the dicts returned in the responses."""
+    return [{'resource': failure.item, 'code': failure.code, 'message': failure.message} for failure in failures]
@@ -0,0 +1,317 @@
+"""Deadline-aware execution with checkpoints and self-continuation.
+
+A Deadline follows the remaining time of the Lambda invocation. Once less than CHECKPOINT_MARGIN_MS is left, the
+streaming pipeline stops sending new batches, lets the batches in flight finish and stops discovery. The handler then
+saves a checkpoint and invokes the function again, as the worker of a job (see jobs), with the id of the checkpoint.
+The follow-up invocation loads it and skips what was already done.
+
+A synchronous request can also set its own budget with the ``maxApiCalls`` and ``maxDurationMs`` query string
+parameters. Once the budget is used up the handler saves a checkpoint and returns what it did with a continuation
+token instead, and the caller sends the same request again with ``continuationToken`` to resume. The token is opaque:
+it holds the id of the checkpoint and a fingerprint of the request, so it cannot resume a different request.
+
+The cursor of a checkpoint is the set of ARNs whose writes were sent, compressed, rather than the pagination tokens
+of the collectors: the pages of the describe APIs are cheap to list again, the tag writes are not, and a resource
+created or deleted between the two invocations cannot shift the cursor.
+
+A checkpoint of a large account does not fit in one store item (DynamoDB items are limited to 400 KB, and 100k ARNs
+take over 1 MB even compressed), so its state is compressed and split into items of CHECKPOINT_CHUNK_SIZE characters,
+written before the item of the checkpoint that counts them.
+"""
+import os
+import json
+import time
+import uuid
+import zlib
+import base64
+import hashlib
+import logging
+import binascii
+
+from utils import jobs, stores, throttling
+from utils.exceptions import InvalidInputException
+
+logger = logging.getLogger()
+
+# Key of the checkpoint id in the event of a follow-up invocation.
+CHECKPOINT_KEY = 'checkpointId'
+
+# Query string parameters of a synchronous request with a budget.
+MAX_API_CALLS_PARAM = 'maxApiCalls'
+MAX_DURATION_MS_PARAM = 'maxDurationMs'
+CONTINUATION_TOKEN_PARAM = 'continuationToken'
+# Parameters that do not change what a request does, left out of its fingerprint.
+CONTROL_PARAMS = ('async', MAX_API_CALLS_PARAM, MAX_DURATION_MS_PARAM, CONTINUATION_TOKEN_PARAM)
+# Hex digits of the request fingerprint kept in a continuation token.
+FINGERPRINT_LENGTH = 32
+
+DEFAULT_MARGIN_MS = 60000
+DEFAULT_MAX_INVOCATIONS = 20
+DEFAULT_CHECKPOINT_TTL = 24 * 3600
+DEFAULT_SLICE_SIZE = 100
+DEFAULT_CHUNK_SIZE = 300000
+
+
+def get_store():
+    """Get the checkpoint store configured by CHECKPOINT_STORE, which defaults to the job store."""
+    return stores.get_store(os.environ.get('CHECKPOINT_STORE') or os.environ.get('JOB_STORE'))
+
+
+def checkpoint_key(checkpoint_id):
+    """Key of a checkpoint in the store."""
+    return f"checkpoint:{checkpoint_id}"
+
+
+def save_state(checkpoint_id, state, store=None):
+    """Save the state of a checkpoint, split into chunks of CHECKPOINT_CHUNK_SIZE characters."""
+    store = store or get_store()
+    ttl = int(os.environ.get('CHECKPOINT_TTL', DEFAULT_CHECKPOINT_TTL))
+    size = int(os.environ.get('CHECKPOINT_CHUNK_SIZE', DEFAULT_CHUNK_SIZE))
+    data = base64.b64encode(zlib.compress(json.dumps(state).encode())).decode()
+    chunks = [data[start:start + size] for start in range(0, len(data), size)]
+    for index, chunk in enumerate(chunks):
+        store.put(f"{checkpoint_key(checkpoint_id)}:{index}", {'data': chunk}, ttl)
+    store.put(checkpoint_key(checkpoint_id), {'chunks': len(chunks)}, ttl)
+
+
+def load_state(checkpoint_id, store=None):
+    """Load the state saved by save_state.
+
+    Returns:
+        dict: The state, or None when the checkpoint or one of its chunks has expired
+    """
+    store = store or get_store()
+    head = store.get(checkpoint_key(checkpoint_id))
+    if head is None:
+        return None
+    chunks = [store.get(f"{checkpoint_key(checkpoint_id)}:{index}") for index in range(head['chunks'])]
+    if None in chunks:
+        return None
+    return json.loads(zlib.decompress(base64.b64decode(''.join(chunk['data'] for chunk in chunks))).decode())
+
+
+class Deadline(object):
+    """Remaining time of an invocation, with a safety margin for saving the checkpoint and answering.
+
+    Without a Lambda context, e.g. in local runs and tests, the deadline never expires.
+    """
+
+    def __init__(self, context=None, margin_ms=None):
+        self.context = context if hasattr(context, 'get_remaining_time_in_millis') else None
+        self.margin_ms = int(os.environ.get('CHECKPOINT_MARGIN_MS', DEFAULT_MARGIN_MS)) \
+            if margin_ms is None else margin_ms
+
+    def remaining_ms(self):
+        """Milliseconds left before the margin, or None without a context."""
+        if self.context is None:
+            return None
+        return self.context.get_remaining_time_in_millis() - self.margin_ms
+
+    def expired(self):
+        """Check whether the invocation should stop taking new work."""
+        remaining = self.remaining_ms()
+        return remaining is not None and remaining <= 0
+
+
+class Budget(Deadline):
+    """Deadline of a request with a budget of API calls and of milliseconds, on top of the Lambda timeout.
+
+    The API calls are the ones made to the account through the throttling controllers, discovery included.
+    """
+
+    def __init__(self, context=None, margin_ms=None, max_api_calls=None, max_duration_ms=None, account=None):
+        super().__init__(context, margin_ms)
+        self.max_api_calls = max_api_calls
+        self.max_duration_ms = max_duration_ms
+        self.account = account
+        self.start = time.monotonic()
+        self.start_calls = throttling.count_calls(account)
+
+    def api_calls(self):
+        """API calls made to the account since the budget started."""
+        return throttling.count_calls(self.account) - self.start_calls
+
+    def remaining_ms(self):
+        """Milliseconds left before the Lambda margin or the duration budget, or None without either."""
+        remaining = super().remaining_ms()
+        if self.max_duration_ms is not None:
+            left = self.max_duration_ms - int((time.monotonic() - self.start) * 1000)
+            remaining = left if remaining is None else min(remaining, left)
+        return remaining
+
+    def expired(self):
+        """Check whether the time or the API calls of the budget are used up."""
+        if super().expired():
+            return True
+        return self.max_api_calls is not None and self.api_calls() >= self.max_api_calls
+
+
+class Cursor(object):
+    """The ARNs written by this invocation and the ones before it."""
+
+    def __init__(self, done=()):
+        self.done = set(done)
+        self.written = []
+        self.stopped = False
+
+    def add(self, arns):
+        """Record ARNs whose write was sent."""
+        self.written.extend(arns)
+
+    def encode(self):
+        """Encode every written ARN into a compact string, for the checkpoint."""
+        arns = sorted(self.done.union(self.written))
+        return base64.b64encode(zlib.compress('\n'.join(arns).encode())).decode()
+
+    @classmethod
+    def decode(cls, encoded):
+        """Build a cursor from the string of encode."""
+        text = zlib.decompress(base64.b64decode(encoded)).decode() if encoded else ''
+        return cls(text.split('\n') if text else ())
+
+
+def get_checkpoint_id(event, store=None):
+    """Get the id of the checkpoint a request starts from: the one of a follow-up invocation, or the one of its
+    continuation token. Called while validating the request, so that an expired token is rejected before any call
+    to AWS.
+
+    Returns:
+        str: The checkpoint id, or None for a first invocation
+
+    Raises:
+        InvalidInputException: The continuation token is invalid or has expired
+    """
+    checkpoint_id = event.get(CHECKPOINT_KEY)
+    if checkpoint_id:
+        return checkpoint_id
+    continuation_id = get_continuation_id(event)
+    if continuation_id and (store or get_store()).get(checkpoint_key(continuation_id)) is None:
+        raise InvalidInputException(f"The {CONTINUATION_TOKEN_PARAM} has expired, send the request without it")
+    return continuation_id
+
+
+def load(checkpoint_id, store=None):
+    """Load the checkpoint a request starts from.
+
+    Args:
+        checkpoint_id: The id of get_checkpoint_id
+
+    Returns:
+        dict: The state saved by continue_later or save_continuation, or None for a first invocation or an expired
+        checkpoint
+    """
+    if not checkpoint_id:
+        return None
+    state = load_state(checkpoint_id, store)
+    if state is None:
+        logger.info(f"Checkpoint {checkpoint_id} has expired, starting over")
+    return state
+
+
+def get_invocation(state):
+    """Number of the current invocation of a request, 1 for the first one."""
+    return (state or {}).get('invocation', 0) + 1
+
+
+def can_continue(state):
+    """Check whether a request may be continued once more, within CHECKPOINT_MAX_INVOCATIONS."""
+    return get_invocation(state) < int(os.environ.get('CHECKPOINT_MAX_INVOCATIONS', DEFAULT_MAX_INVOCATIONS))
+
+
+def continue_later(event, context, handler, state, store=None):
+    """Save the state as a checkpoint and invoke the function again to continue from it.
+
+    The follow-up runs as the worker of the job of the request. A synchronous request gets a new job, whose id the
+    handler returns with a 202.
+
+    Args:
+        event (dict): The API Gateway event of the request
+        context: The Lambda context, see jobs.dispatch
+        handler: The handler of the request
+        state (dict): What the follow-up needs, e.g. {'written': cursor.encode()}, with the number of the current
+            invocation under 'invocation', see get_invocation
+
+    Returns:
+        str: The id of the job that continues the request
+    """
+    job_id = jobs.get_job_id(event) or jobs.create_job(status=jobs.RUNNING)['job_id']
+    save_state(job_id, state, store)
+    jobs.dispatch(event, context, handler, job_id, **{CHECKPOINT_KEY: job_id})
+    logger.info(f"Saved checkpoint {job_id} after invocation {state['invocation']}, continuing in a new invocation")
+    return job_id
+
+
+def get_budget_limits(event):
+    """Get the budget of a synchronous request from its query string parameters.
+
+    Returns:
+        dict: max_api_calls and max_duration_ms for Budget, or None when the request has no budget
+
+    Raises:
+        InvalidInputException: A limit is not a positive integer, or the request is also async
+    """
+    params = event.get('queryStringParameters') or {}
+    limits = {}
+    for param, name in ((MAX_API_CALLS_PARAM, 'max_api_calls'), (MAX_DURATION_MS_PARAM, 'max_duration_ms')):
+        value = params.get(param)
+        if value is None:
+            continue
+        if not value.isdigit() or int(value) == 0:
+            raise InvalidInputException(f"{param} should be a positive integer")
+        limits[name] = int(value)
+    if not limits and params.get(CONTINUATION_TOKEN_PARAM):
+        raise InvalidInputException(f"{CONTINUATION_TOKEN_PARAM} needs {MAX_API_CALLS_PARAM} or "
+                                    f"{MAX_DURATION_MS_PARAM}")
+    if limits and jobs.is_async(event):
+        raise InvalidInputException(f"{MAX_API_CALLS_PARAM} and {MAX_DURATION_MS_PARAM} cannot be used in async mode")
+    return limits or None
+
+
+def get_slice_size():
+    """Resources a request with a budget handles between two checks of the budget, when it works on a list."""
+    return int(os.environ.get('CONTINUATION_SLICE_SIZE', DEFAULT_SLICE_SIZE))
+
+
+def request_fingerprint(event):
+    """Hash of what a request does: its path, its body and the query string parameters that are not CONTROL_PARAMS."""
+    try:
+        body = json.loads(event.get('body') or 'null')
+    except ValueError:
+        body = event.get('body')
+    params = {key: value for key, value in (event.get('queryStringParameters') or {}).items()
+              if key not in CONTROL_PARAMS}
+    request = [event.get('pathParameters') or {}, params, body]
+    return hashlib.sha256(json.dumps(request, sort_keys=True).encode()).hexdigest()
+
+
+def get_continuation_id(event):
+    """Get the checkpoint id of the continuation token of a request.
+
+    Returns:
+        str: The checkpoint id, or None without a token
+
+    Raises:
+        InvalidInputException: The token is malformed or was issued for a different request
+    """
+    token = (event.get('queryStringParameters') or {}).get(CONTINUATION_TOKEN_PARAM)
+    if not token:
+        return None
+    try:
+        checkpoint_id, fingerprint = base64.urlsafe_b64decode(token.encode()).decode().split('.')
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise InvalidInputException(f"Invalid {CONTINUATION_TOKEN_PARAM}")
+    if fingerprint != request_fingerprint(event)[:FINGERPRINT_LENGTH]:
+        raise InvalidInputException(f"The {CONTINUATION_TOKEN_PARAM} was issued for a different request")
+    return checkpoint_id
+
+
+def save_continuation(event, state, store=None):
+    """Save the state as a checkpoint for a continuation token.
+
+    Returns:
+        str: The continuation token of the checkpoint
+    """
+    checkpoint_id = str(uuid.uuid4())
+    save_state(checkpoint_id, state, store)
+    token = f"{checkpoint_id}.{request_fingerprint(event)[:FINGERPRINT_LENGTH]}"
+    return base64.urlsafe_b64encode(token.encode()).decode()
@@ -0,0 +1,107 @@
+"""Process-wide pool of boto3 clients.
+
+Building a client loads its service model and opens its own connection pool, so clients are cached across warm
+invocations, keyed by (account, region, service). An entry is rebuilt when the credentials it was built with are
+replaced or are about to expire, and the least recently used entries are evicted beyond CLIENT_POOL_MAX_SIZE.
+"""
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict, namedtuple
+
+import boto3
+import botocore.config
+import botocore.utils
+
+from utils import throttling
+
+logger = logging.getLogger()
+
+DEFAULT_MAX_SIZE = 64
+DEFAULT_MAX_POOL_CONNECTIONS = 16
+# Clients are not handed out during the last minutes of their credentials' lifetime.
+EXPIRY_MARGIN_SECONDS = 300
+
+_PoolEntry = namedtuple('_PoolEntry', ['client', 'access_key_id', 'expires_at'])
+
+_clients = OrderedDict()
+_lock = threading.Lock()
+
+
+def parse_expiration(expiration):
+    """Convert the Expiration of STS credentials to epoch seconds.
+
+    Args:
+        expiration: datetime, ISO-8601 string or epoch seconds. None when the credentials do not say.
+
+    Returns:
+        float: Epoch seconds, or None when there is no expiration
+    """
+    if expiration in (None, ''):
+        return None
+    return botocore.utils.parse_timestamp(expiration).timestamp()
+
+
+def _is_fresh(entry, credentials):
+    if entry.access_key_id != credentials.get('AccessKeyId', ''):
+        return False
+    return entry.expires_at is None or time.time() < entry.expires_at - EXPIRY_MARGIN_SECONDS
+
+
+def get_client(service_name, credentials, account, region_name=None):
+    """Get a client for the account, reusing the cached one when its credentials are still valid.
+
+    Args:
+        service_name: The boto3 service name, e.g. 'ec2'
+        credentials (dict): STS credentials with AccessKeyId, SecretAccessKey, SessionToken and Expiration
+        account: The account the credentials belong to
+        region_name: The region of the client. None uses the default region of the Lambda function.
+
+    Returns:
+        The boto3 client
+    """
+    key = (account, region_name, service_name)
+    with _lock:
+        entry = _clients.get(key)
+        if entry is not None and _is_fresh(entry, credentials):
+            _clients.move_to_end(key)
+            return entry.client
+
+        client = boto3.client(
+            service_name=service_name,
+            region_name=region_name,
+            aws_access_key_id=credentials.get('AccessKeyId', ''),
+            aws_secret_access_key=credentials.get('SecretAccessKey', ''),
+            aws_session_token=credentials.get('SessionToken', ''),
+            config=botocore.config.Config(
+                max_pool_connections=int(os.environ.get('CLIENT_MAX_POOL_CONNECTIONS', DEFAULT_MAX_POOL_CONNECTIONS))
+            ))
+        throttling.register_client(client, account)
+        _clients[key] = _PoolEntry(client, credentials.get('AccessKeyId', ''),
+                                   parse_expiration(credentials.get('Expiration')))
+        _clients.move_to_end(key)
+
+        max_size = int(os.environ.get('CLIENT_POOL_MAX_SIZE', DEFAULT_MAX_SIZE))
+        while len(_clients) > max_size:
+            evicted_key, _ = _clients.popitem(last=False)
+            logger.info(f"Evicted client {evicted_key} from the client pool")
+        return client
+
+
+def get_clients(service_names, credentials, account, region_name=None):
+    """Get several clients for the same account and region.
+
+    Returns:
+        dict: service name to client
+    """
+    return {service_name: get_client(service_name, credentials, account, region_name)
+            for service_name in service_names}
+
+
+def invalidate(account=None):
+    """Drop the cached clients of an account, or all of them when account is None."""
+    with _lock:
+        for key in list(_clients):
+            if account is None or key[0] == account:
+                del _clients[key]
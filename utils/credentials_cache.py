@@ -0,0 +1,157 @@
+"""Warm-container cache of the admin credentials returned by vpcxiam.
+
+Credentials are kept per account until CREDENTIALS_REFRESH_MARGIN seconds before their Expiration. When several
+threads ask for the same account at once, one of them fetches and the others wait for its result.
+"""
+import os
+import json
+import time
+import logging
+import threading
+
+from utils.client_pool import parse_expiration
+
+logger = logging.getLogger()
+
+DEFAULT_REFRESH_MARGIN = 300
+# Without an Expiration the credentials are kept for the STS default session duration minus the margin.
+DEFAULT_TTL = 3600
+
+# Error codes AWS returns when it does not accept the credentials.
+CREDENTIALS_ERROR_CODES = frozenset([
+    'ExpiredToken',
+    'ExpiredTokenException',
+    'InvalidClientTokenId',
+    'UnrecognizedClientException',
+    'AuthFailure',
+    'InvalidToken',
+    'RequestExpired',
+])
+
+
+class _Fetch(object):
+    """An in-flight fetch that other threads can wait on."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.credentials = None
+        self.error = None
+
+
+class CredentialsCache(object):
+    """Credentials per account, with one in-flight fetch per account."""
+
+    def __init__(self, refresh_margin=None):
+        self.refresh_margin = refresh_margin if refresh_margin is not None else int(
+            os.environ.get('CREDENTIALS_REFRESH_MARGIN', DEFAULT_REFRESH_MARGIN))
+        self._credentials = {}
+        self._fetches = {}
+        self._lock = threading.Lock()
+
+    def _is_fresh(self, entry):
+        _, expires_at = entry
+        return time.time() < expires_at - self.refresh_margin
+
+    def get(self, account, fetch, force_refresh=False):
+        """Get the credentials of an account, calling fetch only when there are no fresh ones.
+
+        Args:
+            account: The account the credentials are for
+            fetch: Callable returning the credentials dict (AccessKeyId, SecretAccessKey, SessionToken, Expiration)
+            force_refresh (bool): Ignore the cached credentials, e.g. after AWS rejected them
+
+        Returns:
+            dict: The credentials
+
+        Raises:
+            Exception: The error raised by fetch, also raised in the threads that waited for it.
+        """
+        with self._lock:
+            entry = self._credentials.get(account)
+            if entry is not None and not force_refresh and self._is_fresh(entry):
+                return entry[0]
+            pending = self._fetches.get(account)
+            leader = pending is None
+            if leader:
+                pending = self._fetches[account] = _Fetch()
+
+        if not leader:
+            pending.done.wait()
+            if pending.error is not None:
+                raise pending.error
+            return pending.credentials
+
+        try:
+            credentials = fetch()
+            expires_at = parse_expiration(credentials.get('Expiration'))
+            if expires_at is None:
+                expires_at = time.time() + DEFAULT_TTL
+            with self._lock:
+                self._credentials[account] = (credentials, expires_at)
+            pending.credentials = credentials
+            return credentials
+        except Exception as err:
+            pending.error = err
+            raise
+        finally:
+            with self._lock:
+                del self._fetches[account]
+            pending.done.set()
+
+    def invalidate(self, account=None):
+        """Forget the credentials of an account, or of all the accounts when account is None."""
+        with self._lock:
+            if account is None:
+                self._credentials.clear()
+            else:
+                self._credentials.pop(account, None)
+
+
+_cache = CredentialsCache()
+
+
+def fetch_admin_credentials(api_requests, vpcxiam_endpoint, vpcxiam_host, vpcxiam_scope, account):
+    """Get the admin role credentials of an account from vpcxiam.
+
+    Args:
+        api_requests: api_request.ApiRequests instance
+        vpcxiam_endpoint: The vpcxiam API endpoint
+        vpcxiam_host: The Host header of the vpcxiam API
+        vpcxiam_scope: The Azure AD scope of the vpcxiam API
+        account: The account to get the credentials for
+
+    Returns:
+        dict: The credentials
+
+    Raises:
+        ValueError: vpcxiam returned an error
+    """
+    url = (vpcxiam_endpoint +
+           f"/v1/accounts/{account}/roles/admin/credentials")
+    additional_headers = {
+        'Host': vpcxiam_host
+    }
+    credentials = json.loads(
+        (api_requests.request(url=url, method='get', scope=vpcxiam_scope, additional_headers=additional_headers)).text
+    )
+    error = credentials.get('error', {})
+    if error:
+        logger.error(error)
+        raise ValueError(error)
+    return credentials.get('credentials', {})
+
+
+def get_admin_credentials(account, fetch, force_refresh=False):
+    """Get the admin credentials of an account from the process-wide cache. See CredentialsCache.get."""
+    return _cache.get(account, fetch, force_refresh=force_refresh)
+
+
+def invalidate(account=None):
+    """Forget the cached admin credentials of an account, or of all the accounts."""
+    _cache.invalidate(account)
+
+
+def is_credentials_error(err):
+    """Check whether a boto3 error means AWS rejected the credentials."""
+    response = getattr(err, 'response', None) or {}
+    return response.get('Error', {}).get('Code') in CREDENTIALS_ERROR_CODES
@@ -0,0 +1,318 @@
+"""Concurrent discovery of the storage resources in an account.
+
+Collectors are plain callables (usually the ``get_*`` functions in this package). They are run on a bounded thread
+pool, at most ``service_limits[service]`` at a time per AWS service, and their results are merged back in the order
+the collectors were given so that the output does not depend on which API answered first.
+
+The ``rgta`` backend is an alternative to the per-service collectors: one Resource Groups Tagging API scan over all
+the storage resource types, EBS volumes included, that returns every ARN with its tags. It only sees resources that
+carry, or once carried, a tag, so resources that were never tagged are missed and the per-service collectors stay
+the default. It also lists the replica tables of a DynamoDB global table rather than its global-table ARN.
+"""
+import os
+import time
+import logging
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from utils import dynamodb, ebs, efs, fsx, rds, redshift, resource_groups_tagging_api, throttling
+from utils.exceptions import InvalidInputException
+
+logger = logging.getLogger()
+
+DEFAULT_MAX_WORKERS = 8
+DEFAULT_SERVICE_LIMIT = 2
+DEFAULT_SERVICE_LIMITS = {
+    'rds': 4,
+    'dynamodb': 2,
+    'elasticfilesystem': 1,
+    'fsx': 1,
+    'redshift': 1,
+    'resourcegroupstaggingapi': 1,
+}
+
+# Name of the collector returning the ARNs with the skip tag. Its result is not merged into the storage resources.
+SKIP_COLLECTOR = 'resources_to_skip'
+
+SERVICES_BACKEND = 'services'
+RGTA_BACKEND = 'rgta'
+BACKENDS = (SERVICES_BACKEND, RGTA_BACKEND)
+
+# The resource types found by the per-service collectors and tag_all_ebs_volumes.
+STORAGE_RESOURCE_TYPES = [
+    'rds:db',
+    'rds:cluster',
+    'rds:global-cluster',
+    'rds:ri',
+    'dynamodb:table',
+    'dynamodb:global-table',
+    'elasticfilesystem:file-system',
+    'fsx:file-system',
+    'redshift:cluster',
+    'ec2:volume',
+]
+
+# Classification of the resources found by the rgta backend.
+TAG = 'tag'
+SKIP = 'skip'
+LEGAL_HOLD = 'legal-hold'
+
+Collector = namedtuple('Collector', ['name', 'service', 'func', 'args'])
+DiscoveryResult = namedtuple('DiscoveryResult', ['results', 'timings'])
+TaggedResource = namedtuple('TaggedResource', ['arn', 'tags', 'classification'])
+# arns and skip_arns exclude the EBS volumes, which are returned as ebs.VolumeRecord in volumes.
+RgtaInventory = namedtuple('RgtaInventory', ['arns', 'skip_arns', 'tags', 'volumes', 'counts', 'timings'])
+
+
+def get_max_workers():
+    """Read the discovery pool size from the DISCOVERY_MAX_WORKERS environment variable."""
+    return int(os.environ.get('DISCOVERY_MAX_WORKERS', DEFAULT_MAX_WORKERS))
+
+
+def get_service_limits():
+    """Read the per-service concurrency limits.
+
+    The DISCOVERY_SERVICE_CONCURRENCY environment variable overrides the defaults, e.g. ``rds=2,dynamodb=1``.
+
+    Returns:
+        dict: service name to the maximum number of its collectors allowed to run at the same time
+    """
+    service_limits = dict(DEFAULT_SERVICE_LIMITS)
+    for entry in os.environ.get('DISCOVERY_SERVICE_CONCURRENCY', '').split(','):
+        if '=' in entry:
+            service, limit = entry.split('=', 1)
+            service_limits[service.strip()] = max(1, int(limit))
+    return service_limits
+
+
+def get_backend(event):
+    """Get the discovery backend of a request: the ``discovery`` query string parameter, or the DISCOVERY_BACKEND
+    environment variable, which defaults to services.
+
+    Raises:
+        InvalidInputException: The backend is neither services nor rgta
+    """
+    params = event.get('queryStringParameters') or {}
+    backend = params.get('discovery') or os.environ.get('DISCOVERY_BACKEND', SERVICES_BACKEND)
+    if backend not in BACKENDS:
+        raise InvalidInputException(f"discovery should be one of {list(BACKENDS)}")
+    return backend
+
+
+def is_strict(event):
+    """Check whether a request asks for strict ARNs: the ``strict`` query string parameter, or the DISCOVERY_STRICT
+    environment variable, is true."""
+    params = event.get('queryStringParameters') or {}
+    return (params.get('strict') or os.environ.get('DISCOVERY_STRICT', 'false')).lower() == 'true'
+
+
+def build_storage_collectors(clients, region, account_id, partition='aws', strict=False):
+    """Build the collectors used by the storage tagging handler.
+
+    The four RDS paginators are separate collectors so they can run side by side under the rds limit.
+
+    Args:
+        clients (dict): boto3 clients keyed by service name (rds, dynamodb, efs, fsx, redshift,
+            resourcegroupstaggingapi)
+        region: The region being tagged
+        account_id: The AWS account id
+        partition: The AWS partition of the account, used to build the DynamoDB ARNs
+        strict (bool): Read the DynamoDB ARNs with describe calls instead of building them
+
+    Returns:
+        list: Collector tuples in the order their results should be merged
+    """
+    return [
+        Collector('rds_db_instances', 'rds', rds.get_db_instance_arns, (clients['rds'],)),
+        Collector('rds_db_clusters', 'rds', rds.get_db_cluster_arns, (clients['rds'],)),
+        Collector('rds_global_clusters', 'rds', rds.get_global_cluster_arns, (clients['rds'],)),
+        Collector('rds_reserved_db_instances', 'rds', rds.get_reserved_db_instance_arns, (clients['rds'],)),
+        Collector('dynamodb_tables', 'dynamodb', dynamodb.get_dynamodb_tables,
+                  (clients['dynamodb'], region, account_id, partition, strict)),
+        Collector('efs_file_systems', 'elasticfilesystem', efs.get_efs_file_systems, (clients['efs'],)),
+        Collector('fsx_file_systems', 'fsx', fsx.get_fsx_file_systems, (clients['fsx'],)),
+        Collector('redshift_clusters', 'redshift', redshift.get_redshift_cluster_arns,
+                  (clients['redshift'], region, account_id)),
+        Collector(SKIP_COLLECTOR, 'resourcegroupstaggingapi', resource_groups_tagging_api.get_all_resources_to_skip,
+                  (clients['resourcegroupstaggingapi'],)),
+    ]
+
+
+def build_streaming_collectors(clients, region, account_id, partition='aws', strict=False):
+    """Build the storage collectors as generators yielding ARNs page by page, for utils.pipeline.
+
+    The skip collector is left out: the skip ARNs have to be known before the first write.
+    See build_storage_collectors for the arguments.
+    """
+    rds_collectors = [Collector(f"rds_{name}", 'rds', rds.iter_arns, (clients['rds'], action))
+                      for name, action in (('db_instances', 'describe_db_instances'),
+                                           ('db_clusters', 'describe_db_clusters'),
+                                           ('global_clusters', 'describe_global_clusters'),
+                                           ('reserved_db_instances', 'describe_reserved_db_instances'))]
+    if strict:
+        # The describe calls of strict mode run concurrently, so the table ARNs come as one list.
+        dynamodb_collector = Collector('dynamodb_tables', 'dynamodb', dynamodb.get_dynamodb_tables,
+                                       (clients['dynamodb'], region, account_id, partition, True))
+    else:
+        dynamodb_collector = Collector('dynamodb_tables', 'dynamodb', dynamodb.iter_dynamodb_tables,
+                                       (clients['dynamodb'], region, account_id, partition))
+    return rds_collectors + [
+        dynamodb_collector,
+        Collector('efs_file_systems', 'elasticfilesystem', efs.iter_efs_file_systems, (clients['efs'],)),
+        Collector('fsx_file_systems', 'fsx', fsx.iter_fsx_file_systems, (clients['fsx'],)),
+        Collector('redshift_clusters', 'redshift', redshift.iter_redshift_cluster_arns,
+                  (clients['redshift'], region, account_id)),
+    ]
+
+
+def _timed_call(collector):
+    """Run one collector and return (result, error, elapsed milliseconds) instead of raising."""
+    start = time.monotonic()
+    result, error = None, None
+    try:
+        result = collector.func(*collector.args)
+    except Exception as err:  # pylint: disable=broad-except
+        error = err
+    elapsed_ms = int((time.monotonic() - start) * 1000)
+    logger.info(f"Collector {collector.name} finished in {elapsed_ms} ms")
+    return result, error, elapsed_ms
+
+
+def run_collectors(collectors, max_workers=None, service_limits=None):
+    """Run the collectors on a bounded thread pool.
+
+    A collector is only submitted once its service is below its limit, so no pool thread is ever parked waiting for
+    a slot. If any collector fails, the error of the first failing collector (in the given order) is raised once all
+    the running collectors have finished.
+
+    Args:
+        collectors (list): Collector tuples. Names must be unique.
+        max_workers (int): Size of the thread pool. Defaults to get_max_workers().
+        service_limits (dict): Per-service concurrency limits. Defaults to get_service_limits().
+
+    Returns:
+        DiscoveryResult: ``results`` maps collector name to its return value and ``timings`` maps collector name
+        (and ``total``) to the elapsed milliseconds, both in collector order.
+
+    Raises:
+        Exception: The exception raised by the first failing collector.
+    """
+    max_workers = max_workers or get_max_workers()
+    service_limits = get_service_limits() if service_limits is None else service_limits
+    pending = list(collectors)
+    running = {}
+    in_flight = {}
+    results = {}
+    errors = {}
+    timings = {}
+    start = time.monotonic()
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while pending or running:
+            for collector in list(pending):
+                if len(running) >= max_workers:
+                    break
+                limit = service_limits.get(collector.service, DEFAULT_SERVICE_LIMIT)
+                if in_flight.get(collector.service, 0) >= limit:
+                    continue
+                pending.remove(collector)
+                in_flight[collector.service] = in_flight.get(collector.service, 0) + 1
+                running[executor.submit(_timed_call, collector)] = collector
+
+            done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+            for future in done:
+                collector = running.pop(future)
+                in_flight[collector.service] -= 1
+                result, error, timings[collector.name] = future.result()
+                if error is not None:
+                    errors[collector.name] = error
+                else:
+                    results[collector.name] = result
+
+    for collector in collectors:
+        if collector.name in errors:
+            raise errors[collector.name]
+
+    ordered_timings = OrderedDict((collector.name, timings[collector.name]) for collector in collectors)
+    ordered_timings['total'] = int((time.monotonic() - start) * 1000)
+    return DiscoveryResult(OrderedDict((collector.name, results[collector.name]) for collector in collectors),
+                           ordered_timings)
+
+
+def merge_results(results, exclude=()):
+    """Concatenate the list results of the collectors in collector order.
+
+    Args:
+        results (OrderedDict): collector name to list of ARNs, as returned in DiscoveryResult.results
+        exclude (tuple): collector names to leave out of the merged list
+
+    Returns:
+        list: The merged ARN list
+    """
+    merged = []
+    for name, arns in results.items():
+        if name not in exclude:
+            merged.extend(arns)
+    return merged
+
+
+def classify(tags):
+    """Classify a resource by its tags: skip when vpcx-skip-backup is true, legal-hold when vpcx-backup is
+    legal-hold, tag otherwise."""
+    if tags.get(ebs.SKIP_TAG_KEY) == 'true':
+        return SKIP
+    if tags.get(ebs.BACKUP_TAG_KEY) == 'legal-hold':
+        return LEGAL_HOLD
+    return TAG
+
+
+def iter_tagged_resources(resource_tagging_client, resource_types=None):
+    """Stream the storage resources of the account with their tags from one get_resources pagination.
+
+    Args:
+        resource_tagging_client: ResourceGroupsTaggingAPI client that is authenticated for the account.
+        resource_types: The RGTA resource types to scan. Defaults to STORAGE_RESOURCE_TYPES.
+
+    Yields:
+        TaggedResource: arn, tags dict and classification
+
+    Raises:
+        ClientError: Error from boto3.
+    """
+    for page in throttling.paginate(resource_tagging_client, 'get_resources',
+                                    ResourceTypeFilters=resource_types or STORAGE_RESOURCE_TYPES):
+        for resource in page.get('ResourceTagMappingList', []):
+            tags = {tag['Key']: tag['Value'] for tag in resource.get('Tags', [])}
+            yield TaggedResource(resource.get('ResourceARN'), tags, classify(tags))
+
+
+def run_rgta_discovery(resource_tagging_client, tag_keys=()):
+    """Discover the storage resources with the rgta backend.
+
+    Args:
+        resource_tagging_client: ResourceGroupsTaggingAPI client that is authenticated for the account.
+        tag_keys: The tag keys to keep in ``tags`` and in the volume records, for the diff
+
+    Returns:
+        RgtaInventory: the ARNs and skip ARNs in the same form as the per-service collectors, the kept tags per ARN,
+        the EBS volume records, the count of each classification and the elapsed milliseconds
+    """
+    start = time.monotonic()
+    keys = set(tag_keys) | {ebs.SKIP_TAG_KEY, ebs.BACKUP_TAG_KEY}
+    arns, skip_arns, volumes = [], [], []
+    resource_tags = {}
+    counts = OrderedDict((classification, 0) for classification in (TAG, SKIP, LEGAL_HOLD))
+    for resource in iter_tagged_resources(resource_tagging_client):
+        counts[resource.classification] += 1
+        tags = {key: value for key, value in resource.tags.items() if key in keys}
+        arn_parts = resource.arn.split(':', 5)
+        if arn_parts[2] == 'ec2' and arn_parts[5].startswith('volume/'):
+            volumes.append(ebs.volume_record(arn_parts[5][len('volume/'):], tags))
+            continue
+        arns.append(resource.arn)
+        resource_tags[resource.arn] = tags
+        if resource.classification == SKIP:
+            skip_arns.append(resource.arn)
+    timings = OrderedDict([(RGTA_BACKEND, int((time.monotonic() - start) * 1000))])
+    timings['total'] = timings[RGTA_BACKEND]
+    return RgtaInventory(arns, skip_arns, resource_tags, volumes, counts, timings)
@@ -1,12 +1,35 @@
+from concurrent.futures import ThreadPoolExecutor
+
 import botocore.exceptions
 
+from utils import throttling
+
+# describe_table and describe_global_table calls sent at the same time in strict mode.
+DEFAULT_STRICT_WORKERS = 8
+
+
+def table_arn(partition, region, account_id, table_name):
+    """Build the ARN of a DynamoDB table."""
+    return f"arn:{partition}:dynamodb:{region}:{account_id}:table/{table_name}"
+
+
+def global_table_arn(partition, account_id, global_table_name):
+    """Build the ARN of a DynamoDB global table (version 2017.11.29). Global table ARNs have no region."""
+    return f"arn:{partition}:dynamodb::{account_id}:global-table/{global_table_name}"
+
 
-def get_dynamodb_tables(dynamodb_client, region):
-    """List all the DynamoDB tables. From the table names describe and get the ARN
+def get_dynamodb_tables(dynamodb_client, region, account_id=None, partition='aws', strict=False,
+                        max_workers=DEFAULT_STRICT_WORKERS):
+    """List all the DynamoDB tables and build their ARNs from the table names.
 
     Args:
         dynamodb_client: The DynamoDB client authenticated for the account
         regio: The region in which the dynamodb tables have to be tagged
+        account_id: The AWS account id. Without it the ARNs are read with the describe calls, as in strict mode.
+        partition: The AWS partition of the account
+        strict: Read every ARN with describe_table and describe_global_table instead of building it. The calls are
+            sent concurrently on up to max_workers threads.
+        max_workers: The number of describe calls sent at the same time in strict mode
 
     Returns:
       The list of dynamodb table arns that need to be tagged with the vpcx-backup tag
@@ -15,49 +38,61 @@ def get_dynamodb_tables(dynamodb_client, region):
       ClientError: Error from boto3.ed.
     """
     try:
-        dynamodb_table_names = []
-        dynamodb_table_arns = []
-        dynamodb_global_table_names = []
-        dynamodb_global_table_arns = []
-
-        # Get the table names.
-        paginator = dynamodb_client.get_paginator('list_tables')
-        response_iterator = paginator.paginate()
-        for page in response_iterator:
-            for table_name in page.get('TableNames', []):
-                dynamodb_table_names.append(table_name)
-
-        for table_name in dynamodb_table_names:
-            response = dynamodb_client.describe_table(
-                TableName=table_name
-            )
-            dynamodb_table_arns.append(response.get('Table', {}).get('TableArn'))
-
-        # Get the global table names
-        response = dynamodb_client.list_global_tables(
-            RegionName=region
-        )
-        exclusive_start_global_table_name = response.get('LastEvaluatedGlobalTableName', None)
-        for global_table in response.get('GlobalTables', []):
-            dynamodb_global_table_names.append(global_table.get('GlobalTableName'))
-        # Paginate for the remaining responses.
-        while exclusive_start_global_table_name is not None:
-            response = dynamodb_client.list_global_tables(
-                ExclusiveStartGlobalTableName=exclusive_start_global_table_name,
-                RegionName=region
-            )
-            exclusive_start_global_table_name = response.get('LastEvaluatedGlobalTableName', None)
-            for global_table in response.get('GlobalTables', []):
-                dynamodb_global_table_names.append(global_table.get('GlobalTableName'))
-
-        # Get the global table ARNs
-        for global_table_name in dynamodb_global_table_names:
-            response = dynamodb_client.describe_global_table(
-                GlobalTableName=global_table_name
-            )
-            dynamodb_global_table_arns.append(response.get('GlobalTableDescription').get('GlobalTableArn'))
+        if account_id is not None and not strict:
+            return list(iter_dynamodb_tables(dynamodb_client, region, account_id, partition))
+
+        def describe_table(table_name):
+            response = throttling.call(dynamodb_client, 'describe_table', TableName=table_name)
+            return response.get('Table', {}).get('TableArn')
+
+        def describe_global_table(global_table_name):
+            response = throttling.call(dynamodb_client, 'describe_global_table', GlobalTableName=global_table_name)
+            return response.get('GlobalTableDescription').get('GlobalTableArn')
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            dynamodb_table_arns = list(executor.map(describe_table, _iter_table_names(dynamodb_client)))
+            dynamodb_global_table_arns = list(executor.map(describe_global_table,
+                                                           _iter_global_table_names(dynamodb_client, region)))
 
         # Combine the list of ARNs to have a common list of the DynamoDB ARNs to tag
         return dynamodb_table_arns + dynamodb_global_table_arns
     except botocore.exceptions.ClientError:
         raise
+
+
+def iter_dynamodb_tables(dynamodb_client, region, account_id, partition='aws'):
+    """Yield the ARNs of the tables, then of the global tables, built from the names as the pages arrive.
+    See get_dynamodb_tables."""
+    for table_name in _iter_table_names(dynamodb_client):
+        yield table_arn(partition, region, account_id, table_name)
+    for global_table_name in _iter_global_table_names(dynamodb_client, region):
+        yield global_table_arn(partition, account_id, global_table_name)
+
+
+def _iter_table_names(dynamodb_client):
+    # Get the table names.
+    for page in throttling.paginate(dynamodb_client, 'list_tables'):
+        for table_name in page.get('TableNames', []):
+            yield table_name
+
+
+def _iter_global_table_names(dynamodb_client, region):
+    # Get the global table names
+    response = throttling.call(
+        dynamodb_client, 'list_global_tables',
+        RegionName=region
+    )
+    for global_table in response.get('GlobalTables', []):
+        yield global_table.get('GlobalTableName')
+    exclusive_start_global_table_name = response.get('LastEvaluatedGlobalTableName', None)
+
+    # Paginate for the remaining responses.
+    while exclusive_start_global_table_name is not None:
+        response = throttling.call(
+            dynamodb_client, 'list_global_tables',
+            ExclusiveStartGlobalTableName=exclusive_start_global_table_name,
+            RegionName=region
+        )
+        exclusive_start_global_table_name = response.get('LastEvaluatedGlobalTableName', None)
+        for global_table in response.get('GlobalTables', []):
+            yield global_table.get('GlobalTableName')
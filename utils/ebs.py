@@ -1,7 +1,55 @@
+import logging
+from collections import namedtuple
+
 import botocore.exceptions
 
+from utils import batch_executor, helpers, tag_plan, throttling
+from utils.retry_queue import RetryQueue
+
+logger = logging.getLogger()
+
+# CreateTags and DeleteTags accept at most 1000 resource ids per call.
+# More details here:
+# https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/ec2.html#EC2.Client.create_tags
+EC2_BATCH_SIZE = 1000
+# Values per filter of the describe calls.
+EC2_FILTER_BATCH_SIZE = 200
+
+SKIP_TAG_KEY = 'vpcx-skip-backup'
+BACKUP_TAG_KEY = 'vpcx-backup'
+
+VolumeRecord = namedtuple('VolumeRecord', ['volume_id', 'skip', 'legal_hold', 'tags'])
+
+
+def iter_volumes(ec2_client, tag_keys=()):
+    """Stream a compact record of every EBS volume in the account from a single describe_volumes scan.
+
+    Only the volume id and the tags this module works with are kept, not the full volume dictionaries.
+
+    Args:
+        ec2_client: The authenticated ec2_client for the account
+        tag_keys: Other tag keys to keep in the records, e.g. the keys of the request for the diff
+
+    Yields:
+        VolumeRecord: volume_id, skip (vpcx-skip-backup is true), legal_hold (vpcx-backup is legal-hold) and the
+        kept tags
 
-def tag_all_ebs_volumes(ec2_client, tag_list, vpcx_backup_tag):
+    Raises:
+        ClientError: boto3 client error
+    """
+    keys = set(tag_keys) | {SKIP_TAG_KEY, BACKUP_TAG_KEY}
+    for page in throttling.paginate(ec2_client, 'describe_volumes'):
+        for volume in page.get('Volumes', []):
+            tags = {tag['Key']: tag.get('Value') for tag in volume.get('Tags') or [] if tag['Key'] in keys}
+            yield volume_record(volume.get('VolumeId'), tags)
+
+
+def volume_record(volume_id, tags):
+    """Build the VolumeRecord of a volume from its tags dict."""
+    return VolumeRecord(volume_id, tags.get(SKIP_TAG_KEY) == 'true', tags.get(BACKUP_TAG_KEY) == 'legal-hold', tags)
+
+
+def tag_all_ebs_volumes(ec2_client, tag_list, vpcx_backup_tag, max_workers=None, diff=False, retry_queue=None):
     """
     Tag all the EBS volumes in the account. Volumes ANRs can't be queried through boto3 ec2_client, hence they have
     to be tagged using the ec2_client instead of the resourcegroupstaggingapi
@@ -9,103 +57,230 @@ def tag_all_ebs_volumes(ec2_client, tag_list, vpcx_backup_tag):
     :param ec2_client: The authenticated ec2 client for the account
     :param tag_list: The tag list that has to be applied on the EBS volumes
     :param vpcx_backup_tag: The vpcx_backup_tag that should be applied on the EBS volumes
+    :param max_workers: The number of create_tags batches sent at the same time. Defaults to BATCH_MAX_WORKERS.
+    :param diff: Only send the tags a volume does not already carry, using the tags returned by describe_volumes
+    :return: The kept, skipped and unknown volume counts, see helpers.ArnPartition.counts, and the plans
+             of the create_tags calls under 'plans'
+    """
+    # Get all the volume ids in the account and the ones with the skip backups tag in one scan.
+    volumes = iter_volumes(ec2_client, list(tag_list) if diff else ())
+    return tag_volumes(ec2_client, volumes, tag_list, vpcx_backup_tag, max_workers=max_workers, diff=diff,
+                       retry_queue=retry_queue)
+
+
+def tag_volumes(ec2_client, volumes, tag_list, vpcx_backup_tag, max_workers=None, diff=False, retry_queue=None):
+    """
+    Tag the given EBS volumes, leaving out the ones with the skip backups tag. See tag_all_ebs_volumes.
+
+    :param ec2_client: The authenticated ec2 client for the account
+    :param volumes: VolumeRecord iterable, e.g. iter_volumes
+    :param tag_list: The tag list that has to be applied on the EBS volumes
+    :param vpcx_backup_tag: The vpcx_backup_tag that should be applied on the EBS volumes
+    :param max_workers: The number of create_tags batches sent at the same time. Defaults to BATCH_MAX_WORKERS.
+    :param diff: Only send the tags a volume does not already carry, according to the tags of the records
+    :param retry_queue: retry_queue.RetryQueue collecting the volumes that could not be tagged. By default they are
+        retried before returning.
+    :return: The kept, skipped and unknown volume counts, the plans of the create_tags calls under 'plans' and the
+        volumes that could not be tagged under 'failures', empty when a retry_queue is given
     """
     try:
         volume_ids = []
         volume_ids_to_skip = []
+        current_tags = {} if diff else None
+        # Skip volumes if the vpcx-backup tag value is not legal-hold
+        can_skip = bool(vpcx_backup_tag) and vpcx_backup_tag["vpcx-backup"] != "legal-hold"
 
-        # Get all the volume ids in the account.
-        paginator = ec2_client.get_paginator('describe_volumes')
-        response_iterator = paginator.paginate()
-        for page in response_iterator:
-            for volume in page.get('Volumes', []):
-                volume_ids.append(volume.get('VolumeId'))
+        for volume in volumes:
+            volume_ids.append(volume.volume_id)
+            if can_skip and volume.skip:
+                volume_ids_to_skip.append(volume.volume_id)
+            if diff:
+                current_tags[volume.volume_id] = volume.tags
 
-        # Skip volumes if the vpcx-backup tag value is not legal-hold
-        if vpcx_backup_tag:
-            if vpcx_backup_tag["vpcx-backup"] != "legal-hold":
-                # Can skip the volumes with skip backups tag
-                response_iterator = paginator.paginate(
-                    Filters=[
-                        {
-                            'Name': 'tag:vpcx-skip-backup',
-                            'Values': ['true']
-                        }
-                    ]
-                )
-                for page in response_iterator:
-                    for volume in page.get('Volumes', []):
-                        volume_ids_to_skip.append(volume.get('VolumeId'))
-
-        # Filter the volumes ids to tag
-        volume_ids_vpcx_backup_tag = volume_ids
-        for volume_id in volume_ids_to_skip:
-            volume_ids_vpcx_backup_tag.remove(volume_id)
-
-        # Tag using the EC2 create-tags API. Attempt to tag 1000 volume ids in each iteration as 1000 ResourceIds at
-        # a time is the API limitation.
-        # More details here:
-        # https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/ec2.html#EC2.Client.create_tags
-        tags = []
-        for key in tag_list:
-            tags.append({
-                'Key': key,
-                'Value': tag_list.get(key)
-            })
-        if len(tags) != 0:
-            # Tag only if there is at least 1 tag in the tag list.
-            for i in range(0, len(volume_ids), 1000):
-                ec2_client.create_tags(
-                    Resources=volume_ids[i:i+1000],
-                    Tags=tags
-                )
+        # Filter the volumes ids to tag. Both tag sets go to the volumes that are not skipped.
+        partition = helpers.partition_arns(volume_ids, volume_ids_to_skip)
 
-        if len(vpcx_backup_tag.keys()) != 0:
-            # Tag the volumes with vpcx-backup tag
-            for i in range(0, len(volume_ids_vpcx_backup_tag), 1000):
-                ec2_client.create_tags(
-                    Resources=volume_ids_vpcx_backup_tag[i:i+1000],
-                    Tags=[
-                        {
-                            'Key': 'vpcx-backup',
-                            'Value': vpcx_backup_tag.get('vpcx-backup')
-                        }
-                    ]
-                )
+        # Tag using the EC2 create-tags API, 1000 volume ids per call as 1000 ResourceIds at a time is the API
+        # limitation. The tag list and the vpcx-backup tag are sent together, one call per distinct tag dict.
+        queue = retry_queue or RetryQueue()
+        plans = [tag_plan.apply(
+            tag_plan.plan_tag_sets([(partition.kept, tag_list), (partition.kept, vpcx_backup_tag)], current_tags),
+            lambda tags, ids: _create_tags_retried(ec2_client, ids, tags, queue, max_workers)
+        )]
+        counts = partition.counts()
+        counts['plans'] = plans
+        counts['failures'] = [] if retry_queue else batch_executor.failures_to_dicts(queue.drain())
+        return counts
 
     except botocore.exceptions.ClientError:
         raise
 
 
-def tag_untag_skip_backup_ebs_volumes(ec2_client, volume_ids, tag_list):
+def _to_ec2_tags(tags):
+    return [{'Key': key, 'Value': value} for (key, value) in tags.items()]
+
+
+def _create_tags_retried(ec2_client, volume_ids, tags, queue, max_workers=None):
+    def write(ids):
+        return create_tags(ec2_client, ids, _to_ec2_tags(tags), max_workers=max_workers).failures
+    queue.add(('create_tags', tuple(sorted(tags.items()))), write, write(volume_ids))
+
+
+def _delete_tags_retried(ec2_client, volume_ids, tags, queue, max_workers=None):
+    def write(ids):
+        return delete_tags(ec2_client, ids, tags, max_workers=max_workers).failures
+    queue.add(('delete_tags', tuple((tag['Key'], tag.get('Value')) for tag in tags)), write, write(volume_ids))
+
+
+def get_volume_tags(ec2_client, volume_ids):
+    """Get the current tags of the given volumes.
+
+    Args:
+        ec2_client: The authenticated ec2_client for the account
+        volume_ids: The ids of the volumes
+
+    Returns:
+        dict: volume id to a dict of its tags. Volumes that do not exist are missing.
+
+    Raises:
+        ClientError: boto3 client error
+    """
+    try:
+        volume_tags = {}
+        for batch in batch_executor.chunks(list(volume_ids), EC2_FILTER_BATCH_SIZE):
+            for page in throttling.paginate(ec2_client, 'describe_volumes',
+                                            Filters=[{'Name': 'volume-id', 'Values': batch}]):
+                for volume in page.get('Volumes', []):
+                    volume_tags[volume.get('VolumeId')] = tag_plan.tags_to_dict(volume.get('Tags'))
+        return volume_tags
+    except botocore.exceptions.ClientError:
+        raise
+
+
+def create_tags(ec2_client, resource_ids, tags, max_workers=None):
+    """Add tags to EC2 resources, sending the 1000-id batches concurrently.
+
+    Args:
+        ec2_client: The authenticated ec2_client for the account
+        resource_ids: The ids of the resources to tag
+        tags: The tags in the EC2 format, [{'Key': key, 'Value': value}]
+        max_workers: The number of batches sent at the same time. Defaults to BATCH_MAX_WORKERS.
+
+    Returns:
+        batch_executor.BatchOutcome: The create_tags responses and the ids that could not be tagged. A batch failing
+        because of one invalid id is bisected until the id is isolated.
+
+    Raises:
+        ClientError: boto3 client error
+    """
+    try:
+        return batch_executor.run_isolated_batches(
+            lambda batch: throttling.call(ec2_client, 'create_tags', Resources=batch, Tags=tags),
+            resource_ids,
+            EC2_BATCH_SIZE,
+            'create_tags',
+            max_workers=max_workers
+        )
+    except botocore.exceptions.ClientError:
+        raise
+
+
+def delete_tags(ec2_client, resource_ids, tags, max_workers=None):
+    """Remove tags from EC2 resources, sending the 1000-id batches concurrently.
+
+    Args:
+        ec2_client: The authenticated ec2_client for the account
+        resource_ids: The ids of the resources to untag
+        tags: The tags in the EC2 format. A tag without 'Value' is removed whatever its value.
+        max_workers: The number of batches sent at the same time. Defaults to BATCH_MAX_WORKERS.
+
+    Returns:
+        batch_executor.BatchOutcome: The delete_tags responses and the ids that could not be untagged. A batch failing
+        because of one invalid id is bisected until the id is isolated.
+
+    Raises:
+        ClientError: boto3 client error
+    """
+    try:
+        return batch_executor.run_isolated_batches(
+            lambda batch: throttling.call(ec2_client, 'delete_tags', Resources=batch, Tags=tags),
+            resource_ids,
+            EC2_BATCH_SIZE,
+            'delete_tags',
+            max_workers=max_workers
+        )
+    except botocore.exceptions.ClientError:
+        raise
+
+
+def tag_untag_skip_backup_ebs_volumes(ec2_client, volume_ids, tag_list, max_workers=None, current_tags=None,
+                                      retry_queue=None):
     """Tag given ebs volume ids with the vpcx-skip-backup tag. Once tagged, untag with the vpcx-backup so that
        AWS Backups skips these volumes
 
+    Each batch is tagged and then untagged before moving on, and the batches are processed concurrently.
+
     Args:
         ec2_client: The authenticated ec2_client for the account
         volume_ids: The ids of all the volumes that should be tagged with skip backup
         tag_list: the tag list that should be added to the volumes
+        max_workers: The number of batches processed at the same time. Defaults to BATCH_MAX_WORKERS.
+        current_tags: volume id to its current tags, see get_volume_tags. When given, only the volumes missing a tag
+            are tagged and only the volumes with vpcx-backup=regular are untagged, all the tagging first.
+        retry_queue: retry_queue.RetryQueue collecting the volumes that could not be written to, to retry and report
+            them at the end of the run. A batch failing because of one invalid volume id is bisected until the id is
+            isolated.
 
     Returns:
-        None
+        list: The tag_plan.TagPlan of the create_tags and of the delete_tags calls
 
     Raises:
         ClientError: boto3 client error
     """
+    untag_tags = [
+        {
+            'Key': 'vpcx-backup',
+            'Value': 'regular'
+        },
+    ]
+
+    queue = retry_queue or RetryQueue()
+
+    def tag_untag(batch):
+        throttling.call(
+            ec2_client, 'create_tags',
+            Resources=batch,
+            Tags=_to_ec2_tags(tag_list)
+        )
+        throttling.call(
+            ec2_client, 'delete_tags',
+            Resources=batch,
+            Tags=untag_tags
+        )
+
     try:
-        for i in range(0, len(volume_ids), 1000):
-            ec2_client.create_tags(
-                Resources=volume_ids[i:i+1000],
-                Tags=[{'Key': k, 'Value': v} for (k, v) in tag_list.items()]
-            )
-            ec2_client.delete_tags(
-                Resources=volume_ids[i:i+1000],
-                Tags=[
-                    {
-                        'Key': 'vpcx-backup',
-                        'Value': 'regular'
-                    },
-                ]
-            )
+        if current_tags is None:
+            def write(ids):
+                return batch_executor.run_isolated_batches(tag_untag, ids, EC2_BATCH_SIZE, 'create_tags',
+                                                           max_workers=max_workers).failures
+            queue.add(('tag_untag', tuple(sorted(tag_list.items()))), write, write(volume_ids))
+            plans = [tag_plan.plan_tags(volume_ids, tag_list), tag_plan.plan_untags(volume_ids, ['vpcx-backup'])]
+        else:
+            plans = [
+                tag_plan.apply(
+                    tag_plan.plan_tags(volume_ids, tag_list, current_tags),
+                    lambda tags, ids: _create_tags_retried(ec2_client, ids, tags, queue, max_workers)
+                ),
+                tag_plan.apply(
+                    tag_plan.plan_untags(volume_ids, ['vpcx-backup'], current_tags,
+                                         values=tag_plan.tags_to_dict(untag_tags)),
+                    lambda keys, ids: _delete_tags_retried(ec2_client, ids, untag_tags, queue, max_workers)
+                )
+            ]
+        if retry_queue is None:
+            failures = queue.drain()
+            if failures:
+                logger.info(f"Volumes that could not be written to: {batch_executor.failures_to_dicts(failures)}")
+        return plans
     except botocore.exceptions.ClientError:
         raise
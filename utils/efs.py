@@ -1,5 +1,7 @@
 import botocore.exceptions
 
+from utils import throttling
+
 
 def get_efs_file_systems(efs_client):
     """Get the ARNs for all the EFS snapshots in the account.
@@ -14,12 +16,13 @@ def get_efs_file_systems(efs_client):
       ClientError: Error from boto3.
     """
     try:
-        efs_arns = []
-        paginator = efs_client.get_paginator('describe_file_systems')
-        response_iterator = paginator.paginate()
-        for page in response_iterator:
-            for file_system in page.get('FileSystems', []):
-                efs_arns.append(file_system.get('FileSystemArn'))
-        return efs_arns
+        return list(iter_efs_file_systems(efs_client))
     except botocore.exceptions.ClientError:
         raise
+
+
+def iter_efs_file_systems(efs_client):
+    """Yield the ARNs of the EFS file systems as the pages arrive. See get_efs_file_systems."""
+    for page in throttling.paginate(efs_client, 'describe_file_systems'):
+        for file_system in page.get('FileSystems', []):
+            yield file_system.get('FileSystemArn')
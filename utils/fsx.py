@@ -1,5 +1,7 @@
 import botocore.exceptions
 
+from utils import throttling
+
 
 def get_fsx_file_systems(fsx_client):
     """Get all the ARNs for all the FSx file systems in the account.
@@ -14,12 +16,13 @@ def get_fsx_file_systems(fsx_client):
       ClientError: Error from boto3.
     """
     try:
-        fsx_file_system_arns = []
-        paginator = fsx_client.get_paginator('describe_file_systems')
-        response_iterator = paginator.paginate()
-        for page in response_iterator:
-            for file_system in page.get('FileSystems', []):
-                fsx_file_system_arns.append(file_system.get('ResourceARN'))
-        return fsx_file_system_arns
+        return list(iter_fsx_file_systems(fsx_client))
     except botocore.exceptions.ClientError:
         raise
+
+
+def iter_fsx_file_systems(fsx_client):
+    """Yield the ARNs of the FSx file systems as the pages arrive. See get_fsx_file_systems."""
+    for page in throttling.paginate(fsx_client, 'describe_file_systems'):
+        for file_system in page.get('FileSystems', []):
+            yield file_system.get('ResourceARN')
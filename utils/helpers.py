@@ -1,13 +1,24 @@
+import os
+from collections import namedtuple
+
 from utils.api_gateway_response import DoubleQuoteDict
 from utils.exceptions import InvalidRegionException
+from utils import throttling
+from utils.ttl_cache import TTLCache
+
+# The enabled regions and the caller role of an account almost never change, so they are cached in the warm
+# container. Set METADATA_CACHE_PATH (e.g. /tmp/account_metadata.json) to also keep them in a file.
+_metadata_cache = TTLCache(int(os.environ.get('METADATA_CACHE_TTL', 3600)),
+                           os.environ.get('METADATA_CACHE_PATH') or None)
 
 
-def is_region_valid(ec2_client, region):
+def is_region_valid(ec2_client, region, account=None):
     """This function checks whether the region is valid for all the services used in this lambda function.
 
     Args:
         ec2_client: The EC2 client authenticated for the account
         region: The region name that needs to be validated
+        account: When given, the region list of the account is cached for METADATA_CACHE_TTL seconds
 
     Returns:
       None
@@ -15,48 +26,101 @@ def is_region_valid(ec2_client, region):
     Raises:
       InvalidRegionException: The exception indicating that the region name is inavlid.
     """
-    response = ec2_client.describe_regions()
-    regions = [region['RegionName'] for region in response['Regions']]
+    def describe_regions():
+        response = throttling.call(ec2_client, 'describe_regions')
+        return [region['RegionName'] for region in response['Regions']]
+
+    regions = describe_regions() if account is None else _metadata_cache.get_or_set(f"regions:{account}",
+                                                                                      describe_regions)
     if region not in regions:
         raise InvalidRegionException("Invalid region")
 
 
-def get_caller_role(sts_client, iam_client):
+def get_caller_role(sts_client, iam_client=None, account=None):
     """This function returns the role name using which this function is creating resources in the account
 
     Args:
         sts_client: The STS client authenticated for the account
-        iam_client: The IAM client authenticated for the account
+        iam_client: The IAM client authenticated for the account. When None, the role arn is built from the assumed
+            role arn instead of being looked up, and does not include the role path.
+        account: When given, the result is cached for the account for METADATA_CACHE_TTL seconds
 
     Returns:
       role_arn: The arn for the account
       aws_account_id: The aws account id the lambda function is running in
     """
-    response = sts_client.get_caller_identity()
+    if account is not None:
+        cache_key = f"caller_role:{account}:{'iam' if iam_client is not None else 'sts'}"
+        role_arn, aws_account_id = _metadata_cache.get_or_set(cache_key,
+                                                              lambda: list(get_caller_role(sts_client, iam_client)))
+        return role_arn, aws_account_id
+
+    response = throttling.call(sts_client, 'get_caller_identity')
     arn = response.get('Arn')
     assumed_role_name_with_session = arn.split(":")[5]
     role_name = assumed_role_name_with_session.split("/")[1]
     aws_account_id = response.get('Account')
-    get_role_response = iam_client.get_role(
+    if iam_client is None:
+        partition = arn.split(":")[1]
+        return f"arn:{partition}:iam::{aws_account_id}:role/{role_name}", aws_account_id
+    get_role_response = throttling.call(
+        iam_client, 'get_role',
         RoleName=role_name
     )
     role_arn = get_role_response.get('Role').get('Arn')
     return role_arn, aws_account_id
 
 
+class ArnPartition(namedtuple('ArnPartition', ['kept', 'skipped', 'unknown'])):
+    """The result of partition_arns: kept and skipped resources in discovery order, and the skip ARNs that were not
+    discovered."""
+
+    def counts(self):
+        """Get the number of kept, skipped and unknown ARNs for the response."""
+        return {'kept': len(self.kept), 'skipped': len(self.skipped), 'unknown': len(self.unknown)}
+
+
+def partition_arns(arns, arns_to_skip):
+    """Split the discovered ARNs (or ids) into the ones to keep and the ones to skip, in linear time.
+
+    The order of ``arns`` is kept and duplicates are dropped. ARNs to skip that were not discovered, e.g. the EC2
+    snapshots returned by the skip-tag query, are reported as unknown instead of raising an error.
+
+    Args:
+        arns: The discovered resource ARNs
+        arns_to_skip: The ARNs of the resources that should be skipped
+
+    Returns:
+        ArnPartition: kept, skipped and unknown lists
+    """
+    skip = set(arns_to_skip)
+    seen = set()
+    kept = []
+    skipped = []
+    for arn in arns:
+        if arn in seen:
+            continue
+        seen.add(arn)
+        if arn in skip:
+            skipped.append(arn)
+        else:
+            kept.append(arn)
+    unknown = [arn for arn in dict.fromkeys(arns_to_skip) if arn not in seen]
+    return ArnPartition(kept, skipped, unknown)
+
+
 def filter_resource_arns(storage_resources_arn_list, resources_to_skip_arn_list):
     """Filter the list of all the storage resources in the account. Resource ARNs that have the skip-vpcx-backup
+    tag are left out. See partition_arns.
 
     Args:
-        storage_resources_arn_list: The list of all the storage resource arns
+        storage_resources_arn_list: The list of all the storage resource arns. It is not modified.
         resources_to_skip_arn_list: The list of the resource arns that should be skipped
 
     Returns:
       The list of the resources that need to tagges with the vpcx-backup tag
     """
-    for resource in resources_to_skip_arn_list:
-        storage_resources_arn_list.remove(resource)
-    return storage_resources_arn_list
+    return partition_arns(storage_resources_arn_list, resources_to_skip_arn_list).kept
 
 
 def lambda_returns(status_code, headers, body):
@@ -0,0 +1,68 @@
+"""Shared keep-alive HTTP session for the calls to the AWSAPI microservices.
+
+One ``requests.Session`` per container keeps its TCP connections and TLS sessions open across calls and warm
+invocations. GET requests are retried with exponential backoff on connection errors and on 429/5xx responses; other
+methods are never retried because they may not be idempotent.
+"""
+import os
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+DEFAULT_POOL_SIZE = 10
+DEFAULT_CONNECT_TIMEOUT = 5
+DEFAULT_READ_TIMEOUT = 60
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF_FACTOR = 0.5
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+_session = None
+_lock = threading.Lock()
+
+
+def _build_retry():
+    retry_kwargs = {
+        'total': int(os.environ.get('HTTP_RETRIES', DEFAULT_RETRIES)),
+        'backoff_factor': float(os.environ.get('HTTP_BACKOFF_FACTOR', DEFAULT_BACKOFF_FACTOR)),
+        'status_forcelist': RETRY_STATUS_CODES,
+        'raise_on_status': False,
+    }
+    try:
+        return Retry(allowed_methods=frozenset(['GET']), **retry_kwargs)
+    except TypeError:
+        # urllib3 < 1.26
+        return Retry(method_whitelist=frozenset(['GET']), **retry_kwargs)
+
+
+def build_session(pool_size=None):
+    """Build a session with a pooled, retrying adapter for http and https.
+
+    Args:
+        pool_size (int): Connections kept per host. Defaults to the HTTP_POOL_SIZE environment variable.
+
+    Returns:
+        requests.Session: The session
+    """
+    pool_size = pool_size or int(os.environ.get('HTTP_POOL_SIZE', DEFAULT_POOL_SIZE))
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=_build_retry())
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def get_session():
+    """Get the process-wide session, building it on first use."""
+    global _session
+    with _lock:
+        if _session is None:
+            _session = build_session()
+        return _session
+
+
+def get_timeout():
+    """Get the (connect, read) timeout in seconds from HTTP_CONNECT_TIMEOUT and HTTP_READ_TIMEOUT."""
+    return (float(os.environ.get('HTTP_CONNECT_TIMEOUT', DEFAULT_CONNECT_TIMEOUT)),
+            float(os.environ.get('HTTP_READ_TIMEOUT', DEFAULT_READ_TIMEOUT)))
@@ -0,0 +1,150 @@
+"""Idempotency keys for the PUT APIs.
+
+A retried PUT carries the same ``Idempotency-Key`` header as the first attempt. Without the header, the key is
+derived from the account, the region and a hash of the rest of the request (path, query string and body).
+
+The first request with a key claims it in the idempotency store before doing any work. With a header, it saves its
+response there once it is done, for IDEMPOTENCY_TTL seconds, and a request that finds the key claimed returns the
+saved response with an ``Idempotent-Replayed: true`` header, or a 202 while the first request is still running. An
+async request saves its 202, so the replays get the id of its job. A derived key only dedupes the requests that run
+at the same time: it is released once the request is done, so that the same request sent later (a daily run, or
+enable again after a disable) does the work again. Responses with a 5xx status are not saved: the key is released
+so that a retry does the work again. A claim whose request died without releasing it expires after IDEMPOTENCY_LOCK_TTL
+seconds, which should be at least the Lambda timeout.
+
+IDEMPOTENCY_STORE selects the store, see stores.get_store, and defaults to the job store. It has to be shared by
+the containers (dynamodb://<table>) for the retries that land on another container.
+"""
+import os
+import re
+import json
+import time
+import hashlib
+import logging
+from collections import namedtuple
+
+from utils import helpers, stores
+from utils.exceptions import InvalidInputException
+
+logger = logging.getLogger()
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+KEY_PATTERN = re.compile(r'^[\x21-\x7e]{1,255}$')
+
+IN_PROGRESS = 'in_progress'
+COMPLETED = 'completed'
+
+DEFAULT_IDEMPOTENCY_TTL = 24 * 3600
+DEFAULT_LOCK_TTL = 900
+
+# key: the Idempotency-Key header or the request hash, derived: whether the key is the request hash.
+IdempotencyKey = namedtuple('IdempotencyKey', ['key', 'derived'])
+
+
+def get_store():
+    """Get the idempotency store configured by IDEMPOTENCY_STORE, which defaults to the job store."""
+    return stores.get_store(os.environ.get('IDEMPOTENCY_STORE') or os.environ.get('JOB_STORE'))
+
+
+def request_hash(event):
+    """Hash of the path, the query string parameters and the body of a request."""
+    try:
+        body = json.loads(event.get('body') or 'null')
+    except ValueError:
+        body = event.get('body')
+    request = [event.get('pathParameters') or {}, event.get('queryStringParameters') or {}, body]
+    return hashlib.sha256(json.dumps(request, sort_keys=True).encode()).hexdigest()
+
+
+def get_key(event):
+    """Get the idempotency key of a request: its Idempotency-Key header, or the hash of the request.
+
+    Returns:
+        IdempotencyKey
+
+    Raises:
+        InvalidInputException: The header is empty, too long or has characters other than printable ASCII
+    """
+    headers = {key.lower(): value for key, value in (event.get('headers') or {}).items()}
+    key = headers.get(IDEMPOTENCY_HEADER.lower())
+    if key is None:
+        return IdempotencyKey(request_hash(event), True)
+    if not KEY_PATTERN.match(key):
+        raise InvalidInputException(f"The {IDEMPOTENCY_HEADER} header should have 1 to 255 printable ASCII "
+                                    f"characters")
+    return IdempotencyKey(key, False)
+
+
+def store_key(account, region, key):
+    """Key of an idempotency record in the store. Keys are scoped to the account and region, and derived keys are
+    kept apart from the header keys."""
+    kind = 'request' if key.derived else 'key'
+    return f"idempotency:{account}:{region}:{kind}:{key.key}"
+
+
+def claim(event, key, account, region, store=None):
+    """Claim an idempotency key for a request, or get the response of the request that claimed it first.
+
+    Args:
+        event (dict): The API Gateway event of the request
+        key (IdempotencyKey): The idempotency key, see get_key
+        account: The account of the request
+        region: The region of the request
+
+    Returns:
+        dict: The API Gateway response to return instead of doing the work, or None when the request claimed the key
+    """
+    store = store or get_store()
+    record_key = store_key(account, region, key)
+    fingerprint = request_hash(event)
+    record = {'status': IN_PROGRESS, 'fingerprint': fingerprint, 'started_at': int(time.time())}
+    if store.add(record_key, record, int(os.environ.get('IDEMPOTENCY_LOCK_TTL', DEFAULT_LOCK_TTL))):
+        return None
+    record = store.get(record_key)
+    if record is None:
+        # The claim expired in the meantime.
+        return claim(event, key, account, region, store)
+    headers = {'Content-Type': 'application/json'}
+    if record.get('fingerprint', fingerprint) != fingerprint:
+        logger.info(f"Idempotency key {key.key} was used for a different request")
+        return helpers.lambda_returns(409, headers, json.dumps({
+            'error': f"The {IDEMPOTENCY_HEADER} was already used for a different request"
+        }))
+    if record['status'] == IN_PROGRESS:
+        logger.info(f"Request with idempotency key {key.key} is in progress")
+        return helpers.lambda_returns(202, dict(headers, **{'Retry-After': '5'}), json.dumps({
+            'message': 'A request with the same idempotency key is in progress. Send it again later for its result.',
+            'status': IN_PROGRESS,
+            'started_at': record['started_at']
+        }))
+    logger.info(f"Replaying the response of idempotency key {key.key}")
+    response = record['response']
+    return helpers.lambda_returns(response['statusCode'], dict(response['headers'], **{REPLAYED_HEADER: 'true'}),
+                                  response['body'])
+
+
+def complete(key, account, region, response, store=None):
+    """Save the response of the request that claimed an idempotency key, or release the key after a 5xx or when
+    the key is derived.
+
+    Args:
+        key (IdempotencyKey): The idempotency key, see get_key
+        response (dict): The API Gateway response returned by the handler
+    """
+    store = store or get_store()
+    record_key = store_key(account, region, key)
+    if key.derived or response['statusCode'] >= 500:
+        store.delete(record_key)
+        return
+    record = store.get(record_key) or {}
+    record.update({
+        'status': COMPLETED,
+        'response': {
+            'statusCode': response['statusCode'],
+            'headers': dict(response['headers']),
+            'body': response['body']
+        }
+    })
+    # Keep the response for IDEMPOTENCY_TTL rather than the lock TTL of the claim.
+    store.put(record_key, record, int(os.environ.get('IDEMPOTENCY_TTL', DEFAULT_IDEMPOTENCY_TTL)))
@@ -0,0 +1,174 @@
+"""Asynchronous jobs of the tagging API.
+
+With the ``async`` query string parameter set to true, or a ``Prefer: respond-async`` header, the handler validates
+the request, records a pending job in the job store and invokes its own Lambda function asynchronously with the
+request and the job id, then returns 202 with the job id. The worker invocation does the work as a synchronous
+request would, saving its progress counters in the job as it goes and its response once it is done.
+GET /v1/jobs/{job-id} returns the job.
+
+JOB_STORE selects the store, see stores.get_store. It has to be shared by the containers (dynamodb://<table>) for
+the GET to find the jobs started by other containers. JOB_DISPATCH=inline runs the worker on a thread of the same
+container instead of a new invocation, for local runs and tests.
+"""
+import os
+import json
+import time
+import uuid
+import logging
+import threading
+
+from utils import stores
+
+logger = logging.getLogger()
+
+# Key of the job id in the event of a worker invocation.
+JOB_ID_KEY = 'jobId'
+
+PENDING = 'pending'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+
+LAMBDA_DISPATCH = 'lambda'
+INLINE_DISPATCH = 'inline'
+
+DEFAULT_JOB_TTL = 7 * 24 * 3600
+DEFAULT_PROGRESS_INTERVAL = 1.0
+
+
+def get_store():
+    """Get the job store configured by JOB_STORE."""
+    return stores.get_store(os.environ.get('JOB_STORE'))
+
+
+def job_key(job_id):
+    """Key of a job in the store."""
+    return f"job:{job_id}"
+
+
+def is_async(event):
+    """Check whether a request asks for async mode: ``async=true`` in the query string or a ``Prefer:
+    respond-async`` header."""
+    params = event.get('queryStringParameters') or {}
+    headers = {key.lower(): value for key, value in (event.get('headers') or {}).items()}
+    return (params.get('async') or '').lower() == 'true' or 'respond-async' in (headers.get('prefer') or '')
+
+
+def get_job_id(event):
+    """Get the job id of a worker invocation, or None for an API request."""
+    return event.get(JOB_ID_KEY)
+
+
+def get_job(job_id, store=None):
+    """Get a job, or None when it does not exist or has expired."""
+    return (store or get_store()).get(job_key(job_id))
+
+
+def create_job(store=None, status=PENDING):
+    """Record a new job in the store.
+
+    Returns:
+        dict: The job
+    """
+    store = store or get_store()
+    job_id = str(uuid.uuid4())
+    now = int(time.time())
+    job = {
+        'job_id': job_id,
+        'status': status,
+        'created_at': now,
+        'updated_at': now,
+        'progress': {},
+        'result': None
+    }
+    store.put(job_key(job_id), job, int(os.environ.get('JOB_TTL', DEFAULT_JOB_TTL)))
+    return job
+
+
+def dispatch(event, context, handler, job_id, **extra):
+    """Start a worker invocation of the job with the request.
+
+    Args:
+        event (dict): The API Gateway event of the request
+        context: The Lambda context of the request, for the name of the function to invoke
+        handler: The handler of the request, run on a thread with JOB_DISPATCH=inline
+        job_id: The id of the job
+        extra: Other keys to add to the worker event
+    """
+    worker_event = dict(event)
+    worker_event[JOB_ID_KEY] = job_id
+    worker_event['queryStringParameters'] = {key: value for key, value in
+                                             (event.get('queryStringParameters') or {}).items() if key != 'async'}
+    worker_event.update(extra)
+    if os.environ.get('JOB_DISPATCH', LAMBDA_DISPATCH) == INLINE_DISPATCH:
+        threading.Thread(target=handler, args=(worker_event, context), daemon=True).start()
+    else:
+        import boto3
+        function_name = getattr(context, 'function_name', None) or os.environ['AWS_LAMBDA_FUNCTION_NAME']
+        boto3.client('lambda').invoke(FunctionName=function_name, InvocationType='Event',
+                                      Payload=json.dumps(worker_event).encode())
+
+
+def submit(event, context, handler, store=None):
+    """Record a pending job for the request and start its worker. See dispatch.
+
+    Returns:
+        dict: The job
+    """
+    job = create_job(store)
+    dispatch(event, context, handler, job['job_id'])
+    logger.info(f"Started job {job['job_id']}")
+    return job
+
+
+class JobProgress(object):
+    """Progress counters of the job of a worker invocation.
+
+    The counters are written to the store at most once per JOB_PROGRESS_INTERVAL seconds. Without a job id, e.g. for
+    a synchronous request, every method does nothing.
+    """
+
+    def __init__(self, job_id=None, store=None, interval=None):
+        self.job_id = job_id
+        self.store = (store or get_store()) if job_id else None
+        self.interval = float(os.environ.get('JOB_PROGRESS_INTERVAL', DEFAULT_PROGRESS_INTERVAL)) \
+            if interval is None else interval
+        self.counters = {}
+        self._written = 0
+        self._lock = threading.Lock()
+
+    def _write(self, changes):
+        changes['updated_at'] = int(time.time())
+        self.store.update(job_key(self.job_id), changes)
+
+    def start(self):
+        """Mark the job as running."""
+        if self.job_id:
+            self._write({'status': RUNNING})
+
+    def update(self, force=False, **counters):
+        """Set progress counters, e.g. update(stage='discovery') or update(resources_seen=1200)."""
+        if not self.job_id:
+            return
+        with self._lock:
+            self.counters.update(counters)
+            if not force and time.monotonic() - self._written < self.interval:
+                return
+            self._written = time.monotonic()
+            progress = dict(self.counters)
+        self._write({'progress': progress})
+
+    def finish(self, response):
+        """Save the response of the worker as the result of the job.
+
+        Args:
+            response (dict): The API Gateway response returned by the handler
+        """
+        if not self.job_id:
+            return
+        status_code = response['statusCode']
+        self._write({
+            'status': SUCCEEDED if status_code < 400 else FAILED,
+            'progress': dict(self.counters),
+            'result': {'statusCode': status_code, 'body': json.loads(response['body'])}
+        })
@@ -0,0 +1,234 @@
+"""Streaming pipeline from discovery to tag writes.
+
+The collectors yield ARNs as their pages arrive. Each one runs on its own thread, within the per-service limits of
+discovery, and puts the ARNs on one bounded queue. The writer side reads the queue, filters and plans every ARN as it
+comes and sends a batch as soon as it is full, with a bounded number of batches in flight. When the writes fall
+behind, the queue fills up and the collectors wait, so memory does not grow with the size of the account and the
+first writes start while discovery is still paging.
+"""
+import os
+import time
+import queue
+import logging
+import threading
+from collections import OrderedDict, deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from utils import batch_executor, discovery, tag_plan
+
+logger = logging.getLogger()
+
+DEFAULT_QUEUE_SIZE = 1000
+# How long a blocked collector waits before checking whether the pipeline was stopped.
+PUT_TIMEOUT_SECONDS = 0.1
+
+# partition_counts: kept, skipped and unknown counts as in helpers.ArnPartition.counts.
+# plan: a tag_plan.TagPlan whose groups are (tags, number of resources) instead of (tags, resource ids).
+StreamResult = namedtuple('StreamResult', ['partition_counts', 'plan', 'timings'])
+
+_DONE = object()
+
+
+class _Failure(object):
+    def __init__(self, error):
+        self.error = error
+
+
+def get_queue_size():
+    """Read the size of the queue between the collectors and the writer from PIPELINE_QUEUE_SIZE."""
+    return int(os.environ.get('PIPELINE_QUEUE_SIZE', DEFAULT_QUEUE_SIZE))
+
+
+def iter_collectors(collectors, timings, queue_size=None, service_limits=None):
+    """Run the collectors concurrently and yield their items as they arrive.
+
+    Args:
+        collectors (list): discovery.Collector tuples whose func returns an iterable, usually a generator
+        timings (dict): Filled with the elapsed milliseconds of every collector, in collector order
+        queue_size (int): Items buffered before the collectors wait. Defaults to get_queue_size().
+        service_limits (dict): Per-service concurrency limits. Defaults to discovery.get_service_limits().
+
+    Yields:
+        The items of all the collectors, interleaved
+
+    Raises:
+        Exception: The error of the first failing collector. The other collectors are stopped.
+    """
+    service_limits = discovery.get_service_limits() if service_limits is None else service_limits
+    items = queue.Queue(maxsize=queue_size or get_queue_size())
+    stop = threading.Event()
+    semaphores = {service: threading.BoundedSemaphore(service_limits.get(service, discovery.DEFAULT_SERVICE_LIMIT))
+                  for service in set(collector.service for collector in collectors)}
+    for collector in collectors:
+        timings[collector.name] = None
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=PUT_TIMEOUT_SECONDS)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce(collector):
+        with semaphores[collector.service]:
+            if stop.is_set():
+                return
+            start = time.monotonic()
+            try:
+                for item in collector.func(*collector.args):
+                    if not put(item):
+                        return
+            except Exception as err:  # pylint: disable=broad-except
+                put(_Failure(err))
+            finally:
+                timings[collector.name] = int((time.monotonic() - start) * 1000)
+                logger.info(f"Collector {collector.name} finished in {timings[collector.name]} ms")
+                put(_DONE)
+
+    threads = [threading.Thread(target=produce, args=(collector,), daemon=True) for collector in collectors]
+    for thread in threads:
+        thread.start()
+    try:
+        remaining = len(collectors)
+        while remaining:
+            item = items.get()
+            if item is _DONE:
+                remaining -= 1
+            elif isinstance(item, _Failure):
+                raise item.error
+            else:
+                yield item
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+
+def write_stream(arns, tag_sets, write, batch_size, skip_arns=(), current_tags=None, max_workers=None,
+                 progress=None, deadline=None, cursor=None, discovered=None):
+    """Plan and send the tag writes of a stream of ARNs, one batch at a time.
+
+    Every ARN that is not in skip_arns gets the merged tag_sets, minus the tags it already carries in current_tags.
+    ARNs that need the same tags are buffered together and a buffer is sent once it holds batch_size ARNs.
+
+    Args:
+        arns: Iterable of ARNs, e.g. iter_collectors. Duplicates are written once.
+        tag_sets (list): tag dicts that every kept ARN should carry
+        write: Callable write(tags, arns) sending one batch, e.g. through batch_executor.run_batches so that the
+            per-API cap applies
+        batch_size (int): ARNs per write call
+        skip_arns: ARNs that must not be written to
+        current_tags (dict): ARN to its current tags, for diff mode. None writes every tag.
+        max_workers (int): Batches in flight at the same time. Defaults to batch_executor.get_max_workers().
+        progress: Callable progress(resources_seen=..., resources_submitted=...) called whenever a batch is sent,
+            e.g. jobs.JobProgress.update
+        deadline: checkpoints.Deadline or Budget. Once it expires no new batch is sent, the batches in flight finish
+            and the stream is closed, which stops the collectors. The first batch is sent regardless.
+        cursor: checkpoints.Cursor. Its done ARNs are left out and the ARNs of every batch sent are added to it.
+            cursor.stopped tells whether the deadline stopped the writes.
+        discovered: Callable called once the ARNs are exhausted, before the last batches are sent, e.g. to publish
+            the discovery of a single-flight leader. Not called when the deadline stopped the stream.
+
+    Returns:
+        tuple: (partition counts, tag_plan.TagPlan with (tags, number of resources) groups)
+
+    Raises:
+        Exception: The error of the first failing write, once the writes in flight have finished.
+    """
+    max_workers = max_workers or batch_executor.get_max_workers()
+    skip = set(skip_arns)
+    seen = set()
+    tags = {}
+    for tag_set in tag_sets:
+        tags.update(tag_set or {})
+    writes_per_resource = len([tag_set for tag_set in tag_sets if tag_set])
+    buffers = OrderedDict()
+    group_sizes = OrderedDict()
+    counts = {'kept': 0, 'skipped': 0, 'unknown': 0}
+    sent = avoided = 0
+    in_flight = deque()
+    submitted = [0]
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        def submit(adds, batch):
+            # The first batch is always sent, so that every invocation makes progress.
+            if deadline is not None and submitted[0] and deadline.expired():
+                return False
+            # Backpressure: wait for the oldest batch before going over the in-flight bound.
+            while len(in_flight) >= max_workers:
+                done, _ = wait(list(in_flight), return_when=FIRST_COMPLETED)
+                for future in done:
+                    in_flight.remove(future)
+                    future.result()
+            in_flight.append(executor.submit(write, dict(adds), batch))
+            submitted[0] += len(batch)
+            if cursor is not None:
+                cursor.add(batch)
+            if progress:
+                progress(resources_seen=len(seen), resources_submitted=submitted[0])
+            return True
+
+        done_arns = cursor.done if cursor is not None else ()
+        stopped = False
+        try:
+            for arn in arns:
+                if arn in seen:
+                    continue
+                seen.add(arn)
+                if arn in skip:
+                    counts['skipped'] += 1
+                    continue
+                if arn in done_arns:
+                    continue
+                counts['kept'] += 1
+                current = {} if current_tags is None else current_tags.get(arn, {})
+                adds = tuple(sorted((key, value) for key, value in tags.items() if current.get(key) != value))
+                if not adds:
+                    avoided += writes_per_resource
+                    continue
+                sent += 1
+                avoided += writes_per_resource - 1
+                group_sizes[adds] = group_sizes.get(adds, 0) + 1
+                buffer = buffers.setdefault(adds, [])
+                buffer.append(arn)
+                if len(buffer) >= batch_size and not submit(adds, buffers.pop(adds)):
+                    stopped = True
+                    break
+            if discovered is not None and not stopped:
+                discovered()
+            for adds, batch in buffers.items():
+                if stopped or not submit(adds, batch):
+                    stopped = True
+                    break
+        finally:
+            # Stop the collectors when a write failed, and let the writes in flight finish.
+            if hasattr(arns, 'close'):
+                arns.close()
+            errors = [future.exception() for future in in_flight]
+        for error in errors:
+            if error is not None:
+                raise error
+
+    if cursor is not None:
+        cursor.stopped = stopped
+    counts['unknown'] = len(skip - seen)
+    plan = tag_plan.TagPlan([(dict(adds), size) for adds, size in group_sizes.items()], sent, avoided)
+    return counts, plan
+
+
+def run(collectors, tag_sets, write, batch_size, skip_arns=(), current_tags=None, max_workers=None, queue_size=None,
+        progress=None, deadline=None, cursor=None, discovered=None):
+    """Stream the ARNs of the collectors into write_stream.
+
+    Returns:
+        StreamResult: the partition counts, the plan and the elapsed milliseconds of every collector and in total
+    """
+    start = time.monotonic()
+    timings = OrderedDict()
+    partition_counts, plan = write_stream(iter_collectors(collectors, timings, queue_size), tag_sets, write,
+                                          batch_size, skip_arns, current_tags, max_workers, progress, deadline,
+                                          cursor, discovered)
+    timings['total'] = int((time.monotonic() - start) * 1000)
+    return StreamResult(partition_counts, plan, timings)
@@ -0,0 +1,102 @@
+"""Preflight stage shared by the handlers: credentials, region validation, caller identity and clients.
+
+Once the credentials are known, the region check, the STS caller identity and the creation of the regional clients
+run at the same time, and the preflight returns as soon as they are done: a failed region check is raised right away,
+without waiting for the other steps, whose pending work is cancelled. The IAM role lookup is only used for a log line, so it is skipped unless VERBOSE_LOGGING is on.
+The region list and the caller role of the account are cached by the helpers, so warm requests skip those calls.
+If AWS rejects cached credentials, they are fetched again once and the checks are repeated.
+"""
+import os
+import time
+import logging
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import botocore.exceptions
+
+from utils import client_pool, credentials_cache, helpers
+
+logger = logging.getLogger()
+
+PreflightResult = namedtuple('PreflightResult', ['credentials', 'clients', 'role_arn', 'account_id', 'timings'])
+
+
+def is_verbose():
+    """Check the VERBOSE_LOGGING environment variable."""
+    return os.environ.get('VERBOSE_LOGGING', 'false').lower() == 'true'
+
+
+def _timed(timings, name, func, *args):
+    start = time.monotonic()
+    try:
+        return func(*args)
+    finally:
+        timings[name] = int((time.monotonic() - start) * 1000)
+
+
+def _check(credentials, account, region, service_names, verbose, timings):
+    ec2_client = client_pool.get_client('ec2', credentials, account)
+    sts_client = client_pool.get_client('sts', credentials, account, region)
+    iam_client = client_pool.get_client('iam', credentials, account, region) if verbose else None
+
+    # The steps write their timings apart, so that a step still running after a failure cannot change the timings
+    # of the preflight.
+    step_timings = OrderedDict()
+    executor = ThreadPoolExecutor(max_workers=3)
+    region_future = executor.submit(_timed, step_timings, 'region', helpers.is_region_valid, ec2_client, region,
+                                    account)
+    identity_future = executor.submit(_timed, step_timings, 'caller_identity', helpers.get_caller_role,
+                                      sts_client, iam_client, account)
+    clients_future = executor.submit(_timed, step_timings, 'clients', client_pool.get_clients,
+                                     service_names, credentials, account, region)
+    try:
+        # The region error comes first: the other two steps fail too when the region does not exist.
+        region_future.result()
+        role_arn, account_id = identity_future.result()
+        clients = clients_future.result()
+    finally:
+        # Do not wait for the steps still running after a failure.
+        for future in (region_future, identity_future, clients_future):
+            future.cancel()
+        executor.shutdown(wait=False)
+    timings.update(step_timings)
+    return clients, role_arn, account_id
+
+
+def run_preflight(account, region, fetch_credentials, service_names, verbose=None):
+    """Get everything the handlers need before they can touch the storage resources.
+
+    Args:
+        account: The account from the request path
+        region: The region from the request path
+        fetch_credentials: Callable fetching the admin credentials of the account from vpcxiam
+        service_names (list): The services to get regional clients for
+        verbose (bool): Look up the IAM role of the caller. Defaults to is_verbose().
+
+    Returns:
+        PreflightResult: credentials, clients keyed by service name, role_arn, account_id and the elapsed
+        milliseconds of every step
+
+    Raises:
+        InvalidRegionException: The region is not valid for the account
+        ValueError: vpcxiam returned an error
+        ClientError: Error from boto3.
+    """
+    verbose = is_verbose() if verbose is None else verbose
+    timings = OrderedDict()
+    start = time.monotonic()
+
+    credentials = _timed(timings, 'credentials', credentials_cache.get_admin_credentials, account, fetch_credentials)
+    try:
+        clients, role_arn, account_id = _check(credentials, account, region, service_names, verbose, timings)
+    except botocore.exceptions.ClientError as err:
+        if not credentials_cache.is_credentials_error(err):
+            raise
+        logger.info(f"Cached credentials for {account} were rejected, fetching new ones: {err}")
+        client_pool.invalidate(account)
+        credentials = _timed(timings, 'credentials_refresh', credentials_cache.get_admin_credentials, account,
+                             fetch_credentials, True)
+        clients, role_arn, account_id = _check(credentials, account, region, service_names, verbose, timings)
+
+    timings['total'] = int((time.monotonic() - start) * 1000)
+    return PreflightResult(credentials, clients, role_arn, account_id, timings)
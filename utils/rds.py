@@ -1,11 +1,119 @@
 import botocore.exceptions
+from concurrent.futures import ThreadPoolExecutor
 
+from utils import throttling
 
-def get_rds_instances(rds_client):
+
+# describe call to the list key and the ARN attribute of its items.
+RDS_DESCRIBE_CALLS = {
+    'describe_db_instances': ('DBInstances', 'DBInstanceArn'),
+    'describe_db_clusters': ('DBClusters', 'DBClusterArn'),
+    'describe_global_clusters': ('GlobalClusters', 'GlobalClusterArn'),
+    'describe_reserved_db_instances': ('ReservedDBInstances', 'ReservedDBInstanceArn'),
+}
+
+
+def iter_arns(rds_client, action):
+    """Paginate an RDS describe call and yield the ARN of every item as the pages arrive.
+
+    Args:
+        rds_client: RDS client that is authenticated for the account.
+        action: One of the describe calls in RDS_DESCRIBE_CALLS
+
+    Raises:
+      ClientError: Error from boto3.
+    """
+    list_key, arn_key = RDS_DESCRIBE_CALLS[action]
+    for page in throttling.paginate(rds_client, action):
+        for item in page.get(list_key, []):
+            yield item.get(arn_key)
+
+
+def _get_arns(rds_client, action):
+    """Collect the ARNs of an RDS describe call in a list."""
+    return list(iter_arns(rds_client, action))
+
+
+def get_db_instance_arns(rds_client):
+    """Get the ARNs of all the db instances.
+
+    Args:
+        rds_client: RDS client that is authenticated for the account.
+
+    Returns:
+      The list of the db instance arns
+
+    Raises:
+      ClientError: Error from boto3.
+    """
+    try:
+        return _get_arns(rds_client, 'describe_db_instances')
+    except botocore.exceptions.ClientError:
+        raise
+
+
+def get_db_cluster_arns(rds_client):
+    """Get the ARNs of all the db clusters.
+
+    Args:
+        rds_client: RDS client that is authenticated for the account.
+
+    Returns:
+      The list of the db cluster arns
+
+    Raises:
+      ClientError: Error from boto3.
+    """
+    try:
+        return _get_arns(rds_client, 'describe_db_clusters')
+    except botocore.exceptions.ClientError:
+        raise
+
+
+def get_global_cluster_arns(rds_client):
+    """Get the ARNs of all the global clusters.
+
+    Args:
+        rds_client: RDS client that is authenticated for the account.
+
+    Returns:
+      The list of the global cluster arns
+
+    Raises:
+      ClientError: Error from boto3.
+    """
+    try:
+        return _get_arns(rds_client, 'describe_global_clusters')
+    except botocore.exceptions.ClientError:
+        raise
+
+
+def get_reserved_db_instance_arns(rds_client):
+    """Get the ARNs of all the reserved db instances.
+
+    Args:
+        rds_client: RDS client that is authenticated for the account.
+
+    Returns:
+      The list of the reserved db instance arns
+
+    Raises:
+      ClientError: Error from boto3.
+    """
+    try:
+        return _get_arns(rds_client, 'describe_reserved_db_instances')
+    except botocore.exceptions.ClientError:
+        raise
+
+
+def get_rds_instances(rds_client, max_workers=4):
     """Get the list of ANRs for rds instance and rds clusters.
 
+    The four describe paginators are independent and are run concurrently on up to max_workers threads.
+
     Args:
         rds_client: RDS client that is authenticated for the account.
+        max_workers: The number of paginators allowed to run at the same time.
 
     Returns:
       The list of the rds arns that needs to be tagged with vpcx-backup tag
@@ -13,41 +121,12 @@ def get_rds_instances(rds_client):
     Raises:
       ClientError: Error from boto3.
     """
+    collectors = [get_db_instance_arns, get_db_cluster_arns, get_global_cluster_arns, get_reserved_db_instance_arns]
     try:
-        rds_instance_anrs = []
-        rds_cluster_arns = []
-        rds_global_cluster_arns = []
-        rds_reserved_instance_arns = []
-
-        # Get all the db instance arns
-        paginator = rds_client.get_paginator('describe_db_instances')
-        response_iterator = paginator.paginate()
-        for page in response_iterator:
-            for db_instance in page.get('DBInstances', []):
-                rds_instance_anrs.append(db_instance.get('DBInstanceArn'))
-
-        # Get all the cluster arns
-        paginator = rds_client.get_paginator('describe_db_clusters')
-        response_iterator = paginator.paginate()
-        for page in response_iterator:
-            for db_cluster in page.get('DBClusters', []):
-                rds_cluster_arns.append(db_cluster.get('DBClusterArn'))
-
-        # Get all the global cluster arns
-        paginator = rds_client.get_paginator('describe_global_clusters')
-        response_iterator = paginator.paginate()
-        for page in response_iterator:
-            for global_cluster in page.get('GlobalClusters', []):
-                rds_global_cluster_arns.append(global_cluster.get('GlobalClusterArn'))
-
-        # Get all the reserved RDS instances
-        paginator = rds_client.get_paginator('describe_reserved_db_instances')
-        response_iterator = paginator.paginate()
-        for page in response_iterator:
-            for reserved_db_instance in page.get('ReservedDBInstances', []):
-                rds_reserved_instance_arns.append((reserved_db_instance.get('ReservedDBInstanceArn')))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            arn_lists = list(executor.map(lambda collector: collector(rds_client), collectors))
 
         # Return the combined list of all the RDS ARNs.
-        return rds_instance_anrs + rds_cluster_arns + rds_global_cluster_arns + rds_reserved_instance_arns
+        return [arn for arn_list in arn_lists for arn in arn_list]
     except botocore.exceptions.ClientError:
         raise
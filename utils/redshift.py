@@ -1,5 +1,7 @@
 import botocore.exceptions
 
+from utils import throttling
+
 
 def get_redshift_cluster_arns(redshift_client, region, account):
     """Get ANRs for all the Redshift Clusters in the account
@@ -16,13 +18,13 @@ def get_redshift_cluster_arns(redshift_client, region, account):
       ClientError: Error from boto3.
     """
     try:
-        redshift_cluster_arns = []
-        paginator = redshift_client.get_paginator('describe_clusters')
-        response_iterator = paginator.paginate()
-        for page in response_iterator:
-            for cluster in page.get('Clusters', []):
-                cluster_arn = f"arn:aws:redshift:{region}:{account}:cluster:{cluster.get('ClusterIdentifier')}"
-                redshift_cluster_arns.append(cluster_arn)
-        return redshift_cluster_arns
+        return list(iter_redshift_cluster_arns(redshift_client, region, account))
     except botocore.exceptions.ClientError:
         raise
+
+
+def iter_redshift_cluster_arns(redshift_client, region, account):
+    """Yield the ARNs of the Redshift clusters as the pages arrive. See get_redshift_cluster_arns."""
+    for page in throttling.paginate(redshift_client, 'describe_clusters'):
+        for cluster in page.get('Clusters', []):
+            yield f"arn:aws:redshift:{region}:{account}:cluster:{cluster.get('ClusterIdentifier')}"
@@ -1,5 +1,12 @@
 import botocore.exceptions
 
+from utils import batch_executor, throttling
+
+# TagResources and UntagResources accept at most 20 ARNs per call.
+RGTA_BATCH_SIZE = 20
+# GetResources accepts at most 100 ARNs in ResourceARNList.
+RGTA_READ_BATCH_SIZE = 100
+
 
 def get_all_resources_to_skip(resource_tagging_client):
     """Get all the storage resources in the account filtered by the tag key `skip-vpcx-backup` and tag value `true`
@@ -14,8 +21,8 @@ def get_all_resources_to_skip(resource_tagging_client):
     """
     resources_to_skip_arn_list = []
     try:
-        paginator = resource_tagging_client.get_paginator('get_resources')
-        response_iterator = paginator.paginate(
+        response_iterator = throttling.paginate(
+            resource_tagging_client, 'get_resources',
             ResourceTypeFilters=[
                 'rds:cluster',
                 'rds:db',
@@ -42,48 +49,122 @@ def get_all_resources_to_skip(resource_tagging_client):
         raise
 
 
-def tag_storage_resources(resource_tagging_client, tag_list, resource_arn_list):
-    """Tag the storage resources with the tag list
+def failed_resources(response):
+    """Get the ARNs that a tag_resources or untag_resources response reports in FailedResourcesMap.
+
+    Returns:
+      dict: resource arn to (error code, error message)
+    """
+    return {arn: (failure.get('ErrorCode'), failure.get('ErrorMessage'))
+            for arn, failure in (response or {}).get('FailedResourcesMap', {}).items()}
+
+
+def tag_storage_resources(resource_tagging_client, tag_list, resource_arn_list, max_workers=None):
+    """Tag the storage resources with the tag list. The 20-ARN batches are sent concurrently.
+
+    A batch rejected because of an invalid ARN is bisected until the ARN is isolated, so the other resources are
+    still tagged. The ARNs listed in FailedResourcesMap are returned as failures, for the caller to retry them in
+    bulk, see retry_queue.RetryQueue.
     Args:
         resource_tagging_client: ResourceGroupsTaggingAPI client that is authenticated for the account.
         tag_list: The list of the tags that needs to be applied on resources.
         resource_arn_list: The list of the resource arns that has to be tagged.
+        max_workers: The number of batches sent at the same time. Defaults to BATCH_MAX_WORKERS.
 
     Returns:
-      None
+      batch_executor.BatchOutcome: The tag_resources responses and the ARNs that could not be tagged
 
     Raises:
       ClientError: Error from boto3.
     """
     try:
-        for i in range(0, len(resource_arn_list), 20):
-            resource_tagging_client.tag_resources(
-                ResourceARNList=resource_arn_list[i:i+20],
-                Tags=tag_list
-            )
+        return batch_executor.run_isolated_batches(
+            lambda batch: throttling.call(resource_tagging_client, 'tag_resources', ResourceARNList=batch,
+                                         Tags=tag_list),
+            resource_arn_list,
+            RGTA_BATCH_SIZE,
+            'tag_resources',
+            max_workers=max_workers,
+            failed_items=failed_resources
+        )
     except botocore.exceptions.ClientError:
         raise
 
 
-def untag_storage_resources_to_skip(resource_tagging_client, resources_to_skip_arn_list, tag_keys):
+def untag_storage_resources_to_skip(resource_tagging_client, resources_to_skip_arn_list, tag_keys, max_workers=None):
     """Untag all the resources that should be skipped by the AWS Backups backup management.
+    Invalid ARNs are isolated as in tag_storage_resources.
     Args:
         resource_tagging_client: ResourceGroupsTaggingAPI client that is authenticated for the account.
         resources_to_skip_arn_list: Resources that should be untagged with vpcx-backup tag key.
         tag_keys: The tag keys which should be removed from the resource list
+        max_workers: The number of batches sent at the same time. Defaults to BATCH_MAX_WORKERS.
+
+    Returns:
+      batch_executor.BatchOutcome: The untag_resources responses and the ARNs that could not be untagged
+
+    Raises:
+      ClientError: Error from boto3.
+    """
+    try:
+        return batch_executor.run_isolated_batches(
+            lambda batch: throttling.call(resource_tagging_client, 'untag_resources', ResourceARNList=batch,
+                                         TagKeys=tag_keys),
+            resources_to_skip_arn_list,
+            RGTA_BATCH_SIZE,
+            'untag_resources',
+            max_workers=max_workers,
+            failed_items=failed_resources
+        )
+    except botocore.exceptions.ClientError:
+        raise
+
+
+def get_resource_tags(resource_tagging_client, tag_keys=None, resource_arns=None, max_workers=None):
+    """Get the current tags of the resources in bulk.
+
+    With resource_arns, the tags of those resources are read 100 ARNs per call. Otherwise every resource that carries
+    one of the tag keys is read, with one query per key because the TagFilters of a query are combined with AND.
+
+    Args:
+        resource_tagging_client: ResourceGroupsTaggingAPI client that is authenticated for the account.
+        tag_keys: The tag keys to read. Other tags are left out of the result.
+        resource_arns: The resources to read the tags of
+        max_workers: The number of 100-ARN reads sent at the same time. Defaults to BATCH_MAX_WORKERS.
 
     Returns:
-      None
+      dict: resource arn to a dict of its tags. Resources without any of the tags may be missing.
 
     Raises:
       ClientError: Error from boto3.
     """
+    def read_tags(pages):
+        resource_tags = {}
+        for page in pages:
+            for resource in page.get('ResourceTagMappingList', []):
+                resource_tags[resource.get('ResourceARN')] = {
+                    tag['Key']: tag['Value'] for tag in resource.get('Tags', [])
+                    if tag_keys is None or tag['Key'] in tag_keys
+                }
+        return resource_tags
+
     try:
-        for i in range(0, len(resources_to_skip_arn_list), 20):
-            resource_tagging_client.untag_resources(
-                ResourceARNList=resources_to_skip_arn_list[i:i+20],
-                TagKeys=tag_keys
-            )
+        current_tags = {}
+        if resource_arns is not None:
+            for batch_tags in batch_executor.run_batches(
+                    lambda batch: read_tags(throttling.paginate(resource_tagging_client, 'get_resources',
+                                                                ResourceARNList=batch)),
+                    list(resource_arns),
+                    RGTA_READ_BATCH_SIZE,
+                    'get_resources',
+                    max_workers=max_workers):
+                current_tags.update(batch_tags)
+            return current_tags
+        for tag_key in tag_keys or []:
+            for arn, tags in read_tags(throttling.paginate(resource_tagging_client, 'get_resources',
+                                                           TagFilters=[{'Key': tag_key}])).items():
+                current_tags.setdefault(arn, {}).update(tags)
+        return current_tags
     except botocore.exceptions.ClientError:
         raise
 
@@ -103,8 +184,8 @@ def get_tag_values_for_resources(resource_tagging_client, tag_key):
     """
     try:
         tag_values = []
-        paginator = resource_tagging_client.get_paginator('get_tag_values')
-        response_iterator = paginator.paginate(
+        response_iterator = throttling.paginate(
+            resource_tagging_client, 'get_tag_values',
             Key=tag_key
         )
         for page in response_iterator:
@@ -0,0 +1,109 @@
+"""Deferred bulk retry of the resources that failed with a retryable error.
+
+Resources that AWS reports as failed because of throttling or an internal error (e.g. in FailedResourcesMap) are not
+written again on the spot. They are queued per write, across all the batches of the run, and sent again in bulk once
+the other writes are done, with a full-jitter exponential backoff before every round. Failures with any other code
+are final and are reported as they are.
+"""
+import os
+import time
+import logging
+import threading
+from collections import Counter, OrderedDict
+
+from utils import throttling
+
+logger = logging.getLogger()
+
+RETRYABLE_ERROR_CODES = throttling.THROTTLE_ERROR_CODES | frozenset([
+    'InternalServiceException',
+    'InternalError',
+    'InternalFailure',
+    'ServiceUnavailable',
+    'Unavailable',
+])
+
+DEFAULT_MAX_ROUNDS = 3
+
+
+def get_max_rounds():
+    """Read the number of retry rounds from the RETRY_QUEUE_ROUNDS environment variable."""
+    return int(os.environ.get('RETRY_QUEUE_ROUNDS', DEFAULT_MAX_ROUNDS))
+
+
+def is_retryable(failure):
+    """Check whether a batch_executor.ItemFailure may succeed when it is sent again."""
+    return failure.code in RETRYABLE_ERROR_CODES
+
+
+class RetryQueue(object):
+    """Collects the failures of the writes of one run, from any thread, and retries the retryable ones in drain."""
+
+    def __init__(self, max_rounds=None):
+        self.max_rounds = get_max_rounds() if max_rounds is None else max_rounds
+        self.deferred = 0
+        self.recovered = 0
+        self._pending = OrderedDict()
+        self._failures = []
+        self._lock = threading.Lock()
+
+    def add(self, key, write, failures):
+        """Record the failures of one write.
+
+        Args:
+            key: Identifies the write, e.g. ('tag_resources', tags). The items queued under the same key are sent
+                again together.
+            write: Callable write(items) sending the items again and returning the ItemFailure of those that failed
+            failures (list): batch_executor.ItemFailure of the write
+        """
+        with self._lock:
+            for failure in failures:
+                if is_retryable(failure):
+                    self._pending.setdefault(key, (write, []))[1].append(failure)
+                    self.deferred += 1
+                else:
+                    self._failures.append(failure)
+
+    def drain(self):
+        """Retry the queued items in bulk until they succeed or the rounds run out.
+
+        Returns:
+            list: The final batch_executor.ItemFailure of the run, retryable ones that kept failing included
+        """
+        for attempt in range(self.max_rounds):
+            with self._lock:
+                pending, self._pending = self._pending, OrderedDict()
+            if not pending:
+                break
+            time.sleep(throttling.backoff_delay(attempt))
+            for key, (write, queued) in pending.items():
+                logger.info(f"Retrying {len(queued)} resources of {key[0]}, round {attempt + 1}")
+                failures = write([failure.item for failure in queued])
+                with self._lock:
+                    self.recovered += len(queued) - len(failures)
+                    for failure in failures:
+                        if is_retryable(failure):
+                            self._pending.setdefault(key, (write, []))[1].append(failure)
+                        else:
+                            self._failures.append(failure)
+        with self._lock:
+            for _, queued in self._pending.values():
+                self._failures.extend(queued)
+            self._pending = OrderedDict()
+            return list(self._failures)
+
+    def summary(self, failures):
+        """Summarize the outcome of the run for the response.
+
+        Args:
+            failures (list): The final failures of the run, as returned by batch_executor.failures_to_dicts
+
+        Returns:
+            dict: The deferred and recovered resources and the failed ones, in total and by error code
+        """
+        return {
+            'deferred': self.deferred,
+            'recovered': self.recovered,
+            'failed': len(failures),
+            'by_code': dict(Counter(failure['code'] for failure in failures))
+        }
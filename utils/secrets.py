@@ -1,5 +1,7 @@
 import json
 
+from utils import throttling
+
 
 def retrieve_ldap_password(secrets_manager_client, logger, ldap_password_secret_name):
     """
@@ -14,7 +16,8 @@ def retrieve_ldap_password(secrets_manager_client, logger, ldap_password_secret_
         str: plaintext ldap password
     """
     logger.info("Retrieving LDAP service account password from Secrets Manager")
-    secret_response = secrets_manager_client.get_secret_value(
+    secret_response = throttling.call(
+        secrets_manager_client, 'get_secret_value',
         SecretId=str(ldap_password_secret_name)
     )
     return json.loads(secret_response['SecretString'])['PASSWORD']
@@ -0,0 +1,301 @@
+"""Single-flight discovery of the storage resources of an account and region.
+
+When several requests tag the same account and region at once, only one of them, the leader, runs the discovery.
+The leader takes a lease in the single-flight store for (account, region, operation) and, as soon as its discovery
+is over and before its last writes, publishes a snapshot of what it discovered: the resource ARNs, the skip ARNs, the
+EBS volume records and the tags the resources carried before its writes, without the keys the leader writes. The
+other requests, the followers, wait for the snapshot and apply their own tag delta to it instead of discovering
+again: in diff mode they only write the tags that differ from the snapshot. They do not depend on the writes of the
+leader, which may still be running or fail.
+
+The operation names the discovery backend and strict mode (see discovery_operation), so that a request only follows
+a snapshot discovered the way it would have discovered itself: the rgta backend misses resources that were never
+tagged, and strict mode reads the DynamoDB ARNs instead of building them.
+
+Within a container the followers wait on an event of the leader; across containers they poll the store. The snapshot
+only lives while its leader runs: the leader removes it with its lease, so a request that starts after the leader is
+done discovers again. A follower that changes tags removes it too, and so does the exception handler once it wrote
+to the account and region (see invalidate_discovery), so that no request diffs against tags that changed. A
+follower waits SINGLE_FLIGHT_WAIT_MS when it is the worker of an async job,
+and SINGLE_FLIGHT_SYNC_WAIT_MS, within the API Gateway timeout, when a client waits for its response. Once the wait
+is over it runs its own discovery. A follower that finds the lease released without a snapshot (the leader failed or
+ran out of time) takes the lead.
+
+SINGLE_FLIGHT_STORE selects the store, see stores.get_store, and defaults to the job store. It has to be shared by
+the containers (dynamodb://<table>) for the requests of different containers to coalesce. SINGLE_FLIGHT=off turns
+the coalescing off.
+"""
+import os
+import json
+import time
+import uuid
+import zlib
+import base64
+import logging
+import threading
+from collections import namedtuple
+
+from utils import ebs, stores
+from utils.discovery import BACKENDS, Collector
+
+logger = logging.getLogger()
+
+DISCOVERY = 'storage-discovery'
+
+LEADER = 'leader'
+FOLLOWER = 'follower'
+ALONE = 'alone'
+
+DEFAULT_WAIT_MS = 600000
+DEFAULT_SYNC_WAIT_MS = 20000
+DEFAULT_LEASE_TTL = 900
+DEFAULT_POLL_INTERVAL = 1.0
+
+# arns: every discovered resource ARN, skip_arns: the ones with the skip tag, volumes: ebs.VolumeRecord list,
+# tags: ARN to the tags it carried before the leader's writes, limited to tag_keys and without the keys the leader
+# writes to it.
+Snapshot = namedtuple('Snapshot', ['arns', 'skip_arns', 'volumes', 'tags', 'tag_keys'])
+
+_leaders = {}
+_leaders_lock = threading.Lock()
+
+
+def get_store():
+    """Get the single-flight store configured by SINGLE_FLIGHT_STORE, which defaults to the job store."""
+    return stores.get_store(os.environ.get('SINGLE_FLIGHT_STORE') or os.environ.get('JOB_STORE'))
+
+
+def is_enabled():
+    """Check whether SINGLE_FLIGHT leaves the coalescing on."""
+    return os.environ.get('SINGLE_FLIGHT', 'on').lower() != 'off'
+
+
+def discovery_operation(backend, strict=False):
+    """Operation of a storage discovery: DISCOVERY with the backend, and strict mode when it is on."""
+    return f"{DISCOVERY}:{backend}{':strict' if strict else ''}"
+
+
+def get_wait_ms(asynchronous):
+    """How long a follower waits for the snapshot: SINGLE_FLIGHT_WAIT_MS for the worker of an async job,
+    SINGLE_FLIGHT_SYNC_WAIT_MS for a request whose client waits for the response."""
+    if asynchronous:
+        return int(os.environ.get('SINGLE_FLIGHT_WAIT_MS', DEFAULT_WAIT_MS))
+    return int(os.environ.get('SINGLE_FLIGHT_SYNC_WAIT_MS', DEFAULT_SYNC_WAIT_MS))
+
+
+def get_lease_ttl():
+    """Seconds the lease of a leader, and its snapshot, last if the leader dies without releasing them."""
+    return int(os.environ.get('SINGLE_FLIGHT_LEASE_TTL', DEFAULT_LEASE_TTL))
+
+
+def flight_key(account, region, operation):
+    """Key of the lease of a flight in the store. The snapshot is kept under the same key with a snapshot: prefix."""
+    return f"single-flight:{operation}:{account}:{region}"
+
+
+def encode_snapshot(snapshot):
+    """Encode a snapshot into a compressed store value."""
+    data = json.dumps([snapshot.arns, snapshot.skip_arns, [list(volume) for volume in snapshot.volumes],
+                       snapshot.tags, snapshot.tag_keys])
+    return {'data': base64.b64encode(zlib.compress(data.encode())).decode()}
+
+
+def decode_snapshot(value):
+    """Build a snapshot from the store value of encode_snapshot."""
+    arns, skip_arns, volumes, tags, tag_keys = json.loads(zlib.decompress(base64.b64decode(value['data'])).decode())
+    return Snapshot(arns, skip_arns, [ebs.VolumeRecord(*volume) for volume in volumes], tags, tag_keys)
+
+
+def build_snapshot(arns, skip_arns, volumes, tag_keys, current_tags, tags, vpcx_backup_tag):
+    """Build the snapshot of a leader from what it discovered, before its writes.
+
+    Args:
+        arns: The discovered resource ARNs
+        skip_arns: The ARNs with the skip tag, which are not written to
+        volumes: The ebs.VolumeRecord list of the volumes
+        tag_keys: The tag keys whose values were read for the ARNs, e.g. the keys of current_tags
+        current_tags (dict): ARN to its tags before the writes, or None when they were not read
+        tags (dict): The tags the leader writes to the resources that are not skipped. Their keys are left out of the
+            tags of those resources, so a follower writes its own values of them whatever the leader's writes do.
+        vpcx_backup_tag (dict): The vpcx-backup tag of the request, which decides whether volumes can be skipped,
+            see ebs.tag_volumes
+
+    Returns:
+        Snapshot
+    """
+    skip = set(skip_arns)
+    known = {}
+    for arn in arns:
+        before = (current_tags or {}).get(arn, {})
+        known[arn] = before if arn in skip else {key: value for key, value in before.items() if key not in tags}
+    can_skip = bool(vpcx_backup_tag) and vpcx_backup_tag.get(ebs.BACKUP_TAG_KEY) != 'legal-hold'
+    records = []
+    for volume in volumes:
+        written = not (can_skip and volume.skip)
+        records.append(ebs.volume_record(volume.volume_id, {key: value for key, value in volume.tags.items()
+                                                            if not written or key not in tags}))
+    return Snapshot(list(arns), list(skip_arns), records, known,
+                    sorted(tag_keys) if current_tags is not None else [])
+
+
+def current_tags(snapshot, tag_keys, fetch_tags=None):
+    """Get the current tags of the ARNs of a snapshot for the diff of a follower.
+
+    Args:
+        snapshot (Snapshot): The snapshot of the leader
+        tag_keys: The tag keys of the follower
+        fetch_tags: Callable fetch_tags(keys) returning ARN to tags for keys the snapshot does not know, e.g. a
+            partial of resource_groups_tagging_api.get_resource_tags. Without it the unknown keys are written.
+
+    Returns:
+        dict: ARN to its current tags
+    """
+    missing_keys = sorted(set(tag_keys) - set(snapshot.tag_keys))
+    if not missing_keys or fetch_tags is None:
+        return snapshot.tags
+    tags = {arn: dict(arn_tags) for arn, arn_tags in snapshot.tags.items()}
+    for arn, fetched in fetch_tags(missing_keys).items():
+        if arn in tags:
+            tags[arn].update(fetched)
+    return tags
+
+
+def record(items, into):
+    """Yield the items, appending each of them to the into list."""
+    for item in items:
+        into.append(item)
+        yield item
+
+
+def record_collectors(collectors, into):
+    """Wrap discovery collectors so that every item they yield is appended to the into list."""
+    def recording(func):
+        return lambda *args: record(func(*args), into)
+    return [Collector(collector.name, collector.service, recording(collector.func), collector.args)
+            for collector in collectors]
+
+
+class Flight(object):
+    """The part of a request in the flight of its account, region and operation.
+
+    Build it with join. role is LEADER when the request runs the operation and should publish its snapshot,
+    FOLLOWER when snapshot holds the snapshot of a leader, and ALONE when the request runs the operation without
+    coalescing.
+    """
+
+    def __init__(self, key, store, role=ALONE, snapshot=None, waited_ms=0, owner=None, event=None):
+        self.key = key
+        self.store = store
+        self.role = role
+        self.snapshot = snapshot
+        self.waited_ms = waited_ms
+        self._owner = owner
+        self._event = event
+
+    def stats(self):
+        """Role and wait of the request, for the response."""
+        return {'role': self.role, 'waited_ms': self.waited_ms}
+
+    def publish(self, snapshot):
+        """Publish the snapshot of the leader until it releases the flight."""
+        if self.role != LEADER:
+            return
+        try:
+            self.store.put(f"snapshot:{self.key}", encode_snapshot(snapshot), get_lease_ttl())
+        except Exception as err:  # pylint: disable=broad-except
+            # e.g. a snapshot over the item size limit of DynamoDB. The followers discover on their own.
+            logger.info(f"Could not publish the snapshot of {self.key}: {err}")
+
+    def invalidate(self):
+        """Remove the snapshot a follower used once it changed tags, so that later requests do not diff against
+        tags that are no longer current."""
+        if self.role == FOLLOWER:
+            self.store.delete(f"snapshot:{self.key}")
+
+    def release(self):
+        """Remove the snapshot and release the lease of the leader, and wake up the followers of the container."""
+        if self._owner is not None:
+            self.store.delete(f"snapshot:{self.key}")
+            self.store.delete(self.key)
+            self._owner = None
+        if self._event is not None:
+            with _leaders_lock:
+                if _leaders.get(self.key) is self._event:
+                    del _leaders[self.key]
+            self._event.set()
+            self._event = None
+
+
+def invalidate_discovery(account, region, store=None):
+    """Remove the discovery snapshots of an account and region, e.g. once the exception handler changed the skip tags
+    of its resources. The requests that join the flights later wait for their leaders to be done and discover
+    again."""
+    if not is_enabled():
+        return
+    store = store or get_store()
+    for backend in BACKENDS:
+        for strict in (False, True):
+            store.delete(f"snapshot:{flight_key(account, region, discovery_operation(backend, strict))}")
+
+
+def _read_snapshot(store, key):
+    value = store.get(f"snapshot:{key}")
+    return decode_snapshot(value) if value is not None else None
+
+
+def join(account, region, operation, store=None, deadline=None, wait_ms=None, poll_interval=None):
+    """Join the flight of an account, region and operation: become its leader or wait for the snapshot of its leader.
+
+    Args:
+        account: The account of the request
+        region: The region of the request
+        operation: The operation, e.g. discovery_operation(backend, strict)
+        deadline: checkpoints.Deadline of the request. A follower stops waiting before it expires.
+        wait_ms: How long a follower waits, see get_wait_ms. Defaults to the wait of an async job.
+
+    Returns:
+        Flight: The flight. Call release once the request is done, including after an error.
+    """
+    store = store or get_store()
+    key = flight_key(account, region, operation)
+    if not is_enabled():
+        return Flight(key, store)
+    wait_ms = get_wait_ms(True) if wait_ms is None else wait_ms
+    if deadline is not None and deadline.remaining_ms() is not None:
+        wait_ms = min(wait_ms, max(0, deadline.remaining_ms()))
+    poll_interval = float(os.environ.get('SINGLE_FLIGHT_POLL_INTERVAL', DEFAULT_POLL_INTERVAL)) \
+        if poll_interval is None else poll_interval
+    start = time.monotonic()
+
+    def waited_ms():
+        return int((time.monotonic() - start) * 1000)
+
+    while True:
+        snapshot = _read_snapshot(store, key)
+        if snapshot is not None:
+            logger.info(f"Following the snapshot of {key} after {waited_ms()} ms")
+            return Flight(key, store, FOLLOWER, snapshot, waited_ms())
+        remaining_s = (wait_ms - waited_ms()) / 1000
+        if remaining_s <= 0:
+            logger.info(f"No snapshot of {key} after {waited_ms()} ms, running alone")
+            return Flight(key, store, ALONE, waited_ms=waited_ms())
+        with _leaders_lock:
+            event = _leaders.get(key)
+            if event is None:
+                event = _leaders[key] = threading.Event()
+                local_leader = True
+            else:
+                local_leader = False
+        if not local_leader:
+            # A request of this container leads: wait for it to finish.
+            event.wait(remaining_s)
+            continue
+        owner = str(uuid.uuid4())
+        if store.add(key, {'owner': owner, 'started_at': int(time.time())}, get_lease_ttl()):
+            logger.info(f"Leading {key}")
+            return Flight(key, store, LEADER, waited_ms=waited_ms(), owner=owner, event=event)
+        # A request of another container leads: poll the store for its snapshot.
+        with _leaders_lock:
+            del _leaders[key]
+        event.set()
+        time.sleep(min(poll_interval, remaining_s))
@@ -0,0 +1,246 @@
+"""Pluggable key-value stores for the state the handlers share across invocations: async jobs and the like.
+
+A store keeps JSON serialisable dict values under string keys, with an optional time to live in seconds. Three
+implementations share the same methods:
+
+- MemoryStore keeps the entries in the container. Warm invocations of the same container see them, other containers
+  do not. Used by default and in the unit tests.
+- SQLiteStore keeps them in a SQLite file, e.g. under /tmp or on a developer machine, so local runs survive restarts.
+- DynamoDBStore keeps them in a DynamoDB table with a ``key`` string hash key, shared by every container. Expired
+  items are ignored on read, and ``expires_at`` can be set as the table TTL attribute to have them removed.
+
+get_store builds a store from a URL: ``memory://``, ``sqlite:///tmp/state.db`` or ``dynamodb://table-name``. The
+stores are cached per URL, so a memory store is kept across the warm invocations of a container.
+"""
+import json
+import time
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from utils.exceptions import InvalidInputException
+
+DEFAULT_STORE_URL = 'memory://'
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def _expires_at(ttl):
+    return int(time.time() + ttl) if ttl else None
+
+
+def _is_live(expires_at):
+    return expires_at is None or expires_at > time.time()
+
+
+class MemoryStore(object):
+    """Entries kept in the container."""
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Get the value of a key, or None when it is missing or expired."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or not _is_live(entry[1]):
+                return None
+            return json.loads(entry[0])
+
+    def put(self, key, value, ttl=None):
+        """Set the value of a key, expiring after ttl seconds when ttl is given."""
+        with self._lock:
+            self._entries[key] = (json.dumps(value), _expires_at(ttl))
+
+    def add(self, key, value, ttl=None):
+        """Set the value of a key only when it is missing or expired.
+
+        Returns:
+            bool: Whether the value was set
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and _is_live(entry[1]):
+                return False
+            self._entries[key] = (json.dumps(value), _expires_at(ttl))
+            return True
+
+    def update(self, key, changes):
+        """Merge changes into the value of a key, keeping its expiration.
+
+        Returns:
+            dict: The new value, or None when the key is missing or expired
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or not _is_live(entry[1]):
+                return None
+            value = json.loads(entry[0])
+            value.update(changes)
+            self._entries[key] = (json.dumps(value), entry[1])
+            return value
+
+    def delete(self, key):
+        """Remove a key."""
+        with self._lock:
+            self._entries.pop(key, None)
+
+
+class SQLiteStore(object):
+    """Entries kept in a SQLite file."""
+
+    def __init__(self, path):
+        self.path = path
+        with self._transaction() as connection:
+            connection.execute('CREATE TABLE IF NOT EXISTS entries '
+                               '(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at INTEGER)')
+
+    @contextmanager
+    def _transaction(self):
+        # BEGIN IMMEDIATE takes the write lock first, so that add and update are atomic across processes.
+        connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                yield connection
+            except BaseException:
+                connection.execute('ROLLBACK')
+                raise
+            connection.execute('COMMIT')
+        finally:
+            connection.close()
+
+    @staticmethod
+    def _read(connection, key):
+        row = connection.execute('SELECT value, expires_at FROM entries WHERE key = ?', (key,)).fetchone()
+        if row is None or not _is_live(row[1]):
+            return None, None
+        return json.loads(row[0]), row[1]
+
+    def get(self, key):
+        """Get the value of a key, or None when it is missing or expired."""
+        with self._transaction() as connection:
+            return self._read(connection, key)[0]
+
+    def put(self, key, value, ttl=None):
+        """Set the value of a key, expiring after ttl seconds when ttl is given."""
+        with self._transaction() as connection:
+            connection.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?)',
+                               (key, json.dumps(value), _expires_at(ttl)))
+
+    def add(self, key, value, ttl=None):
+        """Set the value of a key only when it is missing or expired. See MemoryStore.add."""
+        with self._transaction() as connection:
+            if self._read(connection, key)[0] is not None:
+                return False
+            connection.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?)',
+                               (key, json.dumps(value), _expires_at(ttl)))
+            return True
+
+    def update(self, key, changes):
+        """Merge changes into the value of a key. See MemoryStore.update."""
+        with self._transaction() as connection:
+            value = self._read(connection, key)[0]
+            if value is None:
+                return None
+            value.update(changes)
+            connection.execute('UPDATE entries SET value = ? WHERE key = ?', (json.dumps(value), key))
+            return value
+
+    def delete(self, key):
+        """Remove a key."""
+        with self._transaction() as connection:
+            connection.execute('DELETE FROM entries WHERE key = ?', (key,))
+
+
+class DynamoDBStore(object):
+    """Entries kept in a DynamoDB table. The value is stored as a JSON string in the ``value`` attribute."""
+
+    def __init__(self, table_name, client=None):
+        if client is None:
+            import boto3
+            client = boto3.client('dynamodb')
+        self.table_name = table_name
+        self.client = client
+
+    def _item(self, key, value, expires_at):
+        item = {'key': {'S': key}, 'value': {'S': json.dumps(value)}}
+        if expires_at is not None:
+            item['expires_at'] = {'N': str(expires_at)}
+        return item
+
+    def _read(self, key):
+        item = self.client.get_item(TableName=self.table_name, Key={'key': {'S': key}},
+                                    ConsistentRead=True).get('Item')
+        if item is None:
+            return None, None
+        expires_at = int(item['expires_at']['N']) if 'expires_at' in item else None
+        if not _is_live(expires_at):
+            return None, None
+        return json.loads(item['value']['S']), expires_at
+
+    def get(self, key):
+        """Get the value of a key, or None when it is missing or expired."""
+        return self._read(key)[0]
+
+    def put(self, key, value, ttl=None):
+        """Set the value of a key, expiring after ttl seconds when ttl is given."""
+        self.client.put_item(TableName=self.table_name, Item=self._item(key, value, _expires_at(ttl)))
+
+    def add(self, key, value, ttl=None):
+        """Set the value of a key only when it is missing or expired. See MemoryStore.add."""
+        try:
+            self.client.put_item(
+                TableName=self.table_name,
+                Item=self._item(key, value, _expires_at(ttl)),
+                ConditionExpression='attribute_not_exists(#key) OR expires_at <= :now',
+                ExpressionAttributeNames={'#key': 'key'},
+                ExpressionAttributeValues={':now': {'N': str(int(time.time()))}}
+            )
+            return True
+        except self.client.exceptions.ConditionalCheckFailedException:
+            return False
+
+    def update(self, key, changes):
+        """Merge changes into the value of a key. See MemoryStore.update.
+
+        The read and the write are not atomic: concurrent updates of the same key may lose changes, so a key should
+        have a single writer (e.g. the worker of a job).
+        """
+        value, expires_at = self._read(key)
+        if value is None:
+            return None
+        value.update(changes)
+        self.client.put_item(TableName=self.table_name, Item=self._item(key, value, expires_at))
+        return value
+
+    def delete(self, key):
+        """Remove a key."""
+        self.client.delete_item(TableName=self.table_name, Key={'key': {'S': key}})
+
+
+def create_store(url):
+    """Build a store from its URL, see the module docstring.
+
+    Raises:
+        InvalidInputException: The URL scheme is not memory, sqlite or dynamodb
+    """
+    scheme, _, location = url.partition('://')
+    if scheme == 'memory':
+        return MemoryStore()
+    if scheme == 'sqlite':
+        return SQLiteStore(location)
+    if scheme == 'dynamodb':
+        return DynamoDBStore(location)
+    raise InvalidInputException(f"Unknown store {url}. Use memory://, sqlite://<path> or dynamodb://<table>")
+
+
+def get_store(url=None):
+    """Get the store of a URL, creating it on first use. Defaults to a memory store."""
+    url = url or DEFAULT_STORE_URL
+    with _stores_lock:
+        if url not in _stores:
+            _stores[url] = create_store(url)
+        return _stores[url]
@@ -0,0 +1,132 @@
+"""Desired-state tag planning.
+
+The handlers are called daily with the same tags, so most resources already carry them. In diff mode the current
+tags are read in bulk first and a resource is only written to when one of its tags actually changes. Resources that
+need the same change are grouped so that every group is sent as one batched write.
+
+Several tag sets meant for overlapping resources (e.g. the request tags and the vpcx-backup tag) are merged per
+resource first, so a resource that needs both gets them in a single call.
+"""
+import os
+from collections import OrderedDict, namedtuple
+
+from utils.exceptions import InvalidInputException
+
+DIFF_MODE = 'diff'
+FULL_MODE = 'full'
+WRITE_MODES = (DIFF_MODE, FULL_MODE)
+
+# groups: list of (tags, resource ids). tags is a dict for plan_tags and a list of keys for plan_untags.
+# sent and avoided count resource writes, i.e. one per resource and call. avoided is measured against sending
+# every tag set to every one of its resources.
+TagPlan = namedtuple('TagPlan', ['groups', 'sent', 'avoided'])
+
+
+def get_write_mode(event):
+    """Get the write mode of a request: the ``mode`` query string parameter, or the TAG_WRITE_MODE environment
+    variable, which defaults to full. Diff mode is opt-in.
+
+    Raises:
+        InvalidInputException: The mode is neither diff nor full
+    """
+    params = event.get('queryStringParameters') or {}
+    mode = params.get('mode') or os.environ.get('TAG_WRITE_MODE', FULL_MODE)
+    if mode not in WRITE_MODES:
+        raise InvalidInputException(f"mode should be one of {list(WRITE_MODES)}")
+    return mode
+
+
+def tags_to_dict(tags):
+    """Convert EC2 style tags, [{'Key': key, 'Value': value}], to a dict."""
+    return {tag['Key']: tag.get('Value') for tag in tags or []}
+
+
+def plan_tags(resource_ids, tags, current_tags=None):
+    """Plan the writes that give every resource the tags. See plan_tag_sets."""
+    return plan_tag_sets([(resource_ids, tags)], current_tags)
+
+
+def merge_tag_sets(tag_sets):
+    """Merge the tag sets per resource.
+
+    Args:
+        tag_sets: (resource ids, tags dict) pairs. When two sets give a key to the same resource, the later wins.
+
+    Returns:
+        OrderedDict: resource id to the merged tags, in the order the resources first appear
+    """
+    merged = OrderedDict()
+    for resource_ids, tags in tag_sets:
+        if not tags:
+            continue
+        for resource_id in resource_ids:
+            merged.setdefault(resource_id, {}).update(tags)
+    return merged
+
+
+def plan_tag_sets(tag_sets, current_tags=None):
+    """Plan the writes that give every resource the tags of all the tag sets it belongs to.
+
+    Args:
+        tag_sets: (resource ids, tags dict) pairs
+        current_tags (dict): resource id to its current tags. None sends the merged tags to every resource.
+
+    Returns:
+        TagPlan: The resources grouped by the exact tags they need, one group per distinct tag dict
+    """
+    tag_sets = [(list(resource_ids), tags) for resource_ids, tags in tag_sets]
+    baseline = sum(len(resource_ids) for resource_ids, tags in tag_sets if tags)
+    groups = OrderedDict()
+    for resource_id, tags in merge_tag_sets(tag_sets).items():
+        current = {} if current_tags is None else current_tags.get(resource_id, {})
+        adds = tuple(sorted((key, value) for key, value in tags.items() if current.get(key) != value))
+        if adds:
+            groups.setdefault(adds, []).append(resource_id)
+    sent = sum(len(ids) for ids in groups.values())
+    return TagPlan([(dict(adds), ids) for adds, ids in groups.items()], sent, baseline - sent)
+
+
+def plan_untags(resource_ids, tag_keys, current_tags=None, values=None):
+    """Plan the writes that remove tag keys from the resources.
+
+    Args:
+        resource_ids: The ARNs or ids of the resources
+        tag_keys (list): The keys to remove
+        current_tags (dict): resource id to its current tags. None removes every key from every resource.
+        values (dict): key to value, for keys that are only removed when they have that value
+
+    Returns:
+        TagPlan: The resources grouped by the keys they carry
+    """
+    resource_ids = list(resource_ids)
+    if not tag_keys or not resource_ids:
+        return TagPlan([], 0, 0)
+    if current_tags is None:
+        return TagPlan([(list(tag_keys), resource_ids)], len(resource_ids), 0)
+
+    values = values or {}
+    groups = OrderedDict()
+    for resource_id in resource_ids:
+        current = current_tags.get(resource_id, {})
+        removes = tuple(key for key in tag_keys
+                        if key in current and (key not in values or current[key] == values[key]))
+        if removes:
+            groups.setdefault(removes, []).append(resource_id)
+    sent = sum(len(ids) for ids in groups.values())
+    return TagPlan([(list(keys), ids) for keys, ids in groups.items()], sent, len(resource_ids) - sent)
+
+
+def apply(plan, write):
+    """Call write(tags, resource_ids) once per group of the plan and return the plan."""
+    for tags, resource_ids in plan.groups:
+        write(tags, resource_ids)
+    return plan
+
+
+def summarize(plans):
+    """Sum the resource writes sent and avoided by the plans, for the response."""
+    plans = list(plans)
+    return {
+        'sent': sum(plan.sent for plan in plans),
+        'avoided': sum(plan.avoided for plan in plans)
+    }
@@ -0,0 +1,66 @@
+"""Unit tests for arn router utils"""
+import os
+from unittest import TestCase
+import unittest
+# pylint: disable = no-name-in-module,import-error,no-self-use,broad-except, C0413, C0411, C0330
+
+BASE_PATH = os.path.dirname(os.path.realpath(__file__))
+
+VOLUME_ARN = "arn:aws:ec2:us-east-1:123456789012:volume/vol-012ea34a439822303"
+SNAPSHOT_ARN = "arn:aws:ec2:us-east-1::snapshot/snap-0123456789abcdef0"
+DB_ARN = "arn:aws:rds:us-east-1:123456789012:db:rds_db_instance_1"
+
+
+class RecordingClient(object):
+    """Records the calls made through throttling.call"""
+
+    def __init__(self):
+        self.calls = []
+
+    def __getattr__(self, operation):
+        def record(**kwargs):
+            self.calls.append((operation, kwargs))
+            return {'FailedResourcesMap': {}}
+        return record
+
+
+class TestArnRouter(TestCase):
+
+    def test_parse_arn(self):
+        """The resource part is split on / or :"""
+        from utils.arn_router import parse_arn, ArnParts
+        self.assertEqual(parse_arn(VOLUME_ARN),
+                         ArnParts('aws', 'ec2', 'us-east-1', '123456789012', 'volume', 'vol-012ea34a439822303'))
+        self.assertEqual(parse_arn(DB_ARN),
+                         ArnParts('aws', 'rds', 'us-east-1', '123456789012', 'db', 'rds_db_instance_1'))
+        self.assertIsNone(parse_arn('vol-012ea34a439822303'))
+
+    def test_route_arns(self):
+        """EC2 ARNs are mapped to their ids, the others are kept for the tagging API"""
+        from utils.arn_router import route_arns
+        routed = route_arns([VOLUME_ARN, DB_ARN, SNAPSHOT_ARN])
+        self.assertEqual(list(routed.ec2.items()), [(VOLUME_ARN, 'vol-012ea34a439822303'),
+                                                    (SNAPSHOT_ARN, 'snap-0123456789abcdef0')])
+        self.assertEqual(routed.other, [DB_ARN])
+
+    def test_tag_and_untag_resources(self):
+        """1000 EC2 ids go in one create_tags call, the other ARNs in 20-ARN tag_resources calls"""
+        from utils.arn_router import tag_resources, untag_resources
+        ec2_client = RecordingClient()
+        rgta_client = RecordingClient()
+        volume_arns = [f"arn:aws:ec2:us-east-1:123456789012:volume/vol-{i:017x}" for i in range(1000)]
+        tag_resources(rgta_client, ec2_client, {'vpcx-skip-backup': 'true'}, volume_arns + [DB_ARN])
+        self.assertEqual([operation for operation, kwargs in ec2_client.calls], ['create_tags'])
+        self.assertEqual(len(ec2_client.calls[0][1]['Resources']), 1000)
+        self.assertEqual(ec2_client.calls[0][1]['Tags'], [{'Key': 'vpcx-skip-backup', 'Value': 'true'}])
+        self.assertEqual(rgta_client.calls, [('tag_resources', {'ResourceARNList': [DB_ARN],
+                                                                'Tags': {'vpcx-skip-backup': 'true'}})])
+
+        untag_resources(rgta_client, ec2_client, ['vpcx-backup'], [SNAPSHOT_ARN])
+        self.assertEqual(ec2_client.calls[-1], ('delete_tags', {'Resources': ['snap-0123456789abcdef0'],
+                                                                'Tags': [{'Key': 'vpcx-backup'}]}))
+        self.assertEqual(len(rgta_client.calls), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,129 @@
+"""Unit tests for batch executor utils"""
+import os
+import threading
+import time
+from unittest import TestCase
+import unittest
+# pylint: disable = no-name-in-module,import-error,no-self-use,broad-except, C0413, C0411, C0330
+
+BASE_PATH = os.path.dirname(os.path.realpath(__file__))
+
+
+class TestBatchExecutor(TestCase):
+
+    def test_chunks(self):
+        """Test splitting a list into batches"""
+        from utils.batch_executor import chunks
+        self.assertEqual(chunks(list(range(5)), 2), [[0, 1], [2, 3], [4]])
+        self.assertEqual(chunks([], 20), [])
+
+    def test_run_batches_keeps_batch_order(self):
+        """Results come back in batch order whatever order the batches finish in"""
+        from utils.batch_executor import run_batches
+
+        def func(batch):
+            time.sleep(0.01 * (5 - batch[0]))
+            return batch[0]
+
+        self.assertEqual(run_batches(func, list(range(5)), 1, 'test_order', max_workers=5), [0, 1, 2, 3, 4])
+
+    def test_run_batches_respects_api_limit(self):
+        """No more batches of an API are in flight than its cap"""
+        from utils.batch_executor import run_batches
+        lock = threading.Lock()
+        state = {'running': 0, 'peak': 0}
+
+        def func(batch):
+            with lock:
+                state['running'] += 1
+                state['peak'] = max(state['peak'], state['running'])
+            time.sleep(0.01)
+            with lock:
+                state['running'] -= 1
+
+        os.environ['BATCH_API_CONCURRENCY'] = 'test_limit=2'
+        try:
+            run_batches(func, list(range(10)), 1, 'test_limit', max_workers=8)
+        finally:
+            del os.environ['BATCH_API_CONCURRENCY']
+        self.assertEqual(state['peak'], 2)
+
+    def test_run_batches_raises_first_error(self):
+        """The error of the first failing batch is raised"""
+        from utils.batch_executor import run_batches
+
+        def func(batch):
+            if batch[0] in (2, 3):
+                raise ValueError(f"batch {batch[0]}")
+            return batch[0]
+
+        with self.assertRaisesRegex(ValueError, 'batch 2'):
+            run_batches(func, list(range(5)), 1, 'test_error', max_workers=4)
+
+    def test_run_isolated_batches_bisects_bad_items(self):
+        """A batch failing because of one item is bisected, the other items are written"""
+        import botocore.exceptions
+        from utils.batch_executor import run_isolated_batches, ItemFailure
+        calls = []
+
+        def func(batch):
+            calls.append(list(batch))
+            if 5 in batch:
+                raise botocore.exceptions.ClientError(
+                    {'Error': {'Code': 'InvalidParameterException', 'Message': 'bad arn'}}, 'TagResources')
+            return len(batch)
+
+        outcome = run_isolated_batches(func, list(range(16)), 16, 'test_bisect', max_workers=1)
+        self.assertEqual(outcome.failures, [ItemFailure(5, 'InvalidParameterException', 'bad arn')])
+        self.assertEqual(sum(outcome.results), 15)
+        # One call for the whole batch, then two per level of the bisection.
+        self.assertEqual(len(calls), 1 + 2 * 4)
+
+    def test_run_isolated_batches_stops_on_request_errors(self):
+        """An item error code returned for every half is raised as an error of the request"""
+        import botocore.exceptions
+        from utils.batch_executor import run_isolated_batches
+        calls = []
+
+        def func(batch):
+            calls.append(list(batch))
+            raise botocore.exceptions.ClientError(
+                {'Error': {'Code': 'InvalidParameterException', 'Message': 'Invalid tag key'}}, 'TagResources')
+
+        with self.assertRaisesRegex(botocore.exceptions.ClientError, 'Invalid tag key'):
+            run_isolated_batches(func, list(range(1000)), 1000, 'test_request_error', max_workers=1)
+        self.assertEqual(len(calls), 3)
+
+    def test_run_isolated_batches_returns_failed_items(self):
+        """The items reported as failed by a response are returned without being sent again"""
+        from utils.batch_executor import run_isolated_batches, ItemFailure
+        calls = []
+
+        def func(batch):
+            calls.append(list(batch))
+            return {item: ('InternalServiceException', 'try again') for item in batch if item in (1, 3)}
+
+        outcome = run_isolated_batches(func, list(range(5)), 5, 'test_failed_items', max_workers=1,
+                                       failed_items=lambda response: response)
+        self.assertEqual(calls, [[0, 1, 2, 3, 4]])
+        self.assertEqual(outcome.failures, [ItemFailure(1, 'InternalServiceException', 'try again'),
+                                            ItemFailure(3, 'InternalServiceException', 'try again')])
+
+    def test_run_isolated_batches_raises_other_errors(self):
+        """Errors that are not caused by an item are raised without bisecting"""
+        import botocore.exceptions
+        from utils.batch_executor import run_isolated_batches
+        calls = []
+
+        def func(batch):
+            calls.append(batch)
+            raise botocore.exceptions.ClientError({'Error': {'Code': 'AccessDenied', 'Message': 'denied'}},
+                                                  'TagResources')
+
+        with self.assertRaises(botocore.exceptions.ClientError):
+            run_isolated_batches(func, list(range(4)), 4, 'test_other_error', max_workers=1)
+        self.assertEqual(len(calls), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
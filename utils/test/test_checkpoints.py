@@ -0,0 +1,143 @@
+"""Unit tests for checkpoints utils"""
+import os
+import time
+from unittest import TestCase, mock
+import unittest
+# pylint: disable = no-name-in-module,import-error,no-self-use,broad-except, C0413, C0411, C0330
+
+BASE_PATH = os.path.dirname(os.path.realpath(__file__))
+
+
+class FakeContext(object):
+    def __init__(self, remaining_ms):
+        self.remaining_ms = remaining_ms
+
+    def get_remaining_time_in_millis(self):
+        return self.remaining_ms
+
+
+class TestCheckpoints(TestCase):
+
+    def test_deadline(self):
+        """The deadline expires once less than the margin is left, and never without a Lambda context"""
+        from utils.checkpoints import Deadline
+        context = FakeContext(90000)
+        deadline = Deadline(context, margin_ms=60000)
+        self.assertEqual(deadline.remaining_ms(), 30000)
+        self.assertFalse(deadline.expired())
+        context.remaining_ms = 60000
+        self.assertTrue(deadline.expired())
+        self.assertFalse(Deadline(None).expired())
+
+    def test_cursor_encode_decode(self):
+        """The done and written ARNs survive a round trip, compressed"""
+        from utils.checkpoints import Cursor
+        arns = [f"arn:aws:rds:us-east-1:123456789012:db:db-{i}" for i in range(1000)]
+        cursor = Cursor(arns[:400])
+        cursor.add(arns[400:])
+        encoded = cursor.encode()
+        self.assertLess(len(encoded), len(''.join(arns)) / 10)
+        self.assertEqual(Cursor.decode(encoded).done, set(arns))
+        self.assertEqual(Cursor.decode(None).done, set())
+
+    def test_continue_later(self):
+        """The state is saved under the job of the request and the follow-up loads it"""
+        from utils import checkpoints, jobs
+        from utils.stores import MemoryStore
+        store = MemoryStore()
+        dispatched = []
+        event = {'queryStringParameters': {'async': 'true'}, jobs.JOB_ID_KEY: 'job-1'}
+        with mock.patch.object(jobs, 'dispatch', lambda *args, **extra: dispatched.append(extra)), \
+                mock.patch.dict(os.environ, {'CHECKPOINT_MAX_INVOCATIONS': '2'}):
+            self.assertEqual(checkpoints.load(checkpoints.get_checkpoint_id(event, store), store), None)
+            self.assertTrue(checkpoints.can_continue(None))
+            job_id = checkpoints.continue_later(event, None, None, {'invocation': 1, 'written': ''}, store)
+            self.assertEqual(job_id, 'job-1')
+            self.assertEqual(dispatched, [{checkpoints.CHECKPOINT_KEY: 'job-1'}])
+            state = checkpoints.load(checkpoints.get_checkpoint_id({checkpoints.CHECKPOINT_KEY: 'job-1'}), store)
+            self.assertEqual(checkpoints.get_invocation(state), 2)
+            self.assertFalse(checkpoints.can_continue(state))
+
+    def test_large_checkpoint(self):
+        """The checkpoint of 100k ARNs is split into items below the DynamoDB item size limit"""
+        import json
+        import uuid
+        from utils import checkpoints
+        from utils.stores import MemoryStore
+
+        class ItemSizeStore(MemoryStore):
+            def put(self, key, value, ttl=None):
+                if len(json.dumps(value)) > 400 * 1024:
+                    raise ValueError('Item size has exceeded the maximum allowed size')
+                super().put(key, value, ttl)
+
+        store = ItemSizeStore()
+        arns = [f"arn:aws:dynamodb:us-east-1:123456789012:table/{uuid.uuid4()}" for _ in range(100000)]
+        cursor = checkpoints.Cursor()
+        cursor.add(arns)
+        event = {'queryStringParameters': {'maxApiCalls': '10'}}
+        token = checkpoints.save_continuation(event, {'invocation': 1, 'written': cursor.encode()}, store)
+        resumed = dict(event, queryStringParameters={'maxApiCalls': '10', 'continuationToken': token})
+        checkpoint_id = checkpoints.get_checkpoint_id(resumed, store)
+        self.assertGreater(store.get(checkpoints.checkpoint_key(checkpoint_id))['chunks'], 1)
+        state = checkpoints.load(checkpoint_id, store)
+        self.assertEqual(checkpoints.Cursor.decode(state['written']).done, set(arns))
+
+    def test_budget(self):
+        """The budget expires once the API calls made to the account reach max_api_calls"""
+        from utils import throttling
+        from utils.checkpoints import Budget
+        controller = throttling.get_controller('budget-account', 'us-east-1', 'rds.describe_db_instances')
+        controller.acquire()
+        controller.release(False)
+        budget = Budget(max_api_calls=2, max_duration_ms=60000, account='budget-account')
+        self.assertFalse(budget.expired())
+        self.assertGreater(budget.remaining_ms(), 59000)
+        for throttled in (False, True):
+            controller.acquire()
+            controller.release(throttled)
+        self.assertEqual(budget.api_calls(), 2)
+        self.assertTrue(budget.expired())
+        budget = Budget(max_duration_ms=5, account='budget-account')
+        time.sleep(0.01)
+        self.assertTrue(budget.expired())
+
+    def test_budget_limits(self):
+        """maxApiCalls and maxDurationMs should be positive integers of a synchronous request"""
+        from utils.checkpoints import get_budget_limits
+        from utils.exceptions import InvalidInputException
+        self.assertEqual(get_budget_limits({'queryStringParameters': None}), None)
+        self.assertEqual(get_budget_limits({'queryStringParameters': {'maxApiCalls': '50', 'maxDurationMs': '20000'}}),
+                         {'max_api_calls': 50, 'max_duration_ms': 20000})
+        for params in [{'maxApiCalls': '0'}, {'maxDurationMs': '-1'}, {'maxApiCalls': 'ten'},
+                       {'maxApiCalls': '10', 'async': 'true'}, {'continuationToken': 'abc'}]:
+            with self.assertRaises(InvalidInputException, msg=params):
+                get_budget_limits({'queryStringParameters': params})
+
+    def test_continuation_token(self):
+        """A token resumes the request it was issued for and no other"""
+        from utils import checkpoints
+        from utils.exceptions import InvalidInputException
+        from utils.stores import MemoryStore
+        store = MemoryStore()
+        event = {'pathParameters': {'account-id': 'itx-046'}, 'body': '{"owner": "team"}',
+                 'queryStringParameters': {'maxApiCalls': '10'}}
+        token = checkpoints.save_continuation(event, {'invocation': 1, 'written': ''}, store)
+        resumed = dict(event, queryStringParameters={'maxApiCalls': '20', 'continuationToken': token})
+        checkpoint_id = checkpoints.get_checkpoint_id(resumed, store)
+        self.assertEqual(checkpoints.load(checkpoint_id, store), {'invocation': 1, 'written': ''})
+
+        other = dict(resumed, body='{"owner": "other-team"}')
+        with self.assertRaisesRegex(InvalidInputException, 'different request'):
+            checkpoints.get_checkpoint_id(other, store)
+        with self.assertRaisesRegex(InvalidInputException, 'Invalid'):
+            checkpoints.get_checkpoint_id(dict(resumed, queryStringParameters={'continuationToken': 'not-a-token'}),
+                                          store)
+        store.delete(checkpoints.checkpoint_key(checkpoint_id))
+        with self.assertRaisesRegex(InvalidInputException, 'expired'):
+            checkpoints.get_checkpoint_id(resumed, store)
+        self.assertEqual(checkpoints.load(checkpoint_id, store), None)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+"""Unit tests for client pool utils"""
+import os
+import time
+from unittest import TestCase
+import unittest
+# pylint: disable = no-name-in-module,import-error,no-self-use,broad-except, C0413, C0411, C0330
+
+BASE_PATH = os.path.dirname(os.path.realpath(__file__))
+
+
+def get_credentials(access_key_id='AKIAEXAMPLE', expires_in=3600):
+    return {
+        'AccessKeyId': access_key_id,
+        'SecretAccessKey': 'secret',
+        'SessionToken': 'token',
+        'Expiration': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(time.time() + expires_in))
+    }
+
+
+class TestClientPool(TestCase):
+
+    def setUp(self):
+        from utils.client_pool import invalidate
+        invalidate()
+
+    def test_get_client_reuses_clients(self):
+        """The same client is returned for the same account, region and service"""
+        from utils.client_pool import get_client
+        credentials = get_credentials()
+        client = get_client('ec2', credentials, '123456789012', 'us-east-1')
+        self.assertIs(client, get_client('ec2', credentials, '123456789012', 'us-east-1'))
+        self.assertIsNot(client, get_client('ec2', credentials, '123456789012', 'us-west-2'))
+        self.assertIsNot(client, get_client('ec2', credentials, '210987654321', 'us-east-1'))
+
+    def test_get_client_rebuilds_on_new_or_expiring_credentials(self):
+        """Clients built with replaced or expiring credentials are rebuilt"""
+        from utils.client_pool import get_client
+        client = get_client('sts', get_credentials(), '123456789012', 'us-east-1')
+        rotated = get_client('sts', get_credentials('AKIAROTATED'), '123456789012', 'us-east-1')
+        self.assertIsNot(client, rotated)
+        expiring = get_credentials('AKIAEXPIRING', expires_in=60)
+        client = get_client('sts', expiring, '123456789012', 'us-east-1')
+        self.assertIsNot(client, get_client('sts', expiring, '123456789012', 'us-east-1'))
+
+    def test_get_client_evicts_least_recently_used(self):
+        """The pool does not grow beyond CLIENT_POOL_MAX_SIZE"""
+        from utils import client_pool
+        credentials = get_credentials()
+        os.environ['CLIENT_POOL_MAX_SIZE'] = '2'
+        try:
+            first = client_pool.get_client('sts', credentials, 'account-1', 'us-east-1')
+            client_pool.get_client('sts', credentials, 'account-2', 'us-east-1')
+            client_pool.get_client('sts', credentials, 'account-1', 'us-east-1')
+            client_pool.get_client('sts', credentials, 'account-3', 'us-east-1')
+        finally:
+            del os.environ['CLIENT_POOL_MAX_SIZE']
+        self.assertEqual([key[0] for key in client_pool._clients], ['account-1', 'account-3'])
+        self.assertIs(first, client_pool.get_client('sts', credentials, 'account-1', 'us-east-1'))
+
+    def test_parse_expiration(self):
+        from utils.client_pool import parse_expiration
+        self.assertEqual(parse_expiration('1970-01-01T00:01:40Z'), 100)
+        self.assertIsNone(parse_expiration(None))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+"""Unit tests for credentials cache utils"""
+import os
+import time
+import threading
+from unittest import TestCase
+import unittest
+# pylint: disable = no-name-in-module,import-error,no-self-use,broad-except, C0413, C0411, C0330
+
+BASE_PATH = os.path.dirname(os.path.realpath(__file__))
+
+
+class MockResponse(object):
+    def __init__(self, text):
+        self.text = text
+
+
+class MockApiRequests(object):
+    """Used to mock api_request.ApiRequests"""
+
+    def __init__(self, text):
+        self.text = text
+        self.urls = []
+
+    def request(self, url, method, scope=None, additional_headers=None):
+        self.urls.append(url)
+        return MockResponse(self.text)
+
+
+class CountingFetch(object):
+    """Fetch function returning new credentials on every call"""
+
+    def __init__(self, expires_in=3600, delay=0):
+        self.calls = 0
+        self.expires_in = expires_in
+        self.delay = delay
+        self.lock = threading.Lock()
+
+    def __call__(self):
+        time.sleep(self.delay)
+        with self.lock:
+            self.calls += 1
+            calls = self.calls
+        return {
+            'AccessKeyId': f"AKIA{calls}",
+            'Expiration': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(time.time() + self.expires_in))
+        }
+
+
+class TestCredentialsCache(TestCase):
+
+    def test_get_reuses_credentials_until_expiry(self):
+        """Credentials are fetched again only when they are about to expire or a refresh is forced"""
+        from utils.credentials_cache import CredentialsCache
+        cache = CredentialsCache(refresh_margin=300)
+        fetch = CountingFetch()
+        self.assertEqual(cache.get('123456789012', fetch)['AccessKeyId'], 'AKIA1')
+        self.assertEqual(cache.get('123456789012', fetch)['AccessKeyId'], 'AKIA1')
+        self.assertEqual(cache.get('123456789012', fetch, force_refresh=True)['AccessKeyId'], 'AKIA2')
+        cache.invalidate('123456789012')
+        self.assertEqual(cache.get('123456789012', fetch)['AccessKeyId'], 'AKIA3')
+
+        expiring = CountingFetch(expires_in=60)
+        cache.get('210987654321', expiring)
+        cache.get('210987654321', expiring)
+        self.assertEqual(expiring.calls, 2)
+
+    def test_get_shares_in_flight_fetch(self):
+        """Concurrent requests for the same account share one fetch"""
+        from utils.credentials_cache import CredentialsCache
+        cache = CredentialsCache()
+        fetch = CountingFetch(delay=0.05)
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(cache.get('123456789012', fetch)))
+                   for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(fetch.calls, 1)
+        self.assertEqual([credentials['AccessKeyId'] for credentials in results], ['AKIA1'] * 5)
+
+    def test_get_does_not_cache_errors(self):
+        from utils.credentials_cache import CredentialsCache
+        cache = CredentialsCache()
+
+        def fail():
+            raise ValueError('No account for the project_id')
+
+        self.assertRaises(ValueError, cache.get, '123456789012', fail)
+        self.assertEqual(cache.get('123456789012', CountingFetch())['AccessKeyId'], 'AKIA1')
+
+    def test_fetch_admin_credentials(self):
+        """Test the method to get the admin credentials from vpcxiam"""
+        from utils.credentials_cache import fetch_admin_credentials
+        api_requests = MockApiRequests('{"credentials": {"AccessKeyId": "AKIAEXAMPLE"}}')
+        credentials = fetch_admin_credentials(api_requests, 'https://vpcxiam', 'host', 'scope', 'itx-000')
+        self.assertEqual(credentials, {'AccessKeyId': 'AKIAEXAMPLE'})
+        self.assertEqual(api_requests.urls, ['https://vpcxiam/v1/accounts/itx-000/roles/admin/credentials'])
+        api_requests = MockApiRequests('{"error": "No account for the project_id"}')
+        self.assertRaises(ValueError, fetch_admin_credentials, api_requests, 'https://vpcxiam', 'host', 'scope',
+                          'itx-000')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,284 @@
+"""Unit tests for discovery utils"""
+import os
+import re
+import threading
+import time
+from unittest import TestCase
+import unittest
+# pylint: disable = no-name-in-module,import-error,no-self-use,broad-except, C0413, C0411, C0330
+
+BASE_PATH = os.path.dirname(os.path.realpath(__file__))
+
+
+class ConcurrencyProbe(object):
+    """Records the highest number of concurrent calls per service"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.running = {}
+        self.peak = {}
+
+    def collector(self, service, arns, delay):
+        def collect():
+            with self.lock:
+                self.running[service] = self.running.get(service, 0) + 1
+                self.peak[service] = max(self.peak.get(service, 0), self.running[service])
+            time.sleep(delay)
+            with self.lock:
+                self.running[service] -= 1
+            return arns
+        return collect
+
+
+class TestDiscovery(TestCase):
+
+    def test_run_collectors_merges_in_collector_order(self):
+        """Results are merged in collector order even when later collectors finish first"""
+        from utils.discovery import Collector, run_collectors, merge_results
+        probe = ConcurrencyProbe()
+        collectors = [
+            Collector('slow', 'rds', probe.collector('rds', ['arn-1', 'arn-2'], 0.05), ()),
+            Collector('fast', 'efs', probe.collector('efs', ['arn-3'], 0), ()),
+            Collector('skip', 'rgta', probe.collector('rgta', ['arn-2'], 0), ()),
+        ]
+        result = run_collectors(collectors, max_workers=4, service_limits={})
+        self.assertEqual(list(result.results.keys()), ['slow', 'fast', 'skip'])
+        self.assertEqual(merge_results(result.results, exclude=('skip',)), ['arn-1', 'arn-2', 'arn-3'])
+        self.assertEqual(list(result.timings.keys()), ['slow', 'fast', 'skip', 'total'])
+
+    def test_run_collectors_respects_service_limits(self):
+        """No more collectors of a service run at the same time than its limit"""
+        from utils.discovery import Collector, run_collectors
+        probe = ConcurrencyProbe()
+        collectors = [Collector(f"rds-{i}", 'rds', probe.collector('rds', [i], 0.02), ()) for i in range(6)]
+        collectors += [Collector(f"efs-{i}", 'efs', probe.collector('efs', [i], 0.02), ()) for i in range(3)]
+        run_collectors(collectors, max_workers=8, service_limits={'rds': 2, 'efs': 1})
+        self.assertEqual(probe.peak['rds'], 2)
+        self.assertEqual(probe.peak['efs'], 1)
+
+    def test_run_collectors_raises_first_error(self):
+        """The error of the first failing collector is raised"""
+        from utils.discovery import Collector, run_collectors
+
+        def fail(message):
+            def collect():
+                raise ValueError(message)
+            return collect
+
+        collectors = [
+            Collector('ok', 'rds', lambda: [], ()),
+            Collector('first', 'efs', fail('first'), ()),
+            Collector('second', 'fsx', fail('second'), ()),
+        ]
+        with self.assertRaisesRegex(ValueError, 'first'):
+            run_collectors(collectors, max_workers=2, service_limits={})
+
+    def test_build_storage_collectors(self):
+        """The storage collectors find the same RDS ARNs as get_rds_instances"""
+        from utils.discovery import build_storage_collectors, run_collectors, merge_results, SKIP_COLLECTOR
+        from utils.test.test_rds import MockRDSClient
+        from utils.test.test_dynamodb import MockDynamoDbClient
+        from utils.test.test_resource_groups_tagging_api import MockResourceGroupsTaggingApiClient
+        rds_client = MockRDSClient()
+        dynamodb_client = MockDynamoDbClient()
+        rgta_client = MockResourceGroupsTaggingApiClient()
+        empty_client = EmptyClient()
+        clients = {
+            'rds': rds_client,
+            'dynamodb': dynamodb_client,
+            'efs': empty_client,
+            'fsx': empty_client,
+            'redshift': empty_client,
+            'resourcegroupstaggingapi': rgta_client
+        }
+        result = run_collectors(build_storage_collectors(clients, 'us-east-1', '123456789012'))
+        self.assertEqual(merge_results(result.results, exclude=(SKIP_COLLECTOR,)),
+                         rds_client.get_arn_list() + dynamodb_client.get_arn_list())
+        self.assertEqual(result.results[SKIP_COLLECTOR], rgta_client.get_arn_list())
+
+    def test_rgta_backend_parity(self):
+        """The rgta backend finds the same resources to tag and to skip as the per-service collectors, apart from
+        the global tables, and none of the resource types outside STORAGE_RESOURCE_TYPES"""
+        from utils.discovery import (build_storage_collectors, run_collectors, merge_results, run_rgta_discovery,
+                                     SKIP_COLLECTOR)
+        from utils.helpers import partition_arns
+        from utils.test.test_rds import MockRDSClient
+        from utils.test.test_dynamodb import MockDynamoDbClient
+        from utils.test.test_efs import MockEFSClient
+        from utils.test.test_fsx import MockFSXClient
+        from utils.test.test_redshift import MockRedshiftClient
+        clients = {
+            'rds': MockRDSClient(),
+            'dynamodb': MockDynamoDbClient(),
+            'efs': MockEFSClient(),
+            'fsx': MockFSXClient(),
+            'redshift': MockRedshiftClient(),
+        }
+        all_arns = [arn for client in clients.values() for arn in client.get_arn_list()]
+        # The tagging API lists the replica tables of a global table, not its global-table ARN.
+        global_table_arns = clients['dynamodb'].global_tables_arn
+        other_arns = [
+            'arn:aws:rds:us-east-1:123456789012:snapshot:rds:db-1-2024-01-01',
+            'arn:aws:lambda:us-east-1:123456789012:function:tagger',
+            'arn:aws:s3:::backups-bucket',
+            'arn:aws:ec2:us-east-1:123456789012:snapshot/snap-0123456789abcdef0',
+        ]
+        tagged_arns = [arn for arn in all_arns if arn not in global_table_arns] + other_arns
+        skip_arns = [all_arns[0], all_arns[12], all_arns[-1], other_arns[0]]
+        legal_hold_arns = [all_arns[3]]
+        rgta_client = MockTaggedResourcesClient(tagged_arns, skip_arns, legal_hold_arns)
+        clients['resourcegroupstaggingapi'] = rgta_client
+
+        services = run_collectors(build_storage_collectors(clients, 'us-east-1', '123456789012'))
+        services_partition = partition_arns(merge_results(services.results, exclude=(SKIP_COLLECTOR,)),
+                                            services.results[SKIP_COLLECTOR])
+        inventory = run_rgta_discovery(rgta_client, ['owner'])
+        rgta_partition = partition_arns(inventory.arns, inventory.skip_arns)
+
+        self.assertFalse(set(inventory.arns) & set(other_arns))
+        self.assertEqual(sorted(rgta_partition.kept),
+                         sorted(arn for arn in services_partition.kept if arn not in global_table_arns))
+        self.assertEqual(sorted(rgta_partition.skipped), sorted(services_partition.skipped))
+        self.assertEqual(dict(inventory.counts), {'tag': len(tagged_arns) - len(other_arns) - 4, 'skip': 4,
+                                                  'legal-hold': 1})
+        self.assertEqual(inventory.volumes[0].volume_id, 'vol-012ea34a439822303')
+        self.assertTrue(inventory.volumes[0].skip)
+        self.assertEqual(inventory.tags[all_arns[1]], {'owner': 'team'})
+
+    def test_rgta_backend_stops_at_the_deadline(self):
+        """The writes of the rgta backend stop close to the timeout and the rest is saved in a checkpoint"""
+        from unittest import mock
+        from utils import checkpoints, jobs, pipeline
+        from utils.discovery import run_rgta_discovery
+        from utils.stores import MemoryStore
+        from utils.test.test_checkpoints import FakeContext
+        arns = [f"arn:aws:rds:us-east-1:123456789012:db:db-{i}" for i in range(100)]
+        inventory = run_rgta_discovery(MockTaggedResourcesClient(arns, [arns[0]], []), ['owner'])
+        written = []
+        cursor = checkpoints.Cursor()
+        pipeline.write_stream(iter(inventory.arns), [{'owner': 'other-team'}],
+                              lambda tags, batch: written.extend(batch), 20, skip_arns=inventory.skip_arns, current_tags=inventory.tags, max_workers=1,
+                              deadline=checkpoints.Deadline(FakeContext(30000), margin_ms=60000), cursor=cursor)
+        self.assertTrue(cursor.stopped)
+        self.assertEqual(len(written), 20)
+
+        store = MemoryStore()
+        event = {'queryStringParameters': {'async': 'true'}, jobs.JOB_ID_KEY: 'job-rgta'}
+        with mock.patch.object(jobs, 'dispatch', lambda *args, **extra: None):
+            checkpoints.continue_later(event, None, None, {'invocation': 1, 'written': cursor.encode()}, store)
+        state = checkpoints.load('job-rgta', store)
+        self.assertEqual(checkpoints.Cursor.decode(state['written']).done, set(written))
+
+    def test_rgta_backend_budget(self):
+        """A budgeted request with the rgta backend stops once its API calls are used up and resumes from the
+        continuation token"""
+        from utils import checkpoints, pipeline, throttling
+        from utils.discovery import run_rgta_discovery
+        from utils.stores import MemoryStore
+        arns = [f"arn:aws:rds:us-east-1:123456789012:db:db-{i}" for i in range(100)]
+        rgta_client = MockTaggedResourcesClient(arns, [], [])
+        throttling.register_client(rgta_client, 'rgta-budget-account')
+        store = MemoryStore()
+        event = {'pathParameters': {'account-id': 'rgta-budget-account'},
+                 'queryStringParameters': {'discovery': 'rgta', 'maxApiCalls': '1'}}
+
+        def run(checkpoint_id):
+            checkpoint = checkpoints.load(checkpoint_id, store)
+            budget = checkpoints.Budget(max_api_calls=1, account='rgta-budget-account')
+            cursor = checkpoints.Cursor.decode((checkpoint or {}).get('written'))
+            inventory = run_rgta_discovery(rgta_client, ['owner'])
+            written = []
+            pipeline.write_stream(iter(inventory.arns), [{'owner': 'other-team'}],
+                                  lambda tags, batch: written.extend(batch), 20, max_workers=1, deadline=budget,
+                                  cursor=cursor)
+            return cursor, written
+
+        cursor, written = run(None)
+        self.assertTrue(cursor.stopped)
+        self.assertEqual(written, arns[:20])
+        token = checkpoints.save_continuation(event, {'invocation': 1, 'written': cursor.encode()}, store)
+        resumed = dict(event, queryStringParameters=dict(event['queryStringParameters'], continuationToken=token))
+        cursor, written = run(checkpoints.get_checkpoint_id(resumed, store))
+        self.assertEqual(written, arns[20:40])
+
+    def test_build_streaming_collectors(self):
+        """The streaming collectors yield the same ARNs as the storage collectors"""
+        from utils.discovery import build_storage_collectors, build_streaming_collectors, run_collectors, \
+            merge_results, SKIP_COLLECTOR
+        from utils.test.test_rds import MockRDSClient
+        from utils.test.test_dynamodb import MockDynamoDbClient
+        from utils.test.test_efs import MockEFSClient
+        from utils.test.test_fsx import MockFSXClient
+        from utils.test.test_redshift import MockRedshiftClient
+        clients = {
+            'rds': MockRDSClient(),
+            'dynamodb': MockDynamoDbClient(),
+            'efs': MockEFSClient(),
+            'fsx': MockFSXClient(),
+            'redshift': MockRedshiftClient(),
+            'resourcegroupstaggingapi': EmptyClient(),
+        }
+        result = run_collectors(build_storage_collectors(clients, 'us-east-1', '123456789012'))
+        streamed = [arn for collector in build_streaming_collectors(clients, 'us-east-1', '123456789012')
+                    for arn in collector.func(*collector.args)]
+        self.assertEqual(streamed, merge_results(result.results, exclude=(SKIP_COLLECTOR,)))
+
+    def test_get_backend(self):
+        """The discovery query string parameter selects the backend"""
+        from utils.discovery import get_backend
+        from utils.exceptions import InvalidInputException
+        self.assertEqual(get_backend({}), 'services')
+        self.assertEqual(get_backend({'queryStringParameters': {'discovery': 'rgta'}}), 'rgta')
+        self.assertRaises(InvalidInputException, get_backend, {'queryStringParameters': {'discovery': 'all'}})
+
+
+class MockTaggedResourcesClient(object):
+    """ResourceGroupsTaggingAPI client returning the resources of the ResourceTypeFilters with their tags, and the
+    skip ones on a tag filter"""
+
+    def __init__(self, arns, skip_arns, legal_hold_arns):
+        self.arns = arns
+        self.skip_arns = skip_arns
+        self.legal_hold_arns = legal_hold_arns
+
+    def get_paginator(self, action):
+        return self
+
+    def tags(self, arn):
+        tags = [{'Key': 'owner', 'Value': 'team'}, {'Key': 'Name', 'Value': arn}]
+        if arn in self.skip_arns:
+            tags.append({'Key': 'vpcx-skip-backup', 'Value': 'true'})
+        if arn in self.legal_hold_arns:
+            tags.append({'Key': 'vpcx-backup', 'Value': 'legal-hold'})
+        return tags
+
+    @staticmethod
+    def matches(arn, resource_types):
+        """Check whether an ARN is of one of the resource types, e.g. rds:db, or of one of the services, e.g. s3"""
+        _, _, service, _, _, resource = arn.split(':', 5)
+        resource_type = re.split('[:/]', resource)[0] if re.search('[:/]', resource) else ''
+        return not resource_types or service in resource_types or f"{service}:{resource_type}" in resource_types
+
+    def paginate(self, **kwargs):
+        if kwargs.get('TagFilters'):
+            return [{'ResourceTagMappingList': [{'ResourceARN': arn} for arn in self.skip_arns]}]
+        resource_types = kwargs.get('ResourceTypeFilters')
+        volume_arn = 'arn:aws:ec2:us-east-1:123456789012:volume/vol-012ea34a439822303'
+        return [{'ResourceTagMappingList': [{'ResourceARN': arn, 'Tags': self.tags(arn)} for arn in self.arns
+                                            if self.matches(arn, resource_types)]},
+                {'ResourceTagMappingList': [{'ResourceARN': volume_arn,
+                                             'Tags': [{'Key': 'vpcx-skip-backup', 'Value': 'true'}]}]}]
+
+
+class EmptyClient(object):
+    """Client whose paginators never return any page"""
+
+    def get_paginator(self, action):
+        return self
+
+    def paginate(self, **kwargs):
+        return []
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -62,6 +62,23 @@ class TestDynamodb(TestCase):
         dynamodb_arn_list = get_dynamodb_tables(dynamodb_client, "us-east-1")
         self.assertEqual(dynamodb_arn_list, dynamodb_client.get_arn_list())
 
+    def test_get_dynamodb_tables_built_arns(self):
+        """The ARNs built from the table names match the ones the describe calls return"""
+        from utils.dynamodb import get_dynamodb_tables
+        dynamodb_client = MockDynamoDbClient()
+        dynamodb_client.describe_table = None
+        dynamodb_client.describe_global_table = None
+        dynamodb_arn_list = get_dynamodb_tables(dynamodb_client, "us-east-1", "123456789012")
+        self.assertEqual(dynamodb_arn_list, MockDynamoDbClient().get_arn_list())
+
+    def test_get_dynamodb_tables_strict(self):
+        """Strict mode reads every ARN with the describe calls"""
+        from utils.dynamodb import get_dynamodb_tables
+        dynamodb_client = MockDynamoDbClient()
+        dynamodb_arn_list = get_dynamodb_tables(dynamodb_client, "us-east-1", "123456789012", strict=True,
+                                                max_workers=2)
+        self.assertEqual(dynamodb_arn_list, dynamodb_client.get_arn_list())
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -12,6 +12,8 @@ class MockEC2Client(object):
 
     def __init__(self):
         self.paginator = {}
+        self.tags = {'vol-012ea34a439822303': [{'Key': 'vpcx-skip-backup', 'Value': 'true'}]}
+        self.create_tags_calls = []
         self.volume_ids = ['vol-012ea34a439822303',
                            'vol-01241dfaef14f8780',
                            'vol-0e01b20eb1dcbabdf',
@@ -19,24 +21,23 @@ class MockEC2Client(object):
                            'vol-000dee67be941d7e2']
 
     def get_paginator(self, action):
-        self.paginator = EBSPaginatorClass(self.volume_ids, action)
+        self.paginator = EBSPaginatorClass(self.volume_ids, action, self.tags)
         return self.paginator
 
-    @staticmethod
-    def create_tags(**kwargs):
-        return None
+    def create_tags(self, **kwargs):
+        self.create_tags_calls.append(kwargs)
 
 
 class EBSPaginatorClass:
-    def __init__(self, volume_ids, action):
+    def __init__(self, volume_ids, action, tags=None):
         self.action = action
         self.volume_ids = volume_ids
+        self.tags = tags or {}
 
     def paginate(self, **kwargs):
-        if kwargs.get('Filters'):
-            if kwargs.get('Filters') == [{'Name': 'tag:vpcx-skip-backup', 'Values': ['true']}]:
-                return [{'Volumes': [{'VolumeId': self.volume_ids[0]}]}]
-        return [{'Volumes': [{'VolumeId': volume_id} for volume_id in self.volume_ids]}]
+        self.calls = getattr(self, 'calls', 0) + 1
+        return [{'Volumes': [{'VolumeId': volume_id, 'Tags': self.tags.get(volume_id, [])}
+                             for volume_id in self.volume_ids]}]
 
 
 class TestEBS(TestCase):
@@ -45,7 +46,38 @@ class TestEBS(TestCase):
         """Test the method to tag all the ebs volumes in a given region"""
         from utils.ebs import tag_all_ebs_volumes
         ec2_client = MockEC2Client()
-        tag_all_ebs_volumes(ec2_client, {'dummy-key': 'dummy-value'}, {'vpcx-backup': 'regular'})
+        counts = tag_all_ebs_volumes(ec2_client, {'dummy-key': 'dummy-value'}, {'vpcx-backup': 'regular'})
+        self.assertEqual(ec2_client.paginator.calls, 1)
+        plans = counts.pop('plans')
+        self.assertEqual(counts, {'kept': 4, 'skipped': 1, 'unknown': 0, 'failures': []})
+        self.assertEqual([(plan.sent, plan.avoided) for plan in plans], [(4, 4)])
+        self.assertEqual(len(ec2_client.create_tags_calls), 1)
+        self.assertEqual(len(ec2_client.create_tags_calls[0]['Tags']), 2)
+
+    def test_iter_volumes(self):
+        """Only the volume id and the relevant tags are kept"""
+        from utils.ebs import iter_volumes, VolumeRecord
+        ec2_client = MockEC2Client()
+        ec2_client.tags['vol-01241dfaef14f8780'] = [{'Key': 'vpcx-backup', 'Value': 'legal-hold'},
+                                                    {'Key': 'Name', 'Value': 'data'}]
+        volumes = list(iter_volumes(ec2_client))
+        self.assertEqual(volumes[0], VolumeRecord('vol-012ea34a439822303', True, False, {'vpcx-skip-backup': 'true'}))
+        self.assertEqual(volumes[1], VolumeRecord('vol-01241dfaef14f8780', False, True, {'vpcx-backup': 'legal-hold'}))
+        self.assertEqual(len(volumes), 5)
+
+    def test_tag_all_ebs_volumes_diff(self):
+        """Volumes that already carry the tags are not tagged again"""
+        from utils.ebs import tag_all_ebs_volumes
+        ec2_client = MockEC2Client()
+        ec2_client.tags.update({'vol-01241dfaef14f8780': [{'Key': 'dummy-key', 'Value': 'dummy-value'},
+                                                     {'Key': 'vpcx-backup', 'Value': 'regular'}],
+                           'vol-0e01b20eb1dcbabdf': [{'Key': 'dummy-key', 'Value': 'old-value'},
+                                                     {'Key': 'vpcx-backup', 'Value': 'regular'}]})
+        counts = tag_all_ebs_volumes(ec2_client, {'dummy-key': 'dummy-value'}, {'vpcx-backup': 'regular'}, diff=True)
+        self.assertEqual([(plan.sent, plan.avoided) for plan in counts['plans']], [(3, 5)])
+        self.assertEqual(len(ec2_client.create_tags_calls), 2)
+        self.assertEqual(ec2_client.create_tags_calls[0]['Resources'], ['vol-0e01b20eb1dcbabdf'])
+        self.assertEqual(ec2_client.create_tags_calls[0]['Tags'], [{'Key': 'dummy-key', 'Value': 'dummy-value'}])
 
 
 if __name__ == '__main__':
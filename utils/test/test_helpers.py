@@ -11,6 +11,7 @@ BASE_PATH = os.path.dirname(os.path.realpath(__file__))
 
 class MockEC2Client:
     def __init__(self):
+        self.describe_regions_calls = 0
         self.describe_regions_dict = {
             "Regions": [
                 {
@@ -102,6 +103,7 @@ class MockEC2Client:
         }
 
     def describe_regions(self):
+        self.describe_regions_calls += 1
         return self.describe_regions_dict
 
 
@@ -112,6 +114,7 @@ class MockSTSClient(object):
         self.caller_identity = caller_identity
 
     def get_caller_identity(self, **kwargs):
+        self.calls = getattr(self, 'calls', 0) + 1
         return self.caller_identity
 
 
@@ -139,6 +142,33 @@ class TestHelpers(TestCase):
         is_region_valid(ec2_client, "us-east-1")
         self.assertRaises(InvalidRegionException, is_region_valid, ec2_client, "example")
 
+    def test_is_region_valid_cached_per_account(self):
+        """The region list is described once per account"""
+        from utils.helpers import is_region_valid, _metadata_cache
+        _metadata_cache.invalidate()
+        ec2_client = MockEC2Client()
+        is_region_valid(ec2_client, "us-east-1", "123456789012")
+        is_region_valid(ec2_client, "us-west-2", "123456789012")
+        self.assertRaises(InvalidRegionException, is_region_valid, ec2_client, "example", "123456789012")
+        self.assertEqual(ec2_client.describe_regions_calls, 1)
+        is_region_valid(ec2_client, "us-east-1", "210987654321")
+        self.assertEqual(ec2_client.describe_regions_calls, 2)
+
+    def test_get_caller_role_without_iam(self):
+        """The role arn is built from the assumed role arn and cached per account"""
+        from utils.helpers import get_caller_role, _metadata_cache
+        _metadata_cache.invalidate()
+        sts_client = MockSTSClient({
+            "UserId": "AIDAYVA662W2K5K3RBJLU",
+            "Account": "123456789012",
+            "Arn": "arn:aws:sts::123456789012:assumed-role/ITx-Administrator/Session"
+        })
+        for _ in range(2):
+            role_arn, account_id = get_caller_role(sts_client, account="itx-000")
+            self.assertEqual(role_arn, "arn:aws:iam::123456789012:role/ITx-Administrator")
+            self.assertEqual(account_id, "123456789012")
+        self.assertEqual(sts_client.calls, 1)
+
     def test_get_caller_role(self):
         from utils.helpers import get_caller_role
         sts_client = MockSTSClient({
@@ -173,6 +203,27 @@ class TestHelpers(TestCase):
             "arn:aws:rds:us-east-1:123456789012:ri:reserved_db_instance_name_1"
         ]
         self.assertEqual(resources_to_tag, filter_resource_arns(storage_arn_list, resources_to_skip))
+        self.assertEqual(len(storage_arn_list), 6)
+
+    def test_partition_arns(self):
+        """Skip ARNs that were not discovered are counted as unknown instead of raising an error"""
+        from utils.helpers import partition_arns
+        storage_arn_list = [
+            "arn:aws:rds:us-east-1:123456789012:db:db-3",
+            "arn:aws:rds:us-east-1:123456789012:db:db-1",
+            "arn:aws:rds:us-east-1:123456789012:db:db-2",
+            "arn:aws:rds:us-east-1:123456789012:db:db-1",
+        ]
+        resources_to_skip = [
+            "arn:aws:rds:us-east-1:123456789012:db:db-1",
+            "arn:aws:ec2:us-east-1:123456789012:snapshot/snap-0123456789abcdef0",
+        ]
+        partition = partition_arns(storage_arn_list, resources_to_skip)
+        self.assertEqual(partition.kept, ["arn:aws:rds:us-east-1:123456789012:db:db-3",
+                                          "arn:aws:rds:us-east-1:123456789012:db:db-2"])
+        self.assertEqual(partition.skipped, ["arn:aws:rds:us-east-1:123456789012:db:db-1"])
+        self.assertEqual(partition.unknown, ["arn:aws:ec2:us-east-1:123456789012:snapshot/snap-0123456789abcdef0"])
+        self.assertEqual(partition.counts(), {'kept': 2, 'skipped': 1, 'unknown': 1})
 
     def test_lambda_returns(self):
         """Test the lambda returns method"""
@@ -0,0 +1,95 @@
+"""Unit tests for http session utils"""
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from unittest import TestCase
+import unittest
+# pylint: disable = no-name-in-module,import-error,no-self-use,broad-except, C0413, C0411, C0330
+
+BASE_PATH = os.path.dirname(os.path.realpath(__file__))
+
+
+class StubServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, fail_first=0):
+        self.connections = 0
+        self.requests = 0
+        self.fail_first = fail_first
+        self.lock = threading.Lock()
+        HTTPServer.__init__(self, ('127.0.0.1', 0), StubHandler)
+
+    def process_request(self, request, client_address):
+        with self.lock:
+            self.connections += 1
+        ThreadingMixIn.process_request(self, request, client_address)
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are written separately; without this the kept-alive client waits on delayed ACKs.
+    disable_nagle_algorithm = True
+
+    def _respond(self):
+        with self.server.lock:
+            self.server.requests += 1
+            status = 503 if self.server.requests <= self.server.fail_first else 200
+        length = int(self.headers.get('Content-Length', 0))
+        if length:
+            self.rfile.read(length)
+        body = b'{"credentials": {}}'
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = _respond
+    do_PUT = _respond
+
+    def log_message(self, *args):
+        pass
+
+
+class TestHttpSession(TestCase):
+
+    def start_server(self, fail_first=0):
+        server = StubServer(fail_first)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return server, f"http://127.0.0.1:{server.server_address[1]}/"
+
+    def test_session_reuses_connections(self):
+        """Consecutive calls go over one kept-alive connection"""
+        from utils.http_session import build_session, get_timeout
+        server, url = self.start_server()
+        session = build_session(pool_size=2)
+        for _ in range(5):
+            self.assertEqual(session.request('get', url, timeout=get_timeout()).status_code, 200)
+        self.assertEqual(server.requests, 5)
+        self.assertEqual(server.connections, 1)
+
+    def test_session_retries_get_only(self):
+        """GET requests are retried on 5xx responses and PUT requests are not"""
+        from utils.http_session import build_session
+        os.environ['HTTP_BACKOFF_FACTOR'] = '0'
+        try:
+            server, url = self.start_server(fail_first=2)
+            self.assertEqual(build_session().request('get', url, timeout=5).status_code, 200)
+            self.assertEqual(server.requests, 3)
+
+            server, url = self.start_server(fail_first=1)
+            self.assertEqual(build_session().request('put', url, json={}, timeout=5).status_code, 503)
+            self.assertEqual(server.requests, 1)
+        finally:
+            del os.environ['HTTP_BACKOFF_FACTOR']
+
+    def test_get_timeout(self):
+        from utils.http_session import get_timeout
+        self.assertEqual(get_timeout(), (5.0, 60.0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+"""Unit tests for idempotency utils"""
+import os
+import json
+from unittest import TestCase
+import unittest
+# pylint: disable = no-name-in-module,import-error,no-self-use,broad-except, C0413, C0411, C0330
+
+BASE_PATH = os.path.dirname(os.path.realpath(__file__))
+
+EVENT = {
+    'pathParameters': {'account-id': 'itx-046', 'region-name': 'us-east-1', 'resource-type': 'storage'},
+    'headers': {'idempotency-key': 'retry-1'},
+    'body': json.dumps({'owner': 'team'})
+}
+
+
+class TestIdempotency(TestCase):
+
+    def test_get_key(self):
+        """The header is the key, and requests without it get a key derived from the request"""
+        from utils.idempotency import get_key, IdempotencyKey
+        from utils.exceptions import InvalidInputException
+        self.assertEqual(get_key(EVENT), IdempotencyKey('retry-1', False))
+        derived = get_key(dict(EVENT, headers={}))
+        self.assertTrue(derived.derived)
+        self.assertEqual(derived, get_key(dict(EVENT, headers=None, body='{ "owner":  "team" }')))
+        self.assertNotEqual(derived, get_key(dict(EVENT, headers={}, body='{"owner": "other-team"}')))
+        for key in ['', 'k' * 256, 'key with spaces']:
+            with self.assertRaises(InvalidInputException, msg=key):
+                get_key(dict(EVENT, headers={'Idempotency-Key': key}))
+
+    def test_claim_and_replay(self):
+        """A retry gets 202 while the first request runs, then its response, and a 5xx releases the key"""
+        from utils import helpers
+        from utils.idempotency import claim, complete, IdempotencyKey
+        from utils.stores import MemoryStore
+        store = MemoryStore()
+        key = IdempotencyKey('retry-1', False)
+        self.assertIsNone(claim(EVENT, key, 'itx-046', 'us-east-1', store))
+
+        in_progress = claim(EVENT, key, 'itx-046', 'us-east-1', store)
+        self.assertEqual(in_progress['statusCode'], 202)
+        self.assertEqual(json.loads(in_progress['body'])['status'], 'in_progress')
+
+        response = helpers.lambda_returns(200, {'Content-Type': 'application/json'}, '{"message": "done"}')
+        complete(key, 'itx-046', 'us-east-1', response, store)
+        replay = claim(EVENT, key, 'itx-046', 'us-east-1', store)
+        self.assertEqual((replay['statusCode'], replay['body']), (200, '{"message": "done"}'))
+        self.assertEqual(replay['headers']['Idempotent-Replayed'], 'true')
+
+        conflict = claim(dict(EVENT, body='{"owner": "other-team"}'), key, 'itx-046', 'us-east-1', store)
+        self.assertEqual(conflict['statusCode'], 409)
+        # The same key in another account is another request.
+        self.assertIsNone(claim(EVENT, key, 'itx-047', 'us-east-1', store))
+
+        complete(key, 'itx-047', 'us-east-1', helpers.lambda_returns(503, {}, '{}'), store)
+        self.assertIsNone(claim(EVENT, key, 'itx-047', 'us-east-1', store))
+
+    def test_derived_key_is_released(self):
+        """A key derived from the request dedupes the requests that run at the same time only"""
+        from utils import helpers
+        from utils.idempotency import claim, complete, get_key
+        from utils.stores import MemoryStore
+        store = MemoryStore()
+        event = dict(EVENT, headers={})
+        key = get_key(event)
+        self.assertIsNone(claim(event, key, 'itx-046', 'us-east-1', store))
+        self.assertEqual(claim(event, key, 'itx-046', 'us-east-1', store)['statusCode'], 202)
+        complete(key, 'itx-046', 'us-east-1', helpers.lambda_returns(200, {}, '{}'), store)
+        # The same request sent again later, e.g. the next daily run, does the work again.
+        self.assertIsNone(claim(event, key, 'itx-046', 'us-east-1', store))
+
+
+if __name__ == '__main__':
+    unittest.main()
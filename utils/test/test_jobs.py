@@ -0,0 +1,67 @@
+"""Unit tests for jobs utils"""
+import os
+import json
+import threading
+from unittest import TestCase
+import unittest
+# pylint: disable = no-name-in-module,import-error,no-self-use,broad-except, C0413, C0411, C0330
+
+BASE_PATH = os.path.dirname(os.path.realpath(__file__))
+
+
+class TestJobs(TestCase):
+
+    def setUp(self):
+        os.environ['JOB_DISPATCH'] = 'inline'
+
+    def tearDown(self):
+        del os.environ['JOB_DISPATCH']
+
+    def test_is_async(self):
+        """Async mode is asked for by the query string or the Prefer header"""
+        from utils.jobs import is_async
+        self.assertTrue(is_async({'queryStringParameters': {'async': 'true'}}))
+        self.assertTrue(is_async({'headers': {'Prefer': 'respond-async'}}))
+        self.assertFalse(is_async({'queryStringParameters': None, 'headers': None}))
+
+    def test_submit_and_run(self):
+        """The worker gets the request with the job id and its response becomes the result of the job"""
+        from utils import jobs
+        from utils.stores import MemoryStore
+        store = MemoryStore()
+        done = threading.Event()
+        worker_events = []
+
+        def handler(event, context):
+            worker_events.append(event)
+            progress = jobs.JobProgress(jobs.get_job_id(event), store, interval=0)
+            progress.start()
+            progress.update(stage='discovery', resources_seen=10)
+            self.assertEqual(jobs.get_job(event['jobId'], store)['progress'],
+                             {'stage': 'discovery', 'resources_seen': 10})
+            progress.finish({'statusCode': 200, 'body': json.dumps({'message': 'tagged'})})
+            done.set()
+
+        event = {'queryStringParameters': {'async': 'true', 'mode': 'full'}, 'body': '{"owner": "a"}'}
+        job = jobs.submit(event, None, handler, store)
+        self.assertTrue(done.wait(5))
+        self.assertEqual(worker_events[0]['queryStringParameters'], {'mode': 'full'})
+        self.assertEqual(worker_events[0]['jobId'], job['job_id'])
+        self.assertFalse(jobs.is_async(worker_events[0]))
+
+        finished = jobs.get_job(job['job_id'], store)
+        self.assertEqual(finished['status'], jobs.SUCCEEDED)
+        self.assertEqual(finished['result'], {'statusCode': 200, 'body': {'message': 'tagged'}})
+
+    def test_progress_without_job(self):
+        """Synchronous requests have no job and nothing is written"""
+        from utils.jobs import JobProgress
+        progress = JobProgress()
+        progress.start()
+        progress.update(stage='discovery')
+        progress.finish({'statusCode': 200, 'body': '{}'})
+        self.assertIsNone(progress.store)
+
+
+if __name__ == '__main__':
+    unittest.main()
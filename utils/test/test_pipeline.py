@@ -0,0 +1,141 @@
+"""Unit tests for pipeline utils"""
+import os
+import threading
+import time
+from unittest import TestCase
+import unittest
+# pylint: disable = no-name-in-module,import-error,no-self-use,broad-except, C0413, C0411, C0330
+
+BASE_PATH = os.path.dirname(os.path.realpath(__file__))
+
+
+def arns(prefix, count, delay=0):
+    for i in range(count):
+        if delay:
+            time.sleep(delay)
+        yield f"arn:aws:rds:us-east-1:123456789012:db:{prefix}-{i}"
+
+
+class RecordingWriter(object):
+    """Records the writes and the highest number of writes running at the same time"""
+
+    def __init__(self, delay=0, fail_on=None):
+        self.lock = threading.Lock()
+        self.delay = delay
+        self.fail_on = fail_on
+        self.writes = []
+        self.running = 0
+        self.peak = 0
+        self.first_write_at = None
+
+    def write(self, tags, batch):
+        with self.lock:
+            self.running += 1
+            self.peak = max(self.peak, self.running)
+            self.first_write_at = self.first_write_at or time.monotonic()
+        time.sleep(self.delay)
+        with self.lock:
+            self.running -= 1
+            self.writes.append((tags, batch))
+        if self.fail_on and self.fail_on in batch:
+            raise ValueError(f"failed to tag {self.fail_on}")
+
+
+class TestPipeline(TestCase):
+
+    def test_run(self):
+        """Every kept ARN is written once, in batches, with the merged tags"""
+        from utils.discovery import Collector
+        from utils.pipeline import run
+        writer = RecordingWriter()
+        collectors = [
+            Collector('db', 'rds', arns, ('db', 45)),
+            Collector('db_again', 'rds', arns, ('db', 5)),
+            Collector('cluster', 'rds', arns, ('cluster', 10)),
+        ]
+        skip_arns = ["arn:aws:rds:us-east-1:123456789012:db:db-0",
+                     "arn:aws:ec2:us-east-1:123456789012:snapshot/snap-0123456789abcdef0"]
+        result = run(collectors, [{'owner': 'team'}, {'vpcx-backup': 'regular'}], writer.write, 20,
+                     skip_arns=skip_arns, max_workers=2, queue_size=4)
+        written = [arn for tags, batch in writer.writes for arn in batch]
+        self.assertEqual(len(written), 54)
+        self.assertEqual(len(set(written)), 54)
+        self.assertTrue(all(len(batch) <= 20 for tags, batch in writer.writes))
+        self.assertTrue(all(tags == {'owner': 'team', 'vpcx-backup': 'regular'} for tags, batch in writer.writes))
+        self.assertEqual(result.partition_counts, {'kept': 54, 'skipped': 1, 'unknown': 1})
+        self.assertEqual((result.plan.sent, result.plan.avoided), (54, 54))
+        self.assertEqual(list(result.timings.keys()), ['db', 'db_again', 'cluster', 'total'])
+
+    def test_write_stream_diff(self):
+        """ARNs that already carry the tags are not written to"""
+        from utils.pipeline import write_stream
+        writer = RecordingWriter()
+        stream = list(arns('db', 3))
+        current_tags = {stream[0]: {'owner': 'team'}, stream[1]: {'owner': 'other-team'}}
+        counts, plan = write_stream(iter(stream), [{'owner': 'team'}], writer.write, 20, current_tags=current_tags)
+        self.assertEqual(writer.writes, [({'owner': 'team'}, stream[1:])])
+        self.assertEqual((plan.sent, plan.avoided), (2, 1))
+        self.assertEqual(counts['kept'], 3)
+
+    def test_writes_overlap_discovery_with_backpressure(self):
+        """Writes start before the collectors finish, and no more writes than max_workers run at the same time"""
+        from utils.discovery import Collector
+        from utils.pipeline import run
+        writer = RecordingWriter(delay=0.01)
+        start = time.monotonic()
+        result = run([Collector('db', 'rds', arns, ('db', 100, 0.002))], [{'owner': 'team'}], writer.write, 10,
+                     max_workers=2, queue_size=5)
+        # The collector needs 200 ms for its 100 ARNs, the first batch is full after 10 of them.
+        self.assertLess(writer.first_write_at, start + result.timings['db'] / 1000 / 2)
+        self.assertLessEqual(writer.peak, 2)
+        self.assertEqual(result.partition_counts['kept'], 100)
+
+    def test_errors_stop_the_pipeline(self):
+        """A failing collector or write is raised"""
+        from utils.discovery import Collector
+        from utils.pipeline import run
+
+        def failing_collector():
+            yield "arn:aws:rds:us-east-1:123456789012:db:db-0"
+            raise ValueError('describe failed')
+
+        with self.assertRaisesRegex(ValueError, 'describe failed'):
+            run([Collector('db', 'rds', failing_collector, ()), Collector('cluster', 'rds', arns, ('c', 10000))],
+                [{'owner': 'team'}], RecordingWriter().write, 20, queue_size=2)
+
+        writer = RecordingWriter(fail_on="arn:aws:rds:us-east-1:123456789012:db:db-5")
+        with self.assertRaisesRegex(ValueError, 'failed to tag'):
+            run([Collector('db', 'rds', arns, ('db', 10000))], [{'owner': 'team'}], writer.write, 5, queue_size=2)
+        self.assertLess(len(writer.writes), 100)
+
+    def test_deadline_stops_writes_and_cursor_resumes(self):
+        """An expired deadline stops the writes, and a second run with the cursor writes only the rest"""
+        from utils.checkpoints import Cursor
+        from utils.pipeline import write_stream
+
+        class CountdownDeadline(object):
+            def __init__(self, batches):
+                self.batches = batches
+
+            def expired(self):
+                self.batches -= 1
+                return self.batches < 0
+
+        writer = RecordingWriter()
+        stream = list(arns('db', 50))
+        cursor = Cursor()
+        write_stream(iter(stream), [{'owner': 'team'}], writer.write, 10, max_workers=1,
+                     deadline=CountdownDeadline(1), cursor=cursor)
+        self.assertTrue(cursor.stopped)
+        self.assertEqual(cursor.written, stream[:20])
+
+        resumed = Cursor.decode(cursor.encode())
+        writer = RecordingWriter()
+        counts, _ = write_stream(iter(stream), [{'owner': 'team'}], writer.write, 10, cursor=resumed)
+        self.assertFalse(resumed.stopped)
+        self.assertEqual(sorted(arn for tags, batch in writer.writes for arn in batch), sorted(stream[20:]))
+        self.assertEqual(counts['kept'], 30)
+
+
+if __name__ == '__main__':
+    unittest.main()
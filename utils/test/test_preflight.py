@@ -0,0 +1,112 @@
+"""Unit tests for preflight utils"""
+import os
+import time
+from unittest import TestCase, mock
+import unittest
+import botocore.exceptions
+from utils.exceptions import InvalidRegionException
+from utils.test.test_helpers import MockEC2Client, MockSTSClient, MockIAMClient
+# pylint: disable = no-name-in-module,import-error,no-self-use,broad-except, C0413, C0411, C0330
+
+BASE_PATH = os.path.dirname(os.path.realpath(__file__))
+
+CALLER_IDENTITY = {
+    "UserId": "AIDAYVA662W2K5K3RBJLU",
+    "Account": "123456789012",
+    "Arn": "arn:aws:sts::123456789012:assumed-role/ITx-Administrator/Session"
+}
+
+
+class MockRejectingEC2Client(MockEC2Client):
+    """EC2 client whose credentials have expired"""
+
+    def describe_regions(self):
+        raise botocore.exceptions.ClientError({'Error': {'Code': 'ExpiredToken', 'Message': 'expired'}},
+                                              'DescribeRegions')
+
+
+class MockClientPool(object):
+    """Used to mock client_pool, returning the EC2 client built for the credentials' AccessKeyId"""
+
+    def __init__(self):
+        self.requested = []
+
+    def get_client(self, service_name, credentials, account, region_name=None):
+        self.requested.append(service_name)
+        if service_name == 'ec2':
+            return MockRejectingEC2Client() if credentials['AccessKeyId'] == 'AKIAEXPIRED' else MockEC2Client()
+        if service_name == 'sts':
+            return MockSTSClient(CALLER_IDENTITY)
+        if service_name == 'iam':
+            return MockIAMClient('ITx-Administrator')
+        return object()
+
+    def get_clients(self, service_names, credentials, account, region_name=None):
+        return {service_name: self.get_client(service_name, credentials, account, region_name)
+                for service_name in service_names}
+
+    def invalidate(self, account=None):
+        pass
+
+
+class TestPreflight(TestCase):
+
+    def setUp(self):
+        from utils import credentials_cache, helpers
+        credentials_cache.invalidate()
+        helpers._metadata_cache.invalidate()
+        self.client_pool = MockClientPool()
+        patcher = mock.patch('utils.preflight.client_pool', self.client_pool)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_run_preflight(self):
+        """The preflight returns the clients and caller identity and skips IAM unless verbose"""
+        from utils.preflight import run_preflight
+        result = run_preflight('itx-000', 'us-east-1', lambda: {'AccessKeyId': 'AKIAEXAMPLE'}, ['rds'],
+                               verbose=False)
+        self.assertEqual(result.account_id, '123456789012')
+        self.assertEqual(result.role_arn, 'arn:aws:iam::123456789012:role/ITx-Administrator')
+        self.assertEqual(list(result.clients.keys()), ['rds'])
+        self.assertNotIn('iam', self.client_pool.requested)
+        self.assertEqual(set(result.timings.keys()), {'credentials', 'region', 'caller_identity', 'clients', 'total'})
+
+        run_preflight('itx-001', 'us-east-1', lambda: {'AccessKeyId': 'AKIAEXAMPLE'}, ['rds'], verbose=True)
+        self.assertIn('iam', self.client_pool.requested)
+
+    def test_run_preflight_invalid_region(self):
+        from utils.preflight import run_preflight
+        self.assertRaises(InvalidRegionException, run_preflight, 'itx-000', 'example',
+                          lambda: {'AccessKeyId': 'AKIAEXAMPLE'}, ['rds'], False)
+
+    def test_run_preflight_invalid_region_does_not_wait(self):
+        """A failed region check is raised without waiting for the slower steps"""
+        from utils.preflight import run_preflight
+
+        def get_clients(service_names, credentials, account, region_name=None):
+            time.sleep(0.5)
+            return {}
+
+        self.client_pool.get_clients = get_clients
+        start = time.monotonic()
+        self.assertRaises(InvalidRegionException, run_preflight, 'itx-000', 'example',
+                          lambda: {'AccessKeyId': 'AKIAEXAMPLE'}, ['rds'], False)
+        self.assertLess(time.monotonic() - start, 0.4)
+
+    def test_run_preflight_refreshes_rejected_credentials(self):
+        """Rejected credentials are fetched again once"""
+        from utils.preflight import run_preflight
+        fetched = []
+
+        def fetch():
+            fetched.append(1)
+            return {'AccessKeyId': 'AKIAEXPIRED' if len(fetched) == 1 else 'AKIAEXAMPLE'}
+
+        result = run_preflight('itx-000', 'us-east-1', fetch, ['rds'], verbose=False)
+        self.assertEqual(len(fetched), 2)
+        self.assertEqual(result.credentials, {'AccessKeyId': 'AKIAEXAMPLE'})
+        self.assertIn('credentials_refresh', result.timings)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -39,6 +39,13 @@ class ResourceGroupsTaggingApiPaginatorClass:
         self.resource_arns = resource_arns
 
     def paginate(self, **kwargs):
+        if kwargs.get('TagFilters') == [{'Key': 'vpcx-backup'}]:
+            return [{'ResourceTagMappingList': [{'ResourceARN': self.resource_arns[0],
+                                                 'Tags': [{'Key': 'vpcx-backup', 'Value': 'regular'},
+                                                          {'Key': 'Name', 'Value': 'namespace'}]}]}]
+        if kwargs.get('ResourceARNList'):
+            return [{'ResourceTagMappingList': [{'ResourceARN': arn, 'Tags': [{'Key': 'owner', 'Value': 'team'}]}
+                                                for arn in kwargs['ResourceARNList']]}]
         return [{'ResourceTagMappingList': [{'ResourceARN': arn} for arn in self.resource_arns]}]
 
 
@@ -59,7 +66,28 @@ class TestResourceGroupsTaggingApi(TestCase):
         tag_list = {
             "test_key": "test_value"
         }
-        tag_storage_resources(resource_groups_tagging_api_client, tag_list, arns_to_skip)
+        outcome = tag_storage_resources(resource_groups_tagging_api_client, tag_list, arns_to_skip)
+        self.assertEqual(outcome.failures, [])
+
+    def test_tag_storage_resources_failed_resources(self):
+        """The ARNs in FailedResourcesMap are reported without being sent again"""
+        from utils.resource_groups_tagging_api import tag_storage_resources
+        from utils.batch_executor import ItemFailure
+        bad_arn = "arn:aws:rds:us-east-1:123456789012:db:missing"
+        calls = []
+
+        class FailingClient(MockResourceGroupsTaggingApiClient):
+            def tag_resources(self, **kwargs):
+                calls.append(kwargs['ResourceARNList'])
+                if bad_arn not in kwargs['ResourceARNList']:
+                    return {'FailedResourcesMap': {}}
+                return {'FailedResourcesMap': {bad_arn: {'StatusCode': 400, 'ErrorCode': 'InvalidParameterException',
+                                                         'ErrorMessage': 'not found'}}}
+
+        arns = [bad_arn] + MockResourceGroupsTaggingApiClient().get_arn_list()
+        outcome = tag_storage_resources(FailingClient(), {"test_key": "test_value"}, arns)
+        self.assertEqual(calls, [arns])
+        self.assertEqual(outcome.failures, [ItemFailure(bad_arn, 'InvalidParameterException', 'not found')])
 
     def test_untag_storage_resources_to_skip(self):
         """Test the method to untag all the given arns in a given region"""
@@ -68,6 +96,18 @@ class TestResourceGroupsTaggingApi(TestCase):
         arns_to_skip = ["arn:aws:rds:us-east-1:123456789012:ri:reserved_db_instance_name"]
         untag_storage_resources_to_skip(resource_groups_tagging_api_client, arns_to_skip, ['vpcx-backup'])
 
+    def test_get_resource_tags(self):
+        """Test the method to read the current tags by tag key and by resource arn"""
+        from utils.resource_groups_tagging_api import get_resource_tags
+        resource_groups_tagging_api_client = MockResourceGroupsTaggingApiClient()
+        arns = resource_groups_tagging_api_client.get_arn_list()
+        self.assertEqual(get_resource_tags(resource_groups_tagging_api_client, ['vpcx-backup']),
+                         {arns[0]: {'vpcx-backup': 'regular'}})
+        arn_list = [f"arn:aws:rds:us-east-1:123456789012:db:db-{i}" for i in range(150)]
+        resource_tags = get_resource_tags(resource_groups_tagging_api_client, resource_arns=arn_list)
+        self.assertEqual(len(resource_tags), 150)
+        self.assertEqual(resource_tags[arn_list[149]], {'owner': 'team'})
+
 
 if __name__ == '__main__':
     unittest.main()
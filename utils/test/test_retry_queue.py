@@ -0,0 +1,58 @@
+"""Unit tests for retry queue utils"""
+import os
+from unittest import TestCase
+import unittest
+# pylint: disable = no-name-in-module,import-error,no-self-use,broad-except, C0413, C0411, C0330
+
+BASE_PATH = os.path.dirname(os.path.realpath(__file__))
+
+
+class TestRetryQueue(TestCase):
+
+    def setUp(self):
+        os.environ['THROTTLE_BASE_DELAY'] = '0'
+
+    def tearDown(self):
+        del os.environ['THROTTLE_BASE_DELAY']
+
+    def test_drain_retries_in_bulk(self):
+        """Retryable failures of several writes with the same key are sent again in one call"""
+        from utils.batch_executor import ItemFailure, failures_to_dicts
+        from utils.retry_queue import RetryQueue
+        calls = []
+
+        def write(items):
+            calls.append(items)
+            return []
+
+        queue = RetryQueue(max_rounds=3)
+        queue.add(('tag_resources', ()), write, [ItemFailure('a', 'InternalServiceException', 'retry')])
+        queue.add(('tag_resources', ()), write, [ItemFailure('b', 'ThrottlingException', 'slow down'),
+                                                 ItemFailure('c', 'InvalidParameterException', 'bad arn')])
+        failures = queue.drain()
+        self.assertEqual(calls, [['a', 'b']])
+        self.assertEqual(failures, [ItemFailure('c', 'InvalidParameterException', 'bad arn')])
+        self.assertEqual(queue.summary(failures_to_dicts(failures)),
+                         {'deferred': 2, 'recovered': 2, 'failed': 1, 'by_code': {'InvalidParameterException': 1}})
+
+    def test_drain_gives_up_after_the_rounds(self):
+        """Items that keep failing are reported with their last error"""
+        from utils.batch_executor import ItemFailure, failures_to_dicts
+        from utils.retry_queue import RetryQueue
+        calls = []
+
+        def write(items):
+            calls.append(items)
+            return [ItemFailure(item, 'InternalServiceException', f'round {len(calls)}') for item in items]
+
+        queue = RetryQueue(max_rounds=2)
+        queue.add(('untag_resources', ('vpcx-backup',)), write, [ItemFailure('a', 'InternalServiceException', '')])
+        failures = queue.drain()
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(failures, [ItemFailure('a', 'InternalServiceException', 'round 2')])
+        self.assertEqual(queue.summary(failures_to_dicts(failures)),
+                         {'deferred': 1, 'recovered': 0, 'failed': 1, 'by_code': {'InternalServiceException': 1}})
+
+
+if __name__ == '__main__':
+    unittest.main()
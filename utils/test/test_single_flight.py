@@ -0,0 +1,108 @@
+"""Unit tests for single_flight utils"""
+import os
+import threading
+from unittest import TestCase, mock
+import unittest
+# pylint: disable = no-name-in-module,import-error,no-self-use,broad-except, C0413, C0411, C0330
+
+BASE_PATH = os.path.dirname(os.path.realpath(__file__))
+
+ARNS = [f"arn:aws:rds:us-east-1:123456789012:db:db-{i}" for i in range(3)]
+
+
+class TestSingleFlight(TestCase):
+
+    def test_snapshot(self):
+        """The snapshot has the tags after the leader's writes and survives the store encoding"""
+        from utils import ebs
+        from utils.single_flight import build_snapshot, current_tags, decode_snapshot, encode_snapshot
+        volumes = [ebs.volume_record('vol-1', {}), ebs.volume_record('vol-2', {'vpcx-skip-backup': 'true'})]
+        snapshot = build_snapshot(ARNS, [ARNS[2]], volumes, ['owner', 'vpcx-backup'],
+                                  {ARNS[0]: {'owner': 'old'}, ARNS[2]: {'owner': 'old'}},
+                                  {'owner': 'team', 'vpcx-backup': 'regular'}, {'vpcx-backup': 'regular'},
+                                  failed=[ARNS[1]])
+        snapshot = decode_snapshot(encode_snapshot(snapshot))
+        self.assertEqual(snapshot.tags, {ARNS[0]: {'owner': 'team', 'vpcx-backup': 'regular'},
+                                         ARNS[2]: {'owner': 'old'}})
+        self.assertEqual(snapshot.volumes[0].tags, {'owner': 'team', 'vpcx-backup': 'regular'})
+        self.assertEqual(snapshot.volumes[1].tags, {'vpcx-skip-backup': 'true'})
+
+        fetched = []
+        tags = current_tags(snapshot, ['owner', 'cost-center'],
+                            lambda keys: fetched.append(keys) or {ARNS[0]: {'cost-center': '42'}})
+        self.assertEqual(fetched, [['cost-center']])
+        self.assertEqual(tags[ARNS[0]], {'owner': 'team', 'vpcx-backup': 'regular', 'cost-center': '42'})
+        self.assertIs(current_tags(snapshot, ['owner']), snapshot.tags)
+
+    def test_follower_gets_the_snapshot_of_the_leader(self):
+        """A concurrent request waits for the leader and follows its snapshot"""
+        from utils import single_flight
+        from utils.stores import MemoryStore
+        store = MemoryStore()
+        leader = single_flight.join('itx-046', 'us-east-1', single_flight.DISCOVERY, store, wait_ms=5000)
+        self.assertEqual(leader.role, single_flight.LEADER)
+
+        followers = []
+        thread = threading.Thread(target=lambda: followers.append(single_flight.join(
+            'itx-046', 'us-east-1', single_flight.DISCOVERY, store, wait_ms=5000, poll_interval=0.01)))
+        thread.start()
+        leader.publish(single_flight.Snapshot(ARNS, [], [], {}, ['owner']))
+        leader.release()
+        thread.join()
+        self.assertEqual(followers[0].role, single_flight.FOLLOWER)
+        self.assertEqual(followers[0].snapshot.arns, ARNS)
+
+        # A follower that changed tags removes the snapshot, so the next request leads.
+        followers[0].invalidate()
+        followers[0].release()
+        next_request = single_flight.join('itx-046', 'us-east-1', single_flight.DISCOVERY, store)
+        self.assertEqual(next_request.role, single_flight.LEADER)
+        next_request.release()
+
+    def test_leader_without_snapshot(self):
+        """A follower leads when the leader leaves without a snapshot, and runs alone when the wait is over"""
+        from utils import single_flight
+        from utils.stores import MemoryStore
+        store = MemoryStore()
+        leader = single_flight.join('itx-046', 'us-east-1', single_flight.DISCOVERY, store)
+        followers = []
+        thread = threading.Thread(target=lambda: followers.append(single_flight.join(
+            'itx-046', 'us-east-1', single_flight.DISCOVERY, store, wait_ms=5000, poll_interval=0.01)))
+        thread.start()
+        leader.release()
+        thread.join()
+        self.assertEqual(followers[0].role, single_flight.LEADER)
+
+        # The lease of a leader in another container.
+        other = single_flight.join('itx-046', 'us-west-2', single_flight.DISCOVERY, store)
+        with single_flight._leaders_lock:
+            single_flight._leaders.clear()
+        alone = single_flight.join('itx-046', 'us-west-2', single_flight.DISCOVERY, store, wait_ms=50,
+                                   poll_interval=0.01)
+        self.assertEqual(alone.role, single_flight.ALONE)
+        followers[0].release()
+        other.release()
+
+    def test_discovery_operation(self):
+        """Only requests with the same backend and strict mode share a flight, and synchronous ones wait less"""
+        from utils import single_flight
+        from utils.stores import MemoryStore
+        store = MemoryStore()
+        leader = single_flight.join('itx-046', 'us-east-1', single_flight.discovery_operation('rgta'), store)
+        leader.publish(single_flight.Snapshot([], [], [], {}, []))
+        for backend, strict in [('services', False), ('rgta', True)]:
+            flight = single_flight.join('itx-046', 'us-east-1', single_flight.discovery_operation(backend, strict),
+                                        store)
+            self.assertEqual(flight.role, single_flight.LEADER)
+            flight.release()
+        follower = single_flight.join('itx-046', 'us-east-1', single_flight.discovery_operation('rgta'), store)
+        self.assertEqual(follower.role, single_flight.FOLLOWER)
+        leader.release()
+
+        with mock.patch.dict(os.environ, {'SINGLE_FLIGHT_SYNC_WAIT_MS': '15000'}):
+            self.assertEqual(single_flight.get_wait_ms(False), 15000)
+            self.assertEqual(single_flight.get_wait_ms(True), single_flight.DEFAULT_WAIT_MS)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+"""Unit tests for stores utils"""
+import os
+import time
+import tempfile
+from unittest import TestCase
+import unittest
+# pylint: disable = no-name-in-module,import-error,no-self-use,broad-except, C0413, C0411, C0330
+
+BASE_PATH = os.path.dirname(os.path.realpath(__file__))
+
+
+class TestStores(TestCase):
+
+    def check_store(self, store):
+        self.assertIsNone(store.get('job:1'))
+        store.put('job:1', {'status': 'pending'})
+        self.assertEqual(store.get('job:1'), {'status': 'pending'})
+        self.assertFalse(store.add('job:1', {'status': 'other'}))
+        self.assertEqual(store.update('job:1', {'progress': {'seen': 3}}),
+                         {'status': 'pending', 'progress': {'seen': 3}})
+        self.assertIsNone(store.update('job:2', {'status': 'running'}))
+        store.delete('job:1')
+        self.assertTrue(store.add('job:1', {'status': 'new'}))
+        self.assertEqual(store.get('job:1'), {'status': 'new'})
+
+        store.put('lease', {'owner': 'a'}, ttl=1)
+        self.assertFalse(store.add('lease', {'owner': 'b'}, ttl=1))
+        time.sleep(1.1)
+        self.assertIsNone(store.get('lease'))
+        self.assertTrue(store.add('lease', {'owner': 'b'}, ttl=1))
+
+    def test_memory_store(self):
+        """Entries kept in the container"""
+        from utils.stores import MemoryStore
+        self.check_store(MemoryStore())
+
+    def test_sqlite_store(self):
+        """Entries kept in a SQLite file are seen by other instances"""
+        from utils.stores import SQLiteStore
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'state.db')
+            self.check_store(SQLiteStore(path))
+            self.assertEqual(SQLiteStore(path).get('job:1'), {'status': 'new'})
+
+    def test_get_store(self):
+        """Stores are cached per URL"""
+        from utils.stores import get_store, MemoryStore
+        from utils.exceptions import InvalidInputException
+        self.assertIsInstance(get_store(), MemoryStore)
+        self.assertIs(get_store('memory://'), get_store())
+        with self.assertRaises(InvalidInputException):
+            get_store('redis://localhost')
+
+
+if __name__ == '__main__':
+    unittest.main()
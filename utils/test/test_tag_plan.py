@@ -0,0 +1,68 @@
+"""Unit tests for tag plan utils"""
+import os
+from unittest import TestCase
+import unittest
+# pylint: disable = no-name-in-module,import-error,no-self-use,broad-except, C0413, C0411, C0330
+
+BASE_PATH = os.path.dirname(os.path.realpath(__file__))
+
+ARNS = [
+    "arn:aws:rds:us-east-1:123456789012:db:db-1",
+    "arn:aws:rds:us-east-1:123456789012:db:db-2",
+    "arn:aws:rds:us-east-1:123456789012:db:db-3",
+    "arn:aws:rds:us-east-1:123456789012:db:db-4",
+]
+
+
+class TestTagPlan(TestCase):
+
+    def test_plan_tags(self):
+        """Resources are grouped by the tags they are missing, and the ones that carry all of them are left out"""
+        from utils.tag_plan import plan_tags
+        current_tags = {
+            ARNS[0]: {'owner': 'team', 'vpcx-backup': 'regular'},
+            ARNS[1]: {'owner': 'other-team', 'vpcx-backup': 'regular'},
+            ARNS[2]: {'vpcx-backup': 'regular'},
+        }
+        plan = plan_tags(ARNS, {'owner': 'team', 'vpcx-backup': 'regular'}, current_tags)
+        self.assertEqual(plan.groups, [({'owner': 'team'}, [ARNS[1], ARNS[2]]),
+                                       ({'owner': 'team', 'vpcx-backup': 'regular'}, [ARNS[3]])])
+        self.assertEqual((plan.sent, plan.avoided), (3, 1))
+
+    def test_plan_tags_full(self):
+        """Without the current tags every resource gets every tag"""
+        from utils.tag_plan import plan_tags
+        plan = plan_tags(ARNS, {'owner': 'team'})
+        self.assertEqual(plan.groups, [({'owner': 'team'}, ARNS)])
+        self.assertEqual(plan_tags(ARNS, {}).groups, [])
+
+    def test_plan_tag_sets(self):
+        """Resources in both tag sets get the merged tags in one write"""
+        from utils.tag_plan import plan_tag_sets
+        plan = plan_tag_sets([(ARNS, {'owner': 'team'}), (ARNS[:2], {'vpcx-backup': 'regular'})])
+        self.assertEqual(plan.groups, [({'owner': 'team', 'vpcx-backup': 'regular'}, ARNS[:2]),
+                                       ({'owner': 'team'}, ARNS[2:])])
+        self.assertEqual((plan.sent, plan.avoided), (4, 2))
+
+    def test_plan_untags(self):
+        """Keys are only removed from the resources that carry them, with the given value when there is one"""
+        from utils.tag_plan import plan_untags, summarize
+        current_tags = {
+            ARNS[0]: {'vpcx-backup': 'regular'},
+            ARNS[1]: {'vpcx-backup': 'legal-hold'},
+        }
+        plan = plan_untags(ARNS, ['vpcx-backup'], current_tags, values={'vpcx-backup': 'regular'})
+        self.assertEqual(plan.groups, [(['vpcx-backup'], [ARNS[0]])])
+        self.assertEqual(summarize([plan, plan_untags(ARNS, ['vpcx-backup'])]), {'sent': 5, 'avoided': 3})
+
+    def test_get_write_mode(self):
+        """The mode query string parameter overrides the default full mode"""
+        from utils.tag_plan import get_write_mode
+        from utils.exceptions import InvalidInputException
+        self.assertEqual(get_write_mode({'queryStringParameters': None}), 'full')
+        self.assertEqual(get_write_mode({'queryStringParameters': {'mode': 'diff'}}), 'diff')
+        self.assertRaises(InvalidInputException, get_write_mode, {'queryStringParameters': {'mode': 'fast'}})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+"""Unit tests for throttling utils"""
+import os
+from unittest import TestCase
+import unittest
+import botocore.exceptions
+# pylint: disable = no-name-in-module,import-error,no-self-use,broad-except, C0413, C0411, C0330
+
+BASE_PATH = os.path.dirname(os.path.realpath(__file__))
+
+
+def throttling_error(code='ThrottlingException'):
+    return botocore.exceptions.ClientError({'Error': {'Code': code, 'Message': 'Rate exceeded'}}, 'TagResources')
+
+
+class MockFlakyClient(object):
+    """Client whose tag_resources call is throttled a given number of times before succeeding"""
+
+    def __init__(self, throttles, code='ThrottlingException'):
+        self.throttles = throttles
+        self.code = code
+        self.calls = 0
+
+    def tag_resources(self, **kwargs):
+        self.calls += 1
+        if self.calls <= self.throttles:
+            raise throttling_error(self.code)
+        return {'FailedResourcesMap': {}}
+
+    def get_paginator(self, action):
+        return self
+
+    def paginate(self, **kwargs):
+        self.calls += 1
+        if self.calls <= self.throttles:
+            raise throttling_error(self.code)
+        return [{'Page': 1}, {'Page': 2}]
+
+
+class TestThrottling(TestCase):
+
+    def setUp(self):
+        os.environ['THROTTLE_BASE_DELAY'] = '0'
+
+    def tearDown(self):
+        del os.environ['THROTTLE_BASE_DELAY']
+
+    def test_controller_aimd(self):
+        """The limit grows additively on success and halves on throttle"""
+        from utils.throttling import AimdController
+        controller = AimdController(initial_limit=4, max_limit=8)
+        for _ in range(8):
+            controller.acquire()
+            controller.release(False)
+        self.assertEqual(controller.stats()['limit'], 5)
+        controller.acquire()
+        controller.release(True)
+        self.assertEqual(controller.stats()['limit'], 2)
+        self.assertEqual(controller.stats()['throttles'], 1)
+        for _ in range(5):
+            controller.acquire()
+            controller.release(True)
+        self.assertEqual(controller.stats()['limit'], 1)
+
+    def test_call_retries_throttled_calls(self):
+        """Throttled calls are retried and counted per account"""
+        from utils.throttling import call, register_client, get_stats
+        client = MockFlakyClient(throttles=2, code='RequestLimitExceeded')
+        register_client(client, 'test-retry-account')
+        self.assertEqual(call(client, 'tag_resources', ResourceARNList=[], Tags={}), {'FailedResourcesMap': {}})
+        self.assertEqual(client.calls, 3)
+        stats = get_stats('test-retry-account')
+        self.assertEqual(len(stats), 1)
+        self.assertEqual(stats[0]['api'], 'MockFlakyClient.tag_resources')
+        self.assertEqual(stats[0]['throttles'], 2)
+        self.assertEqual(stats[0]['successes'], 1)
+
+    def test_call_gives_up_after_max_attempts(self):
+        """The throttling error is raised once the attempts are exhausted"""
+        from utils.throttling import call
+        client = MockFlakyClient(throttles=100)
+        os.environ['THROTTLE_MAX_ATTEMPTS'] = '3'
+        try:
+            self.assertRaises(botocore.exceptions.ClientError, call, client, 'tag_resources')
+        finally:
+            del os.environ['THROTTLE_MAX_ATTEMPTS']
+        self.assertEqual(client.calls, 3)
+
+    def test_call_does_not_retry_other_errors(self):
+        """Errors other than throttling are raised straight away"""
+        from utils.throttling import call
+        client = MockFlakyClient(throttles=1, code='InvalidParameterException')
+        self.assertRaises(botocore.exceptions.ClientError, call, client, 'tag_resources')
+        self.assertEqual(client.calls, 1)
+
+    def test_paginate_retries_first_page(self):
+        """A throttled first page is retried"""
+        from utils.throttling import paginate
+        client = MockFlakyClient(throttles=1)
+        self.assertEqual(list(paginate(client, 'get_resources')), [{'Page': 1}, {'Page': 2}])
+
+    def test_is_throttle_error(self):
+        from utils.throttling import is_throttle_error
+        self.assertTrue(is_throttle_error(throttling_error()))
+        self.assertFalse(is_throttle_error(throttling_error('AccessDenied')))
+        self.assertFalse(is_throttle_error(ValueError()))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+"""Unit tests for token cache utils"""
+import os
+import json
+import time
+import base64
+from unittest import TestCase
+import unittest
+# pylint: disable = no-name-in-module,import-error,no-self-use,broad-except, C0413, C0411, C0330
+
+BASE_PATH = os.path.dirname(os.path.realpath(__file__))
+
+
+def make_token(exp):
+    def encode(data):
+        return base64.urlsafe_b64encode(json.dumps(data).encode()).decode().rstrip('=')
+    return f"Bearer {encode({'alg': 'RS256'})}.{encode({'exp': exp, 'aud': 'example'})}.signature"
+
+
+class MockTokenGenerator(object):
+    """Returns a new token that expires after expires_in seconds on every call"""
+
+    def __init__(self, expires_in):
+        self.expires_in = expires_in
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return make_token(int(time.time()) + self.expires_in)
+
+
+class TestTokenCache(TestCase):
+
+    def test_token_expiry(self):
+        """Test reading the exp claim of a bearer token"""
+        from utils.token_cache import token_expiry
+        self.assertEqual(token_expiry(make_token(1600000000)), 1600000000)
+        self.assertEqual(token_expiry(make_token(1600000000)[len('Bearer '):]), 1600000000)
+        self.assertIsNone(token_expiry('not-a-jwt'))
+        self.assertIsNone(token_expiry(None))
+
+    def test_get_reuses_token_until_expiry(self):
+        """A token is generated again only when it is within the margin of its expiry"""
+        from utils.token_cache import TokenCache
+        cache = TokenCache(expiry_margin=300)
+        generator = MockTokenGenerator(expires_in=3600)
+        token = cache.get('client-id', 'scope', generator)
+        self.assertEqual(cache.get('client-id', 'scope', generator), token)
+        self.assertEqual(generator.calls, 1)
+        cache.get('client-id', 'other-scope', generator)
+        self.assertEqual(generator.calls, 2)
+
+        expiring = MockTokenGenerator(expires_in=60)
+        cache.get('client-id', 'expiring-scope', expiring)
+        cache.get('client-id', 'expiring-scope', expiring)
+        self.assertEqual(expiring.calls, 2)
+
+    def test_invalidate(self):
+        from utils.token_cache import TokenCache
+        cache = TokenCache()
+        generator = MockTokenGenerator(expires_in=3600)
+        cache.get('client-id', 'scope', generator)
+        cache.invalidate('client-id', 'scope')
+        cache.get('client-id', 'scope', generator)
+        self.assertEqual(generator.calls, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
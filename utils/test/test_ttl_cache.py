@@ -0,0 +1,46 @@
+"""Unit tests for ttl cache utils"""
+import os
+import time
+import tempfile
+from unittest import TestCase
+import unittest
+# pylint: disable = no-name-in-module,import-error,no-self-use,broad-except, C0413, C0411, C0330
+
+BASE_PATH = os.path.dirname(os.path.realpath(__file__))
+
+
+class TestTTLCache(TestCase):
+
+    def test_get_or_set_until_expiry(self):
+        """Values are computed again once they expire"""
+        from utils.ttl_cache import TTLCache
+        cache = TTLCache(ttl=0.05)
+        computed = []
+
+        def compute():
+            computed.append(1)
+            return ['us-east-1']
+
+        self.assertEqual(cache.get_or_set('regions:123456789012', compute), ['us-east-1'])
+        self.assertEqual(cache.get_or_set('regions:123456789012', compute), ['us-east-1'])
+        self.assertEqual(len(computed), 1)
+        time.sleep(0.06)
+        self.assertIsNone(cache.get('regions:123456789012'))
+        cache.get_or_set('regions:123456789012', compute)
+        self.assertEqual(len(computed), 2)
+
+    def test_persistence(self):
+        """Entries written by one cache are read by another one using the same file"""
+        from utils.ttl_cache import TTLCache
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'cache.json')
+            TTLCache(ttl=60, persist_path=path).set('caller_role:itx-000:sts', ['role-arn', '123456789012'])
+            self.assertEqual(TTLCache(ttl=60, persist_path=path).get('caller_role:itx-000:sts'),
+                             ['role-arn', '123456789012'])
+            with open(path, 'w') as cache_file:
+                cache_file.write('not json')
+            self.assertIsNone(TTLCache(ttl=60, persist_path=path).get('caller_role:itx-000:sts'))
+
+
+if __name__ == '__main__':
+    unittest.main()
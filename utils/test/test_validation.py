@@ -0,0 +1,72 @@
+"""Unit tests for validation utils"""
+import os
+import json
+from unittest import TestCase
+import unittest
+# pylint: disable = no-name-in-module,import-error,no-self-use,broad-except, C0413, C0411, C0330
+
+BASE_PATH = os.path.dirname(os.path.realpath(__file__))
+
+STORAGE_PATH = {'account-id': 'itx-046', 'region-name': 'us-east-1', 'resource-type': 'storage'}
+EXCEPTION_PATH = {'account-id': 'itx-046', 'region-name': 'us-east-1', 'exception-action': 'enable'}
+
+
+class TestValidation(TestCase):
+
+    def test_validate_storage_request(self):
+        """The vpcx-backup tag is split from the tag list"""
+        from utils.validation import validate_storage_request, StorageRequest
+        request = validate_storage_request({'pathParameters': STORAGE_PATH,
+                                            'body': json.dumps({'owner': 'team a', 'vpcx-backup': 'regular'})})
+        self.assertEqual(request, StorageRequest('itx-046', 'us-east-1', {'owner': 'team a'},
+                                                 {'vpcx-backup': 'regular'}))
+
+    def test_validate_storage_request_rejects(self):
+        """Invalid paths, bodies and tags are rejected"""
+        from utils.validation import validate_storage_request
+        from utils.exceptions import InvalidInputException, InvalidRegionException
+        invalid_bodies = [
+            None,
+            'not json',
+            '[]',
+            '{}',
+            json.dumps({'aws:owner': 'x'}),
+            json.dumps({'owner': ''}),
+            json.dumps({'owner': 1}),
+            json.dumps({'owner': 'a' * 257}),
+            json.dumps({'k' * 129: 'x'}),
+            json.dumps({'owner': 'semi;colon'}),
+            json.dumps({'vpcx-backup': 'legal-hold'}),
+            json.dumps({f'key{i}': 'value' for i in range(51)}),
+        ]
+        for body in invalid_bodies:
+            with self.assertRaises(InvalidInputException, msg=body):
+                validate_storage_request({'pathParameters': STORAGE_PATH, 'body': body})
+        with self.assertRaises(InvalidInputException):
+            validate_storage_request({'pathParameters': dict(STORAGE_PATH, **{'resource-type': 'compute'}),
+                                      'body': '{"owner": "x"}'})
+        with self.assertRaises(InvalidRegionException):
+            validate_storage_request({'pathParameters': dict(STORAGE_PATH, **{'region-name': 'invalid_region'}),
+                                      'body': '{"owner": "x"}'})
+
+    def test_validate_exception_request(self):
+        """Volume ids and ARNs are checked for their format"""
+        from utils.validation import validate_exception_request
+        from utils.exceptions import InvalidInputException
+        arn = 'arn:aws:rds:us-east-1:123456789012:db:database-1'
+        request = validate_exception_request({'pathParameters': EXCEPTION_PATH,
+                                              'body': json.dumps({'volume_ids': ['vol-012ea34a439822303'],
+                                                                  'resource_arns': [arn]})})
+        self.assertEqual((request.action, request.volume_ids, request.resource_arns),
+                         ('enable', ['vol-012ea34a439822303'], [arn]))
+        for body in ['{}', '{"volume_ids": ["volume-1"]}', '{"resource_arns": ["database-1"]}',
+                     '{"resource_arns": "arn"}']:
+            with self.assertRaises(InvalidInputException, msg=body):
+                validate_exception_request({'pathParameters': EXCEPTION_PATH, 'body': body})
+        with self.assertRaises(InvalidInputException):
+            validate_exception_request({'pathParameters': dict(EXCEPTION_PATH, **{'exception-action': 'pause'}),
+                                        'body': json.dumps({'resource_arns': [arn]})})
+
+
+if __name__ == '__main__':
+    unittest.main()
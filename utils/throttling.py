@@ -0,0 +1,263 @@
+"""Throttle-aware adaptive concurrency for AWS calls.
+
+Every (account, region, API) gets an AIMD controller: the number of calls allowed in flight grows by about one for
+every ``limit`` successful calls and is halved whenever AWS throttles a call. Throttled calls are retried after a
+full-jitter exponential backoff. Successful responses that botocore only got after its own retries
+(``ResponseMetadata.RetryAttempts``) count as throttles too, so the limit also backs off when botocore absorbs them.
+
+The helpers in this package make their AWS calls through ``call`` and ``paginate``.
+"""
+import os
+import time
+import random
+import logging
+import threading
+import weakref
+
+import botocore.exceptions
+
+logger = logging.getLogger()
+
+THROTTLE_ERROR_CODES = frozenset([
+    'Throttling',
+    'ThrottlingException',
+    'ThrottledException',
+    'RequestThrottled',
+    'RequestThrottledException',
+    'RequestLimitExceeded',
+    'TooManyRequestsException',
+    'ProvisionedThroughputExceededException',
+    'SlowDown',
+])
+
+DEFAULT_INITIAL_LIMIT = 4
+DEFAULT_MIN_LIMIT = 1
+DEFAULT_MAX_LIMIT = 32
+DEFAULT_MAX_ATTEMPTS = 6
+DEFAULT_BASE_DELAY = 0.2
+DEFAULT_MAX_DELAY = 10.0
+
+_controllers = {}
+_controllers_lock = threading.Lock()
+_client_accounts = weakref.WeakKeyDictionary()
+
+
+class AimdController(object):
+    """Additive-increase/multiplicative-decrease limit on the number of in-flight calls to one API."""
+
+    def __init__(self, initial_limit=None, min_limit=DEFAULT_MIN_LIMIT, max_limit=None):
+        self.min_limit = min_limit
+        self.max_limit = max_limit or int(os.environ.get('THROTTLE_MAX_LIMIT', DEFAULT_MAX_LIMIT))
+        self.limit = float(initial_limit or int(os.environ.get('THROTTLE_INITIAL_LIMIT', DEFAULT_INITIAL_LIMIT)))
+        self.in_flight = 0
+        self.successes = 0
+        self.throttles = 0
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        """Block until a call can be started under the current limit."""
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                self._condition.wait()
+            self.in_flight += 1
+
+    def release(self, throttled):
+        """Finish a call and adjust the limit.
+
+        Args:
+            throttled (bool): Whether AWS throttled the call
+        """
+        with self._condition:
+            self.in_flight -= 1
+            if throttled:
+                self.throttles += 1
+                self.limit = max(float(self.min_limit), self.limit / 2)
+            else:
+                self.successes += 1
+                self.limit = min(float(self.max_limit), self.limit + 1 / self.limit)
+            self._condition.notify_all()
+
+    def stats(self):
+        """Return the current limit and counters."""
+        with self._condition:
+            return {
+                'limit': int(self.limit),
+                'in_flight': self.in_flight,
+                'successes': self.successes,
+                'throttles': self.throttles
+            }
+
+
+def register_client(client, account):
+    """Record the account a client is authenticated for, so its calls are keyed by account.
+
+    Args:
+        client: boto3 client
+        account: The account id or name the client's credentials belong to
+    """
+    _client_accounts[client] = account
+
+
+def get_controller(account, region, api):
+    """Get the controller for an (account, region, API), creating it on first use."""
+    key = (account, region, api)
+    with _controllers_lock:
+        if key not in _controllers:
+            _controllers[key] = AimdController()
+        return _controllers[key]
+
+
+def _controller_for(client, operation):
+    meta = getattr(client, 'meta', None)
+    region = getattr(meta, 'region_name', None) or 'global'
+    service_model = getattr(meta, 'service_model', None)
+    service = getattr(service_model, 'service_name', None) or type(client).__name__
+    try:
+        account = _client_accounts.get(client, 'unknown')
+    except TypeError:
+        account = 'unknown'
+    return get_controller(account, region, f"{service}.{operation}")
+
+
+def is_throttle_error(err):
+    """Check whether an exception is an AWS throttling error."""
+    if not isinstance(err, botocore.exceptions.ClientError):
+        return False
+    return err.response.get('Error', {}).get('Code') in THROTTLE_ERROR_CODES
+
+
+def backoff_delay(attempt):
+    """Full-jitter exponential backoff for the given retry attempt (starting at 0)."""
+    base = float(os.environ.get('THROTTLE_BASE_DELAY', DEFAULT_BASE_DELAY))
+    cap = float(os.environ.get('THROTTLE_MAX_DELAY', DEFAULT_MAX_DELAY))
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def _was_retried(response):
+    if not isinstance(response, dict):
+        return False
+    return response.get('ResponseMetadata', {}).get('RetryAttempts', 0) > 0
+
+
+def call(client, operation, **kwargs):
+    """Call a client operation under its controller, retrying throttled calls with backoff.
+
+    Args:
+        client: boto3 client
+        operation: The client method name, e.g. 'tag_resources'
+        kwargs: The operation parameters
+
+    Returns:
+        The operation response
+
+    Raises:
+        ClientError: Error from boto3, or the throttling error once THROTTLE_MAX_ATTEMPTS is exhausted.
+    """
+    controller = _controller_for(client, operation)
+    max_attempts = int(os.environ.get('THROTTLE_MAX_ATTEMPTS', DEFAULT_MAX_ATTEMPTS))
+    attempt = 0
+    while True:
+        controller.acquire()
+        try:
+            response = getattr(client, operation)(**kwargs)
+        except botocore.exceptions.ClientError as err:
+            throttled = is_throttle_error(err)
+            controller.release(throttled)
+            attempt += 1
+            if not throttled or attempt >= max_attempts:
+                raise
+            delay = backoff_delay(attempt)
+            logger.info(f"{operation} throttled, retrying in {delay:.2f} s (attempt {attempt})")
+            time.sleep(delay)
+            continue
+        except Exception:
+            controller.release(False)
+            raise
+        controller.release(_was_retried(response))
+        return response
+
+
+def paginate(client, operation, **kwargs):
+    """Iterate over the pages of a paginated operation, fetching each page under its controller.
+
+    A throttling error on the first page is retried with backoff. Later pages cannot be resumed without
+    re-reading the earlier ones, so a throttling error there (raised after botocore's own retries) is raised.
+
+    Args:
+        client: boto3 client
+        operation: The paginated client method name, e.g. 'describe_volumes'
+        kwargs: The operation parameters
+
+    Yields:
+        The response pages
+
+    Raises:
+        ClientError: Error from boto3.
+    """
+    controller = _controller_for(client, operation)
+    max_attempts = int(os.environ.get('THROTTLE_MAX_ATTEMPTS', DEFAULT_MAX_ATTEMPTS))
+    attempt = 0
+    while True:
+        pages = None
+        first_page = True
+        while True:
+            controller.acquire()
+            try:
+                if pages is None:
+                    pages = iter(client.get_paginator(operation).paginate(**kwargs))
+                page = next(pages)
+            except StopIteration:
+                controller.release(False)
+                return
+            except botocore.exceptions.ClientError as err:
+                throttled = is_throttle_error(err)
+                controller.release(throttled)
+                attempt += 1
+                if not (throttled and first_page) or attempt >= max_attempts:
+                    raise
+                delay = backoff_delay(attempt)
+                logger.info(f"{operation} throttled, retrying in {delay:.2f} s (attempt {attempt})")
+                time.sleep(delay)
+                break
+            except Exception:
+                controller.release(False)
+                raise
+            controller.release(_was_retried(page))
+            first_page = False
+            yield page
+
+
+def count_calls(account):
+    """Count the calls made so far to every API of an account, throttled ones included.
+
+    The counters are per container, so a request measures what it uses as the difference between two counts.
+    """
+    with _controllers_lock:
+        controllers = [controller for (controller_account, _, _), controller in _controllers.items()
+                       if controller_account == account]
+    total = 0
+    for controller in controllers:
+        stats = controller.stats()
+        total += stats['successes'] + stats['throttles']
+    return total
+
+
+def get_stats(account=None):
+    """Export the current limit and counters of every controller.
+
+    Args:
+        account: Only return the controllers of this account
+
+    Returns:
+        list: One dict per controller with account, region, api, limit, in_flight, successes and throttles
+    """
+    with _controllers_lock:
+        items = list(_controllers.items())
+    stats = []
+    for (controller_account, region, api), controller in sorted(items, key=lambda item: item[0]):
+        if account is not None and controller_account != account:
+            continue
+        entry = {'account': controller_account, 'region': region, 'api': api}
+        entry.update(controller.stats())
+        stats.append(entry)
+    return stats
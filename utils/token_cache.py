@@ -0,0 +1,79 @@
+"""Warm-container cache of Azure AD bearer tokens.
+
+Tokens are kept per (client_id, scope) until TOKEN_EXPIRY_MARGIN seconds before they expire. The expiry is read from
+the ``exp`` claim of the JWT; tokens that cannot be decoded are kept for DEFAULT_TTL seconds.
+"""
+import os
+import json
+import time
+import base64
+import threading
+
+DEFAULT_EXPIRY_MARGIN = 300
+# Azure AD access tokens are valid for 60 to 90 minutes.
+DEFAULT_TTL = 3600
+
+
+def token_expiry(token):
+    """Read the expiry of a JWT bearer token without verifying it.
+
+    Args:
+        token (str): The token, with or without the leading 'Bearer '
+
+    Returns:
+        float: The ``exp`` claim in epoch seconds, or None when the token is not a JWT with an ``exp`` claim
+    """
+    if not token:
+        return None
+    if token.lower().startswith('bearer '):
+        token = token[len('bearer '):]
+    parts = token.split('.')
+    if len(parts) != 3:
+        return None
+    payload = parts[1] + '=' * (-len(parts[1]) % 4)
+    try:
+        claims = json.loads(base64.urlsafe_b64decode(payload.encode()).decode())
+        return float(claims['exp'])
+    except (ValueError, KeyError, TypeError):
+        return None
+
+
+class TokenCache(object):
+    """Bearer tokens per (client_id, scope)."""
+
+    def __init__(self, expiry_margin=None):
+        self.expiry_margin = expiry_margin if expiry_margin is not None else int(
+            os.environ.get('TOKEN_EXPIRY_MARGIN', DEFAULT_EXPIRY_MARGIN))
+        self._tokens = {}
+        self._lock = threading.Lock()
+
+    def get(self, client_id, scope, fetch):
+        """Get a token, calling fetch only when there is no cached token that is still valid.
+
+        Args:
+            client_id: The Azure AD client id
+            scope: The scope of the token
+            fetch: Callable returning a new token
+
+        Returns:
+            str: The bearer token
+        """
+        key = (client_id, scope)
+        with self._lock:
+            entry = self._tokens.get(key)
+        if entry is not None and time.time() < entry[1] - self.expiry_margin:
+            return entry[0]
+
+        token = fetch()
+        expires_at = token_expiry(token) or time.time() + DEFAULT_TTL
+        with self._lock:
+            self._tokens[key] = (token, expires_at)
+        return token
+
+    def invalidate(self, client_id=None, scope=None):
+        """Forget a cached token, or all of them when client_id is None."""
+        with self._lock:
+            if client_id is None:
+                self._tokens.clear()
+            else:
+                self._tokens.pop((client_id, scope), None)
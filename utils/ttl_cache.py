@@ -0,0 +1,90 @@
+"""Small thread-safe TTL cache with optional persistence to a JSON file.
+
+Warm invocations of a Lambda container share the in-memory entries. With a ``persist_path`` under /tmp, the entries
+also survive a restart of the runtime process (e.g. after a timeout), as /tmp is kept by the execution environment.
+Keys must be strings and values must be JSON serialisable.
+"""
+import os
+import json
+import time
+import logging
+import threading
+
+logger = logging.getLogger()
+
+
+class TTLCache(object):
+    """Entries expire ``ttl`` seconds after they are set."""
+
+    def __init__(self, ttl, persist_path=None):
+        self.ttl = ttl
+        self.persist_path = persist_path
+        self._entries = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._entries is not None:
+            return
+        self._entries = {}
+        if not self.persist_path or not os.path.exists(self.persist_path):
+            return
+        try:
+            with open(self.persist_path) as cache_file:
+                self._entries = {key: tuple(entry) for key, entry in json.load(cache_file).items()}
+        except (OSError, ValueError) as err:
+            logger.info(f"Ignoring unreadable cache file {self.persist_path}: {err}")
+
+    def _save(self):
+        if not self.persist_path:
+            return
+        tmp_path = f"{self.persist_path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, 'w') as cache_file:
+                json.dump(self._entries, cache_file)
+            os.replace(tmp_path, self.persist_path)
+        except OSError as err:
+            logger.info(f"Could not write cache file {self.persist_path}: {err}")
+
+    def get(self, key):
+        """Get the value of a key, or None when it is missing or expired."""
+        with self._lock:
+            self._load()
+            entry = self._entries.get(key)
+            if entry is None or entry[1] <= time.time():
+                return None
+            return entry[0]
+
+    def set(self, key, value):
+        """Set the value of a key."""
+        with self._lock:
+            self._load()
+            now = time.time()
+            self._entries = {k: entry for k, entry in self._entries.items() if entry[1] > now}
+            self._entries[key] = (value, now + self.ttl)
+            self._save()
+
+    def get_or_set(self, key, compute):
+        """Get the value of a key, computing and storing it when it is missing or expired.
+
+        Args:
+            key (str): The key
+            compute: Callable returning the value
+
+        Returns:
+            The cached or computed value
+        """
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            self.set(key, value)
+        return value
+
+    def invalidate(self, key=None):
+        """Drop one key, or every entry when key is None."""
+        with self._lock:
+            self._load()
+            if key is None:
+                self._entries = {}
+            else:
+                self._entries.pop(key, None)
+            self._save()
@@ -0,0 +1,157 @@
+"""Request validation shared by the handlers.
+
+Every check here works on the API Gateway event alone, so the handlers run it first and reject an invalid request
+before any call to AWS or to vpcxiam. The patterns are compiled once per container.
+"""
+import re
+import json
+from collections import namedtuple
+
+from utils.arn_router import parse_arn
+from utils.exceptions import InvalidInputException, InvalidRegionException
+
+# Limits of the AWS tagging APIs.
+MAX_TAG_KEY_LENGTH = 128
+MAX_TAG_VALUE_LENGTH = 256
+MAX_TAGS_PER_RESOURCE = 50
+RESERVED_TAG_PREFIX = 'aws:'
+# Letters, numbers and spaces representable in UTF-8, and + - = . _ : / @
+TAG_PATTERN = re.compile(r'^[\w +\-=.:/@]*$', re.UNICODE)
+
+ACCOUNT_PATTERN = re.compile(r'^[A-Za-z0-9][A-Za-z0-9._-]{0,63}$')
+REGION_PATTERN = re.compile(r'^[a-z]{2}(-[a-z]+)+-\d{1,2}$')
+VOLUME_ID_PATTERN = re.compile(r'^vol-[0-9a-f]{8,17}$')
+
+VPCX_BACKUP_TAG_KEY = 'vpcx-backup'
+VALID_VPCX_BACKUP_VALUES = ('regular',)
+EXCEPTION_ACTIONS = ('enable', 'disable')
+
+StorageRequest = namedtuple('StorageRequest', ['account', 'region', 'tag_list', 'vpcx_backup_tag'])
+ExceptionRequest = namedtuple('ExceptionRequest', ['account', 'region', 'action', 'volume_ids', 'resource_arns'])
+
+
+def validate_path(event):
+    """Check the account and region path parameters.
+
+    Returns:
+        tuple: (account, region)
+
+    Raises:
+        InvalidInputException: The account is missing or malformed
+        InvalidRegionException: The region is missing or malformed
+    """
+    path_params = event.get('pathParameters') or {}
+    account = path_params.get('account-id')
+    region = path_params.get('region-name')
+    if not isinstance(account, str) or not ACCOUNT_PATTERN.match(account):
+        raise InvalidInputException("Please enter a valid account in the url path")
+    if not isinstance(region, str) or not REGION_PATTERN.match(region):
+        raise InvalidRegionException("Please enter a valid region in the url path")
+    return account, region
+
+
+def parse_body(event):
+    """Parse the JSON object in the request body.
+
+    Raises:
+        InvalidInputException: The body is missing, is not JSON or is not a JSON object
+    """
+    try:
+        body = json.loads(event.get('body') or '')
+    except ValueError:
+        raise InvalidInputException("The request body should be a JSON object")
+    if not isinstance(body, dict):
+        raise InvalidInputException("The request body should be a JSON object")
+    return body
+
+
+def validate_tags(tags):
+    """Check the tags against the limits of the AWS tagging APIs.
+
+    Args:
+        tags (dict): The tags of the request, vpcx-backup included
+
+    Raises:
+        InvalidInputException: A key or value is not a string, is too long, has characters AWS does not accept, a key
+            is empty or starts with aws:, a value is empty, or there are more than 50 tags
+    """
+    if len(tags) > MAX_TAGS_PER_RESOURCE:
+        raise InvalidInputException(f"At most {MAX_TAGS_PER_RESOURCE} tags can be applied to a resource")
+    empty_value_keys = []
+    for key, value in tags.items():
+        if not key or len(key) > MAX_TAG_KEY_LENGTH or not TAG_PATTERN.match(key):
+            raise InvalidInputException(f"Invalid tag key {key!r}. Tag keys should have 1 to {MAX_TAG_KEY_LENGTH} "
+                                        f"letters, numbers, spaces or + - = . _ : / @")
+        if key.lower().startswith(RESERVED_TAG_PREFIX):
+            raise InvalidInputException(f"Invalid tag key {key!r}. The {RESERVED_TAG_PREFIX} prefix is reserved "
+                                        f"for AWS")
+        if not isinstance(value, str) or len(value) > MAX_TAG_VALUE_LENGTH or not TAG_PATTERN.match(value):
+            raise InvalidInputException(f"Invalid value for the tag key {key!r}. Tag values should be strings of up "
+                                        f"to {MAX_TAG_VALUE_LENGTH} letters, numbers, spaces or + - = . _ : / @")
+        if value == "":
+            empty_value_keys.append(key)
+    if empty_value_keys:
+        raise InvalidInputException(f"The request body has empty values for the these tagKeys: {empty_value_keys}."
+                                    f"Tag values should be non-empty")
+
+
+def validate_storage_request(event):
+    """Validate a put-storage-tags request.
+
+    Returns:
+        StorageRequest: The account and region, the tag list of the body and the vpcx-backup tag, empty when the body
+        has none
+
+    Raises:
+        InvalidInputException: The request is invalid
+        InvalidRegionException: The region is missing or malformed
+    """
+    path_params = event.get('pathParameters') or {}
+    if path_params.get('resource-type') != 'storage':
+        raise InvalidInputException("resource type should be storage")
+    account, region = validate_path(event)
+    tag_list = parse_body(event)
+    if not tag_list:
+        raise InvalidInputException("No tag key-values present in the request body.")
+    validate_tags(tag_list)
+
+    vpcx_backup_tag = {}
+    if VPCX_BACKUP_TAG_KEY in tag_list:
+        vpcx_backup_tag[VPCX_BACKUP_TAG_KEY] = tag_list.pop(VPCX_BACKUP_TAG_KEY)
+        if vpcx_backup_tag[VPCX_BACKUP_TAG_KEY] not in VALID_VPCX_BACKUP_VALUES:
+            raise InvalidInputException(f"Allowed values for the vpcx-backup tag are: "
+                                        f"[{', '.join(VALID_VPCX_BACKUP_VALUES)}]")
+    return StorageRequest(account, region, tag_list, vpcx_backup_tag)
+
+
+def validate_exception_request(event):
+    """Validate a backup exception request.
+
+    Returns:
+        ExceptionRequest: The account, region and action, and the volume ids and resource ARNs of the body
+
+    Raises:
+        InvalidInputException: The request is invalid
+        InvalidRegionException: The region is missing or malformed
+    """
+    path_params = event.get('pathParameters') or {}
+    action = path_params.get('exception-action')
+    if action not in EXCEPTION_ACTIONS:
+        raise InvalidInputException("exception-action should be enable or disable")
+    account, region = validate_path(event)
+    body = parse_body(event)
+    volume_ids = body.get('volume_ids') or []
+    resource_arns = body.get('resource_arns') or []
+    if not isinstance(volume_ids, list) or not isinstance(resource_arns, list):
+        raise InvalidInputException("volume_ids and resource_arns should be lists")
+    if len(volume_ids) == 0 and len(resource_arns) == 0:
+        raise InvalidInputException("Either resource_arns or volume_ids have to be included in the request body")
+
+    invalid_volume_ids = [volume_id for volume_id in volume_ids
+                          if not isinstance(volume_id, str) or not VOLUME_ID_PATTERN.match(volume_id)]
+    if invalid_volume_ids:
+        raise InvalidInputException(f"Invalid volume ids in the request body: {invalid_volume_ids}")
+    invalid_arns = [arn for arn in resource_arns if parse_arn(arn) is None]
+    if invalid_arns:
+        raise InvalidInputException(f"Invalid resource arns in the request body: {invalid_arns}")
+    return ExceptionRequest(account, region, action, volume_ids, resource_arns)